@@ -17,6 +17,99 @@ document.addEventListener('DOMContentLoaded', () => {
         chatDisplay.scrollTop = chatDisplay.scrollHeight; // Scroll to bottom
     }; 
 
+    // Non-streaming fallback for browsers without readable fetch bodies.
+    const fetchAnswer = async (query) => {
+        const response = await fetch(`/api/chat/${encodeURIComponent(query)}`);
+        if (!response.ok) {
+            throw new Error(`HTTP error! status: ${response.status}`);
+        }
+        const data = await response.json();
+        addMessageToChat('ai', data.response || 'No specific response received.'); // Assuming Flask returns { "response": "..." }
+    };
+
+    // Streams the answer from /api/chat_stream (Server-Sent Events), appending tokens as they arrive.
+    const streamAnswer = async (query) => {
+        const started = performance.now();
+        const response = await fetch(`/api/chat_stream/${encodeURIComponent(query)}`, {
+            headers: { 'Accept': 'text/event-stream' },
+        });
+        if (response.status === 429) {
+            const data = await response.json();
+            addMessageToChat('ai', data.response || 'The assistant is busy, please try again shortly.');
+            return;
+        }
+        if (!response.ok) {
+            throw new Error(`HTTP error! status: ${response.status}`);
+        }
+        if (!response.body || !response.body.getReader) {
+            return fetchAnswer(query);
+        }
+
+        const messageElement = document.createElement('div');
+        messageElement.classList.add('chat-message', 'ai-message');
+        messageElement.innerHTML = '<strong>AI:</strong> ';
+        const answer = document.createElement('span');
+        answer.style.whiteSpace = 'pre-wrap';
+        messageElement.appendChild(answer);
+        chatDisplay.appendChild(messageElement);
+
+        let sources = [];
+        let firstTokenMs = null;
+        const handleEvent = (event, data) => {
+            if (event === 'sources') {
+                sources = data;
+            } else if (event === 'error') {
+                answer.textContent += `\n${data.message}`;
+            } else if (event === 'done') {
+                console.info(`Chat answer: first token ${firstTokenMs} ms (server ${data.ttft_ms} ms), total ${data.total_ms} ms`);
+                if (sources.length > 0) {
+                    const sourcesElement = document.createElement('div');
+                    sourcesElement.classList.add('chat-sources');
+                    sourcesElement.textContent = 'Sources: ' + sources.map(s => {
+                        const more = (s.occurrence_count || 1) - 1;
+                        return `${s.file_path} (${s.procedure_name})` + (more > 0 ? ` +${more} more` : '')
+                            + (s.via ? ` [via ${s.via}]` : '');
+                    }).join(', ');
+                    messageElement.appendChild(sourcesElement);
+                }
+            } else if (data.token) {
+                if (firstTokenMs === null) {
+                    firstTokenMs = Math.round(performance.now() - started);
+                }
+                answer.textContent += data.token;
+            }
+            chatDisplay.scrollTop = chatDisplay.scrollHeight;
+        };
+
+        const reader = response.body.getReader();
+        const decoder = new TextDecoder();
+        let buffer = '';
+        while (true) {
+            const { value, done } = await reader.read();
+            if (done) {
+                break;
+            }
+            buffer += decoder.decode(value, { stream: true });
+            // Events are separated by a blank line; the last piece may still be incomplete.
+            const frames = buffer.split('\n\n');
+            buffer = frames.pop();
+            for (const frame of frames) {
+                let event = null;
+                let data = '';
+                for (const line of frame.split('\n')) {
+                    if (line.startsWith('event: ')) {
+                        event = line.slice(7);
+                    } else if (line.startsWith('data: ')) {
+                        data += line.slice(6);
+                    }
+                }
+                if (data) {
+                    handleEvent(event, JSON.parse(data));
+                }
+            }
+        }
+    };
+
     // Handle sending query
     sendQueryButton.addEventListener('click', async () => {
         try {
@@ -28,12 +121,7 @@ document.addEventListener('DOMContentLoaded', () => {
             addMessageToChat('user', query);
             userQueryInput.value = ''; // Clear input
 
-            const response = await fetch(`/api/chat/${encodeURIComponent(query)}`);
-            if (!response.ok) {
-                throw new Error(`HTTP error! status: ${response.status}`);
-            }
-            const data = await response.json();
-            addMessageToChat('ai', data.response || 'No specific response received.'); // Assuming Flask returns { "response": "..." }
+            await streamAnswer(query);
         } catch (error) {
             console.error('Error in sendQueryButton click handler:', error);
             addMessageToChat('ai', `A critical JavaScript error occurred: ${error.message}`);
@@ -0,0 +1,176 @@
+"""Offline app benchmarks: retrieval latency and /chat requests/sec by concurrency, written to JSON.
+
+The LLM and embeddings are replaced by the local fakes (LLM_FAKE_LATENCY_SEC and
+EMBED_FAKE_LATENCY_SEC), so no Google API is called. Retrieval runs against the benchmark
+vector database that `ingestion/bench_ingestion.py` loads (BENCH_VECTOR_DB_NAME, default
+palantir_bench), and chat history goes to a separate, migrated app database
+(BENCH_APP_DB_NAME, default palantir_bench_app), so neither real database is touched.
+
+Usage: python bench_app.py [--concurrency 1 4 16] [--requests 200] [--llm-latency 0.5]
+                           [--output bench-app.json]
+"""
+import argparse
+import json
+import os
+import platform
+import sys
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timezone
+from urllib.parse import quote
+
+from retrieval import LRUCache
+
+QUERIES = (
+    "What does ip-0001-0 do?",
+    "How are order totals calculated?",
+    "Which programs read the customer table?",
+    "Explain prog/p0003.p",
+    "Where is dTotal001 defined?",
+    "How does the window initialise its temp-table lines?",
+    "Which procedures run ip-proc-0?",
+    "Show me the invoice posting code",
+)
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))] if ordered else 0.0
+
+def latency_summary(seconds):
+    return {
+        'count': len(seconds),
+        'mean_ms': round(sum(seconds) / max(len(seconds), 1) * 1000, 2),
+        'p50_ms': round(percentile(seconds, 0.5) * 1000, 2),
+        'p95_ms': round(percentile(seconds, 0.95) * 1000, 2),
+        'max_ms': round(max(seconds, default=0.0) * 1000, 2),
+    }
+
+def ensure_database(name, host, database, user, password):
+    """Creates database `name` on the server of the given one if it does not exist."""
+    import psycopg2
+    conn = psycopg2.connect(host=host, database=database, user=user, password=password)
+    conn.autocommit = True
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SELECT 1 FROM pg_database WHERE datname = %s;", (name,))
+            if cur.fetchone() is None:
+                cur.execute(f'CREATE DATABASE "{name}";')
+    finally:
+        conn.close()
+
+def configure(args):
+    """Points the app at the benchmark databases and fakes; must run before importing main."""
+    ensure_database(
+        args.app_database, os.getenv('APP_DB_HOST', 'app_db'), os.getenv('APP_DB_NAME', 'palantir_app_db'),
+        os.getenv('APP_DB_USER', 'palantir_user'), os.getenv('APP_DB_PASSWORD'),
+    )
+    os.environ.update({
+        'APP_DB_NAME': args.app_database,
+        'VECTOR_DB_NAME': args.vector_database,
+        'LLM_FAKE_LATENCY_SEC': str(args.llm_latency),
+        'EMBED_FAKE_LATENCY_SEC': str(args.embed_latency),
+        'EMBEDDING_CACHE_PATH': '',
+        'LLM_CACHE_PERSISTENT': '0',
+        'SESSION_STORE': 'memory',
+        'LOG_LEVEL': os.getenv('LOG_LEVEL', 'WARNING'),
+    })
+    os.environ.pop('APP_DATABASE_URL', None)
+    os.environ.pop('VECTOR_DATABASE_URL', None)
+
+def bench_retrieval(main, rounds):
+    """retriever.search latency with a cold, then a warm query embedding cache."""
+    results = {}
+    for phase in ('cold', 'warm'):
+        if phase == 'cold':
+            main.retriever.query_cache = LRUCache(main.retriever.query_cache.maxsize)
+        seconds = []
+        for _ in range(rounds):
+            for query in QUERIES:
+                started = time.perf_counter()
+                main.retriever.search(query)
+                seconds.append(time.perf_counter() - started)
+        results[phase] = latency_summary(seconds)
+    return results
+
+def bench_chat(main, concurrency, requests_per_level):
+    """Sends distinct (uncacheable) questions to /chat from `concurrency` threads."""
+    statuses = Counter()
+    seconds = []
+    lock = threading.Lock()
+    counter = iter(range(requests_per_level))
+
+    def worker():
+        client = main.app.test_client()
+        while True:
+            with lock:
+                n = next(counter, None)
+            if n is None:
+                return
+            query = quote(f"{QUERIES[n % len(QUERIES)]} (request {n})")
+            started = time.perf_counter()
+            response = client.get(f"/chat/{query}?nocache=1")
+            elapsed = time.perf_counter() - started
+            with lock:
+                statuses[response.status_code] += 1
+                seconds.append(elapsed)
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall = time.perf_counter() - started
+    return {
+        'concurrency': concurrency,
+        'requests': requests_per_level,
+        'seconds': round(wall, 3),
+        'requests_per_sec': round(requests_per_level / wall, 2),
+        'ok_per_sec': round(statuses[200] / wall, 2),
+        'statuses': {str(code): count for code, count in sorted(statuses.items())},
+        'latency': latency_summary(seconds),
+    }
+
+def write_results(path, benchmark, params, results):
+    document = {
+        'benchmark': benchmark,
+        'started_at': datetime.now(timezone.utc).isoformat(),
+        'python': sys.version.split()[0],
+        'platform': platform.platform(),
+        'params': params,
+        'results': results,
+    }
+    with open(path, 'w') as f:
+        json.dump(document, f, indent=2)
+    print(json.dumps(results, indent=2))
+    print(f"Results written to {path}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 4, 16])
+    parser.add_argument('--requests', type=int, default=200, help="/chat requests per concurrency level.")
+    parser.add_argument('--retrieval-rounds', type=int, default=10)
+    parser.add_argument('--llm-latency', type=float, default=0.5)
+    parser.add_argument('--embed-latency', type=float, default=0.05)
+    parser.add_argument('--vector-database', default=os.getenv('BENCH_VECTOR_DB_NAME', 'palantir_bench'))
+    parser.add_argument('--app-database', default=os.getenv('BENCH_APP_DB_NAME', 'palantir_bench_app'))
+    parser.add_argument('--output', default='bench-app.json')
+    args = parser.parse_args()
+
+    configure(args)
+    import main as app_main
+    from flask_migrate import upgrade
+    with app_main.app.app_context():
+        upgrade()
+
+    results = {
+        'retrieval': bench_retrieval(app_main, args.retrieval_rounds),
+        'chat': [bench_chat(app_main, level, args.requests) for level in args.concurrency],
+        'llm_gate': app_main.llm_gate.stats(),
+    }
+    app_main.history_writer.close()
+    write_results(args.output, 'app', vars(args), results)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,100 @@
+# app/db.py
+import os
+from contextlib import contextmanager
+
+from flask_migrate import Migrate
+from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import text
+from sqlalchemy.engine import URL
+
+db = SQLAlchemy()
+migrate = Migrate()
+
+def database_url(prefix, default_host, default_name, default_user):
+    """Builds a SQLAlchemy URL from the <prefix>_HOST/_NAME/_USER/_PASSWORD env vars."""
+    return URL.create(
+        "postgresql+psycopg2",
+        username=os.environ.get(f"{prefix}_USER", default_user),
+        password=os.environ.get(f"{prefix}_PASSWORD"),
+        host=os.environ.get(f"{prefix}_HOST", default_host),
+        database=os.environ.get(f"{prefix}_NAME", default_name),
+    ).render_as_string(hide_password=False)
+
+def init_db(app):
+    """Configures one pooled engine per database (app_db by default, vector_db as the 'vector' bind).
+
+    Engines are created once per gunicorn worker when it imports the app and connect lazily.
+    Connections are pinged on checkout, so one that died with a database restart is
+    replaced instead of failing a request, and recycled after DB_POOL_RECYCLE_SEC.
+    """
+    pool_options = {
+        'pool_pre_ping': True,
+        'max_overflow': int(os.getenv('DB_POOL_MAX_OVERFLOW', '5')),
+        'pool_timeout': int(os.getenv('DB_POOL_TIMEOUT_SEC', '10')),
+        'pool_recycle': int(os.getenv('DB_POOL_RECYCLE_SEC', '1800')),
+    }
+    app.config['SQLALCHEMY_DATABASE_URI'] = os.getenv('APP_DATABASE_URL') or database_url(
+        "APP_DB", "app_db", "palantir_app_db", "palantir_user"
+    )
+    # SQLALCHEMY_ENGINE_OPTIONS only applies to the default engine, so binds repeat them.
+    app.config['SQLALCHEMY_BINDS'] = {
+        'vector': {
+            'url': os.getenv('VECTOR_DATABASE_URL') or database_url(
+                "VECTOR_DB", "vector_db", "palantir_vector_db", "palantir_vector_user"
+            ),
+            'pool_size': int(os.getenv('VECTOR_DB_POOL_SIZE', '10')),
+            **pool_options,
+        },
+    }
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {
+        'pool_size': int(os.getenv('APP_DB_POOL_SIZE', '5')),
+        **pool_options,
+    }
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    db.init_app(app)
+    migrate.init_app(app, db)
+    with app.app_context():
+        return EnginePool(db.engine), EnginePool(db.engines['vector'])
+
+class EnginePool:
+    """Lends raw psycopg2 connections from a SQLAlchemy engine's pool.
+
+    The retrieval, upload and cache code is written against psycopg2 cursors; this gives it
+    the engine's pooling (size limits, pre-ping, recycling) without an ORM layer. Waiting
+    for a connection longer than pool_timeout raises sqlalchemy.exc.TimeoutError.
+    """
+
+    def __init__(self, engine):
+        self.engine = engine
+
+    @contextmanager
+    def connection(self):
+        conn = self.engine.raw_connection()
+        try:
+            yield conn
+        except Exception:
+            if getattr(conn.dbapi_connection, 'closed', True):
+                conn.invalidate()
+            else:
+                try:
+                    conn.rollback()
+                except Exception:
+                    conn.invalidate()
+            raise
+        finally:
+            # Returns the connection to the pool (or discards it if invalidated).
+            conn.close()
+
+    def ping(self):
+        """Runs SELECT 1 on a pooled connection."""
+        with self.engine.connect() as conn:
+            return conn.execute(text("SELECT 1")).scalar()
+
+    def status(self):
+        pool = self.engine.pool
+        return {
+            'size': pool.size(),
+            'checked_out': pool.checkedout(),
+            'checked_in': pool.checkedin(),
+            'overflow': pool.overflow(),
+        }
@@ -0,0 +1,45 @@
+# app/fake_llm.py
+import threading
+import time
+
+class FakeMessage:
+    def __init__(self, content):
+        self.content = content
+
+class FakeChatModel:
+    """A stand-in for the chat model with configurable latency and no network access.
+
+    invoke() sleeps for `latency` seconds and returns a canned answer mentioning the
+    question; stream() yields the same answer in `tokens` pieces spread over the same time,
+    after `first_token_latency`. Set LLM_FAKE_LATENCY_SEC to run the app against it.
+    """
+
+    def __init__(self, latency=1.0, first_token_latency=None, tokens=20):
+        self.latency = latency
+        self.first_token_latency = latency / 4 if first_token_latency is None else first_token_latency
+        self.tokens = max(1, tokens)
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def _answer(self, messages):
+        question = messages[-1].content if messages else ""
+        return f"Fake answer to: {question[-200:]}"
+
+    def invoke(self, messages):
+        with self._lock:
+            self.calls += 1
+        time.sleep(self.latency)
+        return FakeMessage(self._answer(messages))
+
+    def stream(self, messages):
+        with self._lock:
+            self.calls += 1
+        answer = self._answer(messages)
+        size = max(1, -(-len(answer) // self.tokens))
+        pieces = [answer[i:i + size] for i in range(0, len(answer), size)]
+        time.sleep(self.first_token_latency)
+        interval = max(0.0, self.latency - self.first_token_latency) / max(1, len(pieces) - 1)
+        for i, piece in enumerate(pieces):
+            if i:
+                time.sleep(interval)
+            yield FakeMessage(piece)
@@ -0,0 +1,86 @@
+# app/history_writer.py
+import logging
+import queue
+import threading
+import time
+from datetime import datetime, timezone
+
+logger = logging.getLogger(__name__)
+
+_STOP = object()
+
+class HistoryWriter:
+    """Records chat turns from a background thread, in batches, off the request path.
+
+    submit() only enqueues (and drops the turn if the bounded queue is full, rather than
+    slow the request down). The writer thread hands `write_batch` up to `batch_size` rows
+    at a time, as soon as a batch is full or `flush_interval` seconds after its first row,
+    and close() flushes whatever is left.
+    """
+
+    def __init__(self, write_batch, max_queue=10_000, batch_size=100, flush_interval=1.0):
+        self.write_batch = write_batch
+        self.batch_size = max(1, batch_size)
+        self.flush_interval = flush_interval
+        self._queue = queue.Queue(max_queue)
+        self.written = 0
+        self.dropped = 0
+        self.batches = 0
+        self.errors = 0
+        self._thread = threading.Thread(target=self._run, name="history-writer", daemon=True)
+        self._thread.start()
+
+    def submit(self, session_id, user_message, bot_response):
+        row = (session_id, user_message, bot_response, datetime.now(timezone.utc))
+        try:
+            self._queue.put_nowait(row)
+        except queue.Full:
+            self.dropped += 1
+
+    def _run(self):
+        batch = []
+        deadline = None
+        while True:
+            timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+            try:
+                row = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                row = None
+            if row is _STOP:
+                self._flush(batch)
+                return
+            if row is not None:
+                if not batch:
+                    deadline = time.monotonic() + self.flush_interval
+                batch.append(row)
+            if batch and (len(batch) >= self.batch_size or time.monotonic() >= deadline):
+                self._flush(batch)
+                batch = []
+                deadline = None
+
+    def _flush(self, batch):
+        if not batch:
+            return
+        try:
+            self.write_batch(batch)
+            self.written += len(batch)
+            self.batches += 1
+        except Exception as e:
+            self.errors += 1
+            logger.error(f"Error writing {len(batch)} chat history rows: {e}")
+
+    def close(self, timeout=10):
+        """Flushes queued turns and stops the writer thread."""
+        if not self._thread.is_alive():
+            return
+        self._queue.put(_STOP)
+        self._thread.join(timeout)
+
+    def stats(self):
+        return {
+            'queued': self._queue.qsize(),
+            'written': self.written,
+            'batches': self.batches,
+            'dropped': self.dropped,
+            'errors': self.errors,
+        }
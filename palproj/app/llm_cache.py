@@ -0,0 +1,142 @@
+# app/llm_cache.py
+import hashlib
+import json
+import logging
+import re
+import threading
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+_SPACE_RE = re.compile(r'\s+')
+
+def normalize_query(query):
+    """Lowercases and collapses whitespace so trivially different spellings share an entry."""
+    return _SPACE_RE.sub(' ', query).strip().lower().rstrip('?!. ')
+
+def cache_key(query, system_prompt, context, model):
+    """Key for one answer: the normalized query plus a hash of everything else the LLM saw."""
+    surroundings = hashlib.sha256(
+        json.dumps([system_prompt, context, model]).encode('utf-8')
+    ).hexdigest()
+    return hashlib.sha256(f"{normalize_query(query)}\x00{surroundings}".encode('utf-8')).hexdigest()
+
+class PostgresAnswerStore:
+    """Persistent answer tier in app_db's llm_answer_cache table (see migrations).
+
+    `pool` is the app_db db.EnginePool. Database errors are logged and treated as a miss,
+    so an unavailable app_db only costs the persistent tier.
+    """
+
+    def __init__(self, pool):
+        self.pool = pool
+
+    def get(self, key):
+        try:
+            with self.pool.connection() as conn:
+                with conn.cursor() as cur:
+                    cur.execute(
+                        "SELECT answer FROM llm_answer_cache WHERE cache_key = %s AND expires_at > NOW();",
+                        (key,)
+                    )
+                    row = cur.fetchone()
+                conn.commit()
+            return row[0] if row else None
+        except Exception as e:
+            logger.error(f"Error reading LLM answer cache: {e}")
+            return None
+
+    def put(self, key, answer, model, ttl):
+        try:
+            with self.pool.connection() as conn:
+                with conn.cursor() as cur:
+                    cur.execute("""
+                        INSERT INTO llm_answer_cache (cache_key, answer, model, created_at, expires_at)
+                        VALUES (%s, %s, %s, NOW(), NOW() + make_interval(secs => %s))
+                        ON CONFLICT (cache_key) DO UPDATE
+                        SET answer = EXCLUDED.answer, created_at = EXCLUDED.created_at, expires_at = EXCLUDED.expires_at;
+                    """, (key, answer, model, ttl))
+                conn.commit()
+        except Exception as e:
+            logger.error(f"Error writing LLM answer cache: {e}")
+
+    def delete(self, key):
+        try:
+            with self.pool.connection() as conn:
+                with conn.cursor() as cur:
+                    cur.execute("DELETE FROM llm_answer_cache WHERE cache_key = %s OR expires_at <= NOW();", (key,))
+                conn.commit()
+        except Exception as e:
+            logger.error(f"Error invalidating LLM answer cache: {e}")
+
+class AnswerCache:
+    """Caches LLM answers in an in-process LRU with a TTL, optionally backed by a shared store.
+
+    Lookups try the process's own LRU first, then the store (whose hits are copied into the
+    LRU); new answers go to both. Entries expire `ttl` seconds after they were stored.
+    """
+
+    def __init__(self, maxsize=512, ttl=24 * 3600, store=None, model=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.store = store
+        self.model = model
+        self.hits = 0
+        self.store_hits = 0
+        self.misses = 0
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._items.get(key)
+            if entry is not None:
+                answer, expires_at = entry
+                if expires_at > now:
+                    self._items.move_to_end(key)
+                    self.hits += 1
+                    return answer
+                del self._items[key]
+        answer = self.store.get(key) if self.store else None
+        with self._lock:
+            if answer is None:
+                self.misses += 1
+                return None
+            self.store_hits += 1
+        # The remaining TTL is unknown here; keep it locally for at most a full TTL.
+        self._remember(key, answer)
+        return answer
+
+    def put(self, key, answer):
+        self._remember(key, answer)
+        if self.store:
+            self.store.put(key, answer, self.model, self.ttl)
+
+    def invalidate(self, key):
+        with self._lock:
+            self._items.pop(key, None)
+        if self.store:
+            self.store.delete(key)
+
+    def _remember(self, key, answer):
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._items[key] = (answer, time.monotonic() + self.ttl)
+            self._items.move_to_end(key)
+            while len(self._items) > self.maxsize:
+                self._items.popitem(last=False)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.store_hits + self.misses
+            return {
+                'size': len(self._items),
+                'hits': self.hits,
+                'store_hits': self.store_hits,
+                'misses': self.misses,
+                'hit_ratio': round((self.hits + self.store_hits) / lookups, 3) if lookups else 0.0,
+                'persistent': self.store is not None,
+            }
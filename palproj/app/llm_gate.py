@@ -0,0 +1,185 @@
+# app/llm_gate.py
+import math
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+class Overloaded(Exception):
+    """Raised when an LLM call cannot be admitted; retry_after is a hint in seconds."""
+
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+class SingleFlight:
+    """Shares one call among concurrent callers asking for the same key.
+
+    The first caller for a key runs the function; callers arriving while it runs wait and
+    get the same result (or the same exception) instead of starting their own call.
+    """
+
+    class _Call:
+        def __init__(self):
+            self.done = threading.Event()
+            self.result = None
+            self.error = None
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self.leaders = 0
+        self.coalesced = 0
+
+    def do(self, key, fn):
+        """Returns (result, shared); shared is True when another caller's call was reused."""
+        with self._lock:
+            call = self._calls.get(key)
+            if call is None:
+                call = self._calls[key] = self._Call()
+                self.leaders += 1
+                leader = True
+            else:
+                self.coalesced += 1
+                leader = False
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+
+        try:
+            call.result = fn()
+            return call.result, False
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+class AdmissionController:
+    """Caps concurrent upstream calls, with a bounded queue of callers waiting for a slot.
+
+    At most `max_concurrent` callers hold a slot; up to `max_queue` more wait for one, for
+    at most `queue_timeout` seconds, and are admitted first come, first served. Anyone
+    beyond that, or who waits too long, gets Overloaded with a Retry-After estimate based
+    on recent call durations.
+    """
+
+    def __init__(self, max_concurrent=4, max_queue=16, queue_timeout=30.0, history=1000):
+        self.max_concurrent = max(1, max_concurrent)
+        self.max_queue = max(0, max_queue)
+        self.queue_timeout = queue_timeout
+        self._lock = threading.Lock()
+        self._waiters = deque()  # one Event per queued caller, set when it is handed a slot
+        self.in_flight = 0
+        self.waiting = 0
+        self.max_waiting = 0
+        self.admitted = 0
+        self.rejected = 0
+        self.timed_out = 0
+        self._wait_times = deque(maxlen=history)
+        self._service_times = deque(maxlen=history)
+
+    def acquire(self):
+        """Takes a slot, waiting in the queue if needed; returns the time waited in seconds.
+
+        Waiters are served in arrival order: a released slot is handed straight to the
+        oldest waiter, so a caller arriving just then cannot take it first.
+        """
+        started = time.monotonic()
+        with self._lock:
+            if self.in_flight < self.max_concurrent and not self._waiters:
+                self.in_flight += 1
+                return self._admitted(started)
+            if self.waiting >= self.max_queue:
+                self.rejected += 1
+                raise Overloaded("LLM queue is full.", self._retry_after())
+            waiter = threading.Event()
+            self._waiters.append(waiter)
+            self.waiting += 1
+            self.max_waiting = max(self.max_waiting, self.waiting)
+        granted = waiter.wait(self.queue_timeout)
+        with self._lock:
+            if not granted and not waiter.is_set():
+                # Still queued: give up the place in line.
+                self._waiters.remove(waiter)
+                self.waiting -= 1
+                self.timed_out += 1
+                raise Overloaded("Timed out waiting for an LLM slot.", self._retry_after())
+            # release() counted the slot as ours and took us off the queue.
+            return self._admitted(started)
+
+    def _admitted(self, started):
+        self.admitted += 1
+        waited = time.monotonic() - started
+        self._wait_times.append(waited)
+        return waited
+
+    def release(self, service_time=None):
+        with self._lock:
+            if service_time is not None:
+                self._service_times.append(service_time)
+            if self._waiters:
+                # The slot passes to the oldest waiter without ever being free.
+                self.waiting -= 1
+                self._waiters.popleft().set()
+            else:
+                self.in_flight -= 1
+
+    @contextmanager
+    def admit(self):
+        self.acquire()
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.release(time.monotonic() - started)
+
+    def _retry_after(self):
+        # Roughly how long until everyone already queued has been served.
+        average = sum(self._service_times) / len(self._service_times) if self._service_times else 1.0
+        return max(1, math.ceil(average * (self.waiting + 1) / self.max_concurrent))
+
+    def stats(self):
+        with self._lock:
+            waits = sorted(self._wait_times)
+            return {
+                'max_concurrent': self.max_concurrent,
+                'max_queue': self.max_queue,
+                'in_flight': self.in_flight,
+                'queue_depth': self.waiting,
+                'max_queue_depth': self.max_waiting,
+                'admitted': self.admitted,
+                'rejected': self.rejected,
+                'timed_out': self.timed_out,
+                'wait_ms_p50': round(waits[len(waits) // 2] * 1000, 1) if waits else 0.0,
+                'wait_ms_p95': round(waits[min(len(waits) - 1, int(len(waits) * 0.95))] * 1000, 1) if waits else 0.0,
+            }
+
+class LLMGate:
+    """Single-flight plus admission control in front of an LLM.
+
+    Identical requests in flight share one upstream call, and only the call that actually
+    goes upstream takes an admission slot.
+    """
+
+    def __init__(self, admission, single_flight=None):
+        self.admission = admission
+        self.single_flight = single_flight or SingleFlight()
+
+    def call(self, key, fn):
+        """Returns (result, shared) for fn(), coalesced by key and admitted by the controller."""
+        def admitted():
+            with self.admission.admit():
+                return fn()
+        return self.single_flight.do(key, admitted)
+
+    def stats(self):
+        stats = self.admission.stats()
+        stats['upstream_calls'] = self.single_flight.leaders
+        stats['coalesced'] = self.single_flight.coalesced
+        return stats
@@ -1,15 +1,35 @@
 # app/main.py
 
 import logging
-from flask import Flask, request, jsonify, send_from_directory, session
-from flask_session import Session  # Import Flask-Session
+from flask import Flask, request, jsonify, session, Response, send_file, stream_with_context
+import io
 import os
 from dotenv import load_dotenv
 import uuid
+import json
+import time
+import atexit
+from datetime import datetime
 
-from langchain_google_genai import ChatGoogleGenerativeAI
+from psycopg2.extras import execute_values
+
+from langchain_google_genai import ChatGoogleGenerativeAI, GoogleGenerativeAIEmbeddings
 from langchain.schema import HumanMessage, SystemMessage
 
+from db import init_db
+from embedding_cache import CachedEmbeddings, open_embedding_cache
+from retrieval import VectorRetriever, source_list, RETRIEVAL_TOP_K
+from llm_cache import AnswerCache, PostgresAnswerStore, cache_key
+from llm_gate import AdmissionController, LLMGate, Overloaded
+from fake_llm import FakeChatModel
+from fake_embeddings import FakeEmbeddings
+from upload_index import UploadIndex, decode_upload
+from prompt_builder import ConversationMemory, PromptBudget
+from history_writer import HistoryWriter
+from metrics import CONTENT_TYPE, Registry
+from session_store import (MemoryStore, PostgresStore, QuotaExceeded, StoreSessionInterface, Sweeper,
+                           sweep_legacy_upload_dir)
+
 load_dotenv()
 
 app = Flask(__name__)
@@ -17,12 +37,7 @@ app = Flask(__name__)
 # --- Session Configuration ---
 # Secret key for signing the session cookie
 app.config['SECRET_KEY'] = os.getenv('FLASK_SECRET_KEY', 'super-secret-key-for-dev')
-# Configure session to use the filesystem (server-side)
-app.config['SESSION_TYPE'] = 'filesystem'
-app.config['SESSION_FILE_DIR'] = './flask_session'  # Directory to store session files
-app.config['SESSION_PERMANENT'] = False
-app.config['SESSION_USE_SIGNER'] = True
-Session(app)
+# Sessions themselves are kept server side; see "Session and Upload Store" below.
 # --- END Session Configuration ---
 
 # --- Configure Logging ---
@@ -42,21 +57,213 @@ logging.basicConfig(
 app.logger.setLevel(log_level)
 # --- END Configure Logging ---
 
-app.config['SQLALCHEMY_DATABASE_URI'] = os.getenv('APP_DATABASE_URL')
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+# --- Metrics ---
+# Prometheus text format at /metrics, per worker process. Request latency by route, and
+# time per stage of answering a question: session_read/session_write, query_embedding,
+# lexical_search, vector_search, upload_search, prompt_assembly, llm (whole answer),
+# llm_first_token (streaming), history_write, upload_store and upload_index.
+metrics = Registry()
+REQUEST_SECONDS = metrics.histogram(
+    'palantir_http_request_duration_seconds', 'Time until the response is returned to the server.',
+    ['method', 'route', 'status']
+)
+STAGE_SECONDS = metrics.histogram('palantir_stage_duration_seconds', 'Time spent in one stage of a request.', ['stage'])
+STAGE_ERRORS = metrics.counter('palantir_stage_errors_total', 'Errors raised by a stage.', ['stage'])
+LLM_GATE = metrics.gauge('palantir_llm_gate', 'LLM admission control state (see /llm_stats).', ['field'])
+DB_POOL = metrics.gauge('palantir_db_pool_connections', 'Pooled database connections.', ['database', 'state'])
+HISTORY_WRITER = metrics.gauge('palantir_history_writer', 'Background chat history writer counters.', ['field'])
+CACHE = metrics.gauge('palantir_cache', 'Answer and query embedding cache counters.', ['cache', 'field'])
+
+def stage_timer(stage):
+    return STAGE_SECONDS.time(stage=stage)
+
+@app.before_request
+def start_request_timer():
+    request.environ['palantir.started'] = time.perf_counter()
+
+@app.after_request
+def observe_request(response):
+    started = request.environ.get('palantir.started')
+    if started is not None:
+        # Streamed responses are observed when streaming starts; see the llm stage for the rest.
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        REQUEST_SECONDS.observe(time.perf_counter() - started, method=request.method, route=route,
+                                status=response.status_code)
+    return response
+# --- END Metrics ---
+
+# --- Database Pools ---
+# One pooled engine per database per worker; everything that talks to app_db or vector_db
+# borrows connections from these.
+app_db_pool, vector_db_pool = init_db(app)
+# --- END Database Pools ---
+
+# --- Session and Upload Store ---
+# SESSION_STORE=memory keeps sessions and uploaded files in this process (one app
+# container only); SESSION_STORE=postgres keeps them in app_db, shared by all replicas.
+# Sessions expire SESSION_TTL_SEC after their last request, and their uploads with them.
+SESSION_TTL_SEC = int(os.getenv('SESSION_TTL_SEC', str(24 * 3600)))
+UPLOAD_SESSION_QUOTA_BYTES = int(os.getenv('UPLOAD_SESSION_QUOTA_MB', '20')) * 1024 * 1024
+UPLOAD_TOTAL_QUOTA_BYTES = int(os.getenv('UPLOAD_TOTAL_QUOTA_MB', '1024')) * 1024 * 1024
+if os.getenv('SESSION_STORE', 'memory') == 'postgres':
+    store = PostgresStore(app_db_pool, UPLOAD_SESSION_QUOTA_BYTES, UPLOAD_TOTAL_QUOTA_BYTES)
+else:
+    store = MemoryStore(UPLOAD_SESSION_QUOTA_BYTES, UPLOAD_TOTAL_QUOTA_BYTES)
+# A session that is cleared is deleted with its uploads, and their chunks in vector_db
+# (upload_index is set up further down).
+app.session_interface = StoreSessionInterface(
+    store, SESSION_TTL_SEC, timer=stage_timer, on_delete=lambda session_id: upload_index.clear(session_id)
+)
+
+# Files written to the old uploads/ directory are no longer read; clear them out too.
+UPLOAD_FOLDER = 'uploads'
+
+def sweep_store():
+    sessions, uploads = store.sweep()
+    legacy = sweep_legacy_upload_dir(UPLOAD_FOLDER, SESSION_TTL_SEC)
+    if sessions or uploads or legacy:
+        app.logger.info(f"Swept {sessions} expired sessions, {uploads} orphaned uploads and {legacy} old upload files.")
+
+store_sweeper = Sweeper(sweep_store, int(os.getenv('SESSION_SWEEP_INTERVAL_SEC', '300')))
+# --- END Session and Upload Store ---
 
 google_api_key = os.getenv("GOOGLE_API_KEY")
 
 if not google_api_key or google_api_key == "your_google_api_key_here":
     app.logger.error("GOOGLE_API_KEY is not configured. LLM calls will fail.")
 
-llm = ChatGoogleGenerativeAI(model="gemini-1.5-flash", google_api_key=google_api_key)
+LLM_MODEL = "gemini-1.5-flash"
+# LLM_FAKE_LATENCY_SEC swaps in a local fake model, for load and latency testing without the API.
+LLM_FAKE_LATENCY_SEC = os.getenv('LLM_FAKE_LATENCY_SEC')
+if LLM_FAKE_LATENCY_SEC:
+    llm = FakeChatModel(latency=float(LLM_FAKE_LATENCY_SEC))
+    app.logger.warning(f"Using the fake LLM with {LLM_FAKE_LATENCY_SEC}s latency.")
+else:
+    llm = ChatGoogleGenerativeAI(model=LLM_MODEL, google_api_key=google_api_key)
+
+# --- LLM Admission Control ---
+# Identical in-flight questions share one LLM call, at most LLM_MAX_CONCURRENT calls run at
+# once and up to LLM_MAX_QUEUE more wait (for LLM_QUEUE_TIMEOUT_SEC at most, below nginx's
+# 60s proxy timeout); beyond that requests get 429 with Retry-After.
+llm_gate = LLMGate(AdmissionController(
+    max_concurrent=int(os.getenv('LLM_MAX_CONCURRENT', '4')),
+    max_queue=int(os.getenv('LLM_MAX_QUEUE', '16')),
+    queue_timeout=float(os.getenv('LLM_QUEUE_TIMEOUT_SEC', '30')),
+))
+# --- END LLM Admission Control ---
 
 COLLECTION_NAME = "qad_code_embeddings"
 
-UPLOAD_FOLDER = 'uploads'
-if not os.path.exists(UPLOAD_FOLDER):
-    os.makedirs(UPLOAD_FOLDER)
+# --- Code Retrieval ---
+EMBEDDING_MODEL = "models/embedding-001"
+embedding_cache = open_embedding_cache(
+    os.getenv('EMBEDDING_CACHE_PATH', ''), int(os.getenv('EMBEDDING_CACHE_MAX_MB', '2048'))
+)
+# EMBED_FAKE_LATENCY_SEC swaps in deterministic local embeddings (the same ones ingestion
+# uses with that setting), for benchmarks without the API.
+EMBED_FAKE_LATENCY_SEC = os.getenv('EMBED_FAKE_LATENCY_SEC')
+if EMBED_FAKE_LATENCY_SEC:
+    query_embeddings = FakeEmbeddings(latency=float(EMBED_FAKE_LATENCY_SEC))
+    app.logger.warning(f"Using fake embeddings with {EMBED_FAKE_LATENCY_SEC}s latency.")
+else:
+    query_embeddings = GoogleGenerativeAIEmbeddings(model=EMBEDDING_MODEL, google_api_key=google_api_key)
+if embedding_cache:
+    query_embeddings = CachedEmbeddings(query_embeddings, embedding_cache, EMBEDDING_MODEL)
+
+retriever = VectorRetriever(query_embeddings, vector_db_pool, timer=stage_timer)
+# --- END Code Retrieval ---
+
+# --- LLM Answer Cache ---
+# Repeated questions over the same context are answered from here instead of the LLM.
+# The persistent tier (app_db table llm_answer_cache, created by the migrations) is shared
+# by all workers and survives restarts; add ?nocache=1 to bypass the cache for a request,
+# or ?refresh=1 to replace the cached answer.
+answer_store = None
+if os.getenv('LLM_CACHE_PERSISTENT', '0') == '1':
+    answer_store = PostgresAnswerStore(app_db_pool)
+answer_cache = AnswerCache(
+    maxsize=int(os.getenv('LLM_CACHE_SIZE', '512')),
+    ttl=int(os.getenv('LLM_CACHE_TTL_SEC', str(24 * 3600))),
+    store=answer_store,
+    model=LLM_MODEL,
+)
+# --- END LLM Answer Cache ---
+
+# --- Uploaded Context ---
+# Uploads are chunked and embedded into vector_db's upload_chunks table, per session, and
+# stay searchable until UPLOAD_TTL_SEC after the session last asked a question.
+UPLOAD_TOP_K = int(os.getenv('UPLOAD_TOP_K', '5'))
+UPLOAD_TTL_SEC = int(os.getenv('UPLOAD_TTL_SEC', str(24 * 3600)))
+UPLOAD_MAX_BYTES = int(os.getenv('UPLOAD_MAX_MB', '5')) * 1024 * 1024
+upload_index = UploadIndex(vector_db_pool, query_embeddings, ttl=UPLOAD_TTL_SEC)
+try:
+    upload_index.create_table()
+except Exception as e:
+    # Retried by the first upload or search that needs the table.
+    app.logger.error(f"Could not create the upload_chunks table: {e}")
+# --- END Uploaded Context ---
+
+# --- Prompt Assembly ---
+# PROMPT_TOKEN_BUDGET caps the (estimated) prompt size, and with it per-request LLM time;
+# HISTORY_TURNS recent question/answer pairs per session are offered to the prompt.
+prompt_budget = PromptBudget(budget_tokens=int(os.getenv('PROMPT_TOKEN_BUDGET', '8000')))
+conversation_memory = ConversationMemory(max_turns=int(os.getenv('HISTORY_TURNS', '3')))
+# --- END Prompt Assembly ---
+
+# --- Chat History ---
+# Turns are written to app_db's chat_history table in batches by a background thread.
+def write_chat_history(rows):
+    with stage_timer('history_write'), app_db_pool.connection() as conn:
+        with conn.cursor() as cur:
+            execute_values(
+                cur,
+                "INSERT INTO chat_history (session_id, user_message, bot_response, timestamp) VALUES %s;",
+                rows
+            )
+        conn.commit()
+
+history_writer = HistoryWriter(
+    write_chat_history,
+    max_queue=int(os.getenv('HISTORY_QUEUE_SIZE', '10000')),
+    batch_size=int(os.getenv('HISTORY_BATCH_SIZE', '100')),
+    flush_interval=float(os.getenv('HISTORY_FLUSH_INTERVAL_SEC', '1.0')),
+)
+atexit.register(history_writer.close)
+
+def fetch_history_page(session_id, limit, before=None):
+    """Newest-first turns of a session older than the `before` (timestamp, id) cursor."""
+    sql = "SELECT id, user_message, bot_response, timestamp FROM chat_history WHERE session_id = %s"
+    params = [session_id]
+    if before:
+        sql += " AND (timestamp, id) < (%s, %s)"
+        params.extend(before)
+    sql += " ORDER BY timestamp DESC, id DESC LIMIT %s;"
+    params.append(limit)
+    with app_db_pool.connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(sql, params)
+            rows = cur.fetchall()
+        conn.commit()
+    return rows
+
+def recent_history(session_id):
+    """Recent turns for the prompt: from memory, or from chat_history after a restart."""
+    turns = conversation_memory.recent(session_id)
+    if turns or conversation_memory.max_turns <= 0:
+        return turns
+    try:
+        rows = fetch_history_page(session_id, conversation_memory.max_turns)
+    except Exception as e:
+        app.logger.error(f"Error loading chat history: {e}")
+        return []
+    for _, user_message, bot_response, _ in reversed(rows):
+        conversation_memory.add(session_id, user_message, bot_response)
+    return conversation_memory.recent(session_id)
+
+def record_turn(session_id, query, answer):
+    conversation_memory.add(session_id, query, answer)
+    history_writer.submit(session_id, query, answer)
+# --- END Chat History ---
 
 @app.route('/')
 def home():
@@ -65,64 +272,293 @@ def home():
 @app.route('/db_test')
 def db_test():
     try:
-        import psycopg2
-        DB_HOST = os.environ.get("APP_DB_HOST", "app_db")
-        DB_NAME = os.environ.get("APP_DB_NAME", "palantir_app_db")
-        DB_USER = os.environ.get("APP_DB_USER", "palantir_user")
-        DB_PASSWORD = os.environ.get("APP_DB_PASSWORD")
-
-        conn = psycopg2.connect(host=DB_HOST, database=DB_NAME, user=DB_USER, password=DB_PASSWORD)
-        cursor = conn.cursor()
-        cursor.execute("SELECT 1")
-        result = cursor.fetchone()
-        cursor.close()
-        conn.close()
-
+        result = app_db_pool.ping()
         app.logger.info("Successfully connected to app_db from /db_test.")
-        return jsonify({"status": "Database connection successful", "test_query_result": result[0]})
+        return jsonify({"status": "Database connection successful", "test_query_result": result})
     except Exception as e:
         app.logger.error(f"Error connecting to app_db from /db_test: {e}")
         return jsonify({"status": "Database connection error", "error": str(e)}), 500
 
+@app.route('/healthz')
+def healthz():
+    """Liveness: the worker is up and serving requests. Touches no database."""
+    return jsonify({"status": "ok"})
+
+@app.route('/readyz')
+def readyz():
+    """Readiness: both databases answer on a pooled connection. Reports pool usage."""
+    checks = {}
+    ready = True
+    for name, pool in (("app_db", app_db_pool), ("vector_db", vector_db_pool)):
+        started = time.monotonic()
+        try:
+            pool.ping()
+            checks[name] = {"status": "ok", "latency_ms": round((time.monotonic() - started) * 1000, 1)}
+        except Exception as e:
+            ready = False
+            checks[name] = {"status": "error", "error": str(e)}
+        checks[name]["pool"] = pool.status()
+    return jsonify({
+        "status": "ready" if ready else "not ready",
+        "checks": checks,
+        "history_writer": history_writer.stats(),
+    }), 200 if ready else 503
+
+SYSTEM_PROMPT = "You are a helpful AI assistant for OpenEdge code. Provide concise and relevant information based on the user's query and any provided context."
+
+def api_key_configured():
+    if isinstance(llm, FakeChatModel):
+        return True
+    return bool(google_api_key) and google_api_key != "your_google_api_key_here"
+
+def overloaded_response(error):
+    app.logger.warning(f"Shedding chat request: {error}")
+    response = jsonify({"response": f"The assistant is busy, please retry in {error.retry_after}s."})
+    response.status_code = 429
+    response.headers['Retry-After'] = str(error.retry_after)
+    return response
+
+def current_session_id():
+    """The id the session store keys this browser session under; its uploads use it too,
+    so they expire and are deleted with the session."""
+    # Empty sessions are not saved, so the id is also kept in the session itself.
+    if session.get('session_id') != session.sid:
+        session['session_id'] = session.sid
+    return session.sid
+
+def uploaded_context_hits(query):
+    """The uploaded chunks most relevant to `query`, if this session has uploaded anything."""
+    if not session.get('uploads'):
+        return []
+    try:
+        query_vector = retriever.embed_query(query)
+        with stage_timer('upload_search'):
+            return upload_index.search(current_session_id(), query_vector, k=UPLOAD_TOP_K)
+    except Exception as e:
+        STAGE_ERRORS.inc(stage='upload_search')
+        app.logger.error(f"Error searching uploaded context: {e}")
+        return []
+
+def build_chat_messages(query):
+    """Gathers retrieved code and uploaded chunks for `query`; returns (messages, hits, context)."""
+    upload_hits = uploaded_context_hits(query)
+
+    # Retrieval problems should not stop the question being answered, just less well.
+    hits = []
+    try:
+        hits = retriever.search(
+            query,
+            k=request.args.get('k', RETRIEVAL_TOP_K, type=int),
+            path_prefix=request.args.get('path_prefix'),
+        )
+    except Exception as e:
+        STAGE_ERRORS.inc(stage='retrieval')
+        app.logger.error(f"Error retrieving code context from vector_db: {e}")
+
+    session_id = current_session_id()
+    history = recent_history(session_id)
+    with stage_timer('prompt_assembly'):
+        context, report = prompt_budget.assemble(
+            SYSTEM_PROMPT, query, code_hits=hits, upload_hits=upload_hits, history=history
+        )
+    app.logger.info(
+        f"Prompt: {report['used']}/{report['budget']} tokens ({report['code_chunks']} code chunks, "
+        f"{report['upload_chunks']} upload chunks, {report['history_turns']} history turns; "
+        f"{report['duplicates_dropped']} duplicates dropped, {report['trimmed']} trimmed, {report['skipped']} skipped)."
+    )
+
+    effective_query = query
+    if context:
+        effective_query = f"Here is some relevant context:\n{context}\n\nBased on this context and the following question: {query}"
+
+    messages = [
+        SystemMessage(content=SYSTEM_PROMPT),
+        HumanMessage(content=effective_query),
+    ]
+    return messages, hits + upload_hits, context
+
+def answer_cache_lookup(query, context):
+    """Returns (key, cached answer or None, whether to store a fresh answer) for this request."""
+    # context holds the session's recent turns too: a follow-up question means something
+    # else in another conversation, so it must not share that conversation's answer.
+    key = cache_key(query, SYSTEM_PROMPT, context, LLM_MODEL)
+    if request.args.get('nocache') == '1':
+        return key, None, False
+    if request.args.get('refresh') == '1':
+        answer_cache.invalidate(key)
+        return key, None, True
+    return key, answer_cache.get(key), True
+
+def timed_invoke(messages):
+    """llm.invoke, timed as the llm stage (only calls that actually go upstream)."""
+    with stage_timer('llm'):
+        return llm.invoke(messages)
+
 @app.route('/chat/<path:query>', methods=['GET', 'POST'])
 def chat(query):
-    if not google_api_key or google_api_key == "your_google_api_key_here":
+    if not api_key_configured():
         return jsonify({"response": "Error: Google API Key not configured in .env"}), 500
 
-    context_filepath = session.get('context_filepath')
-    file_content = ""
-
-    if context_filepath and os.path.exists(context_filepath):
-        try:
-            with open(context_filepath, 'r', encoding='utf-8') as f:
-                file_content = f.read()
-            app.logger.info(f"Using context from session file: {context_filepath}")
-            # Clean up the file after reading
-            os.remove(context_filepath)
-            session.pop('context_filepath', None)
-        except Exception as e:
-            app.logger.error(f"Error reading or deleting context file {context_filepath}: {e}")
-            file_content = "" # Ensure content is clear on error
-
+    messages, hits, context = build_chat_messages(query)
+    key, cached_answer, store_answer = answer_cache_lookup(query, context)
+    if cached_answer is not None:
+        record_turn(current_session_id(), query, cached_answer)
+        return jsonify({"query": query, "response": cached_answer, "sources": source_list(hits), "cached": True})
     try:
-        effective_query = query
-        if file_content:
-            effective_query = f"Here is some relevant context:\n{file_content}\n\nBased on this context and the following question: {query}"
-    
-        messages = [
-            SystemMessage(content="You are a helpful AI assistant for OpenEdge code. Provide concise and relevant information based on the user's query and any provided context."),
-            HumanMessage(content=effective_query),
-        ]
-    
-        llm_response_object = llm.invoke(messages)
+        llm_response_object, shared = llm_gate.call(key, lambda: timed_invoke(messages))
         llm_response_content = llm_response_object.content
+        if store_answer and not shared:
+            answer_cache.put(key, llm_response_content)
+        record_turn(current_session_id(), query, llm_response_content)
 
-        return jsonify({"query": query, "response": llm_response_content})
+        return jsonify({"query": query, "response": llm_response_content, "sources": source_list(hits), "cached": False})
 
+    except Overloaded as e:
+        return overloaded_response(e)
     except Exception as e:
+        STAGE_ERRORS.inc(stage='llm')
         app.logger.error(f"Error communicating with LLM: {e}")
         return jsonify({"response": f"Error communicating with LLM: {str(e)}"}), 500
 
+def sse_event(data, event=None):
+    """Formats one Server-Sent Events frame with a JSON payload."""
+    frame = f"event: {event}\n" if event else ""
+    return frame + f"data: {json.dumps(data)}\n\n"
+
+@app.route('/chat_stream/<path:query>', methods=['GET', 'POST'])
+def chat_stream(query):
+    """Streams the answer as Server-Sent Events while the LLM generates it.
+
+    Events: 'sources' (the retrieved chunks) first, then unnamed events carrying
+    {"token": ...} as each piece of the answer arrives, and finally 'done' with
+    time-to-first-token, total time in milliseconds and whether the answer came from the
+    answer cache, or 'error'.
+    """
+    if not api_key_configured():
+        return jsonify({"response": "Error: Google API Key not configured in .env"}), 500
+
+    # Session and retrieval work happen before the response starts, while the request
+    # context (and the session cookie) can still be changed.
+    started = time.monotonic()
+    messages, hits, context = build_chat_messages(query)
+    key, cached_answer, store_answer = answer_cache_lookup(query, context)
+    session_id = current_session_id()
+
+    # Streams cannot be shared between requests, but they do hold an LLM slot until the
+    # response is closed (also when the client goes away early).
+    slot = None
+    if cached_answer is None:
+        try:
+            llm_gate.admission.acquire()
+        except Overloaded as e:
+            return overloaded_response(e)
+        slot = {'started': time.monotonic(), 'held': True}
+
+    def release_slot():
+        if slot and slot['held']:
+            slot['held'] = False
+            llm_gate.admission.release(time.monotonic() - slot['started'])
+
+    def generate():
+        yield sse_event(source_list(hits), event="sources")
+        if cached_answer is not None:
+            record_turn(session_id, query, cached_answer)
+            yield sse_event({"token": cached_answer})
+            elapsed_ms = round((time.monotonic() - started) * 1000)
+            yield sse_event({"ttft_ms": elapsed_ms, "total_ms": elapsed_ms, "cached": True}, event="done")
+            return
+        first_token_at = None
+        pieces = []
+        llm_started = time.monotonic()
+        try:
+            for chunk in llm.stream(messages):
+                if not chunk.content:
+                    continue
+                if first_token_at is None:
+                    first_token_at = time.monotonic()
+                    STAGE_SECONDS.observe(first_token_at - llm_started, stage='llm_first_token')
+                pieces.append(chunk.content)
+                yield sse_event({"token": chunk.content})
+        except Exception as e:
+            STAGE_ERRORS.inc(stage='llm')
+            app.logger.error(f"Error streaming from LLM: {e}")
+            yield sse_event({"message": f"Error communicating with LLM: {str(e)}"}, event="error")
+            return
+        finally:
+            release_slot()
+        finished = time.monotonic()
+        STAGE_SECONDS.observe(finished - llm_started, stage='llm')
+        ttft_ms = round(((first_token_at or finished) - started) * 1000)
+        total_ms = round((finished - started) * 1000)
+        app.logger.info(f"Streamed chat answer: first token after {ttft_ms} ms, complete after {total_ms} ms.")
+        answer = "".join(pieces)
+        if store_answer and answer:
+            answer_cache.put(key, answer)
+        record_turn(session_id, query, answer)
+        yield sse_event({"ttft_ms": ttft_ms, "total_ms": total_ms, "cached": False}, event="done")
+
+    response = Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        # X-Accel-Buffering stops nginx holding the tokens back until the answer is complete.
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'},
+    )
+    response.call_on_close(release_slot)
+    return response
+
+@app.route('/cache_stats', methods=['GET'])
+def cache_stats():
+    return jsonify({
+        "llm_answers": answer_cache.stats(),
+        "query_embeddings": retriever.query_cache.stats(),
+    })
+
+@app.route('/history', methods=['GET'])
+def history():
+    """This session's chat history, newest first, one keyset page at a time.
+
+    Pass the returned next_before back as ?before= for the next (older) page.
+    """
+    limit = min(max(request.args.get('limit', 20, type=int), 1), 100)
+    before = None
+    if request.args.get('before'):
+        try:
+            timestamp, row_id = request.args['before'].rsplit('_', 1)
+            before = (datetime.fromisoformat(timestamp), int(row_id))
+        except ValueError:
+            return jsonify({"message": "Invalid 'before' cursor"}), 400
+    try:
+        rows = fetch_history_page(current_session_id(), limit, before)
+    except Exception as e:
+        app.logger.error(f"Error reading chat history: {e}")
+        return jsonify({"message": f"Error reading chat history: {str(e)}"}), 500
+    turns = [
+        {"id": row_id, "user_message": user_message, "bot_response": bot_response, "timestamp": timestamp.isoformat()}
+        for row_id, user_message, bot_response, timestamp in rows
+    ]
+    next_before = f"{turns[-1]['timestamp']}_{turns[-1]['id']}" if len(turns) == limit else None
+    return jsonify({"turns": turns, "next_before": next_before})
+
+@app.route('/llm_stats', methods=['GET'])
+def llm_stats():
+    return jsonify(llm_gate.stats())
+
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    """Prometheus scrape target. Gauges are refreshed from the components' stats here."""
+    for field, value in llm_gate.stats().items():
+        LLM_GATE.set(value, field=field)
+    for name, pool in (("app_db", app_db_pool), ("vector_db", vector_db_pool)):
+        for state, value in pool.status().items():
+            DB_POOL.set(value, database=name, state=state)
+    for field, value in history_writer.stats().items():
+        HISTORY_WRITER.set(value, field=field)
+    for name, stats in (("llm_answers", answer_cache.stats()), ("query_embeddings", retriever.query_cache.stats())):
+        for field, value in stats.items():
+            if isinstance(value, (int, float)):
+                CACHE.set(value, cache=name, field=field)
+    return Response(metrics.render(), content_type=CONTENT_TYPE)
+
 @app.route('/upload_context', methods=['POST'])
 def upload_context():
     if 'file' not in request.files:
@@ -134,21 +570,47 @@ def upload_context():
         return jsonify({"message": "No selected file"}), 400
 
     if file:
+        data = file.read(UPLOAD_MAX_BYTES + 1)
+        if len(data) > UPLOAD_MAX_BYTES:
+            return jsonify({"message": f"File is larger than {UPLOAD_MAX_BYTES // (1024 * 1024)} MB"}), 413
+
         unique_filename = str(uuid.uuid4()) + "_" + file.filename
-        filepath = os.path.join(UPLOAD_FOLDER, unique_filename)
-        
-        # Clean up any old file path in session before saving new one
-        old_filepath = session.get('context_filepath')
-        if old_filepath and os.path.exists(old_filepath):
-            os.remove(old_filepath)
-            
-        file.save(filepath)
-        session['context_filepath'] = filepath # Store file path in session
-        app.logger.info(f"File '{unique_filename}' uploaded and path stored in session.")
+        session_id = current_session_id()
+        # A file uploaded again under the same name replaces the earlier one, so that one
+        # does not count against the quota.
+        replaced = next((upload['upload_id'] for upload in session.get('uploads', [])
+                         if upload['filename'] == file.filename), None)
+
+        try:
+            with stage_timer('upload_store'):
+                store.save_upload(session_id, unique_filename, file.filename, data, replaces=replaced)
+        except QuotaExceeded as e:
+            return jsonify({"message": str(e)}), 413
+
+        # Chunk and embed once now, so each question only pulls the relevant parts.
+        try:
+            with stage_timer('upload_index'):
+                chunk_count = upload_index.add(session_id, file.filename, decode_upload(data))
+        except Exception as e:
+            STAGE_ERRORS.inc(stage='upload_index')
+            app.logger.error(f"Error indexing uploaded file '{file.filename}': {e}")
+            store.delete_upload(unique_filename)
+            return jsonify({"message": f"Could not index uploaded file: {str(e)}"}), 500
+
+        uploads = []
+        for upload in session.get('uploads', []):
+            if upload['filename'] == file.filename:
+                store.delete_upload(upload['upload_id'])
+            else:
+                uploads.append(upload)
+        uploads.append({"filename": file.filename, "upload_id": unique_filename})
+        session['uploads'] = uploads
+        app.logger.info(f"File '{unique_filename}' uploaded and indexed as {chunk_count} chunks.")
 
         return jsonify({
             "message": "File uploaded successfully and is ready for context.",
-            "filename": unique_filename
+            "filename": unique_filename,
+            "chunks": chunk_count
         }), 200
 
     return jsonify({"message": "File upload failed"}), 500
@@ -156,9 +618,14 @@ def upload_context():
 @app.route('/download/<filename>', methods=['GET'])
 def download_file(filename):
     try:
-        return send_from_directory(UPLOAD_FOLDER, filename, as_attachment=True)
-    except FileNotFoundError:
-        return jsonify({"message": "File not found"}), 404
+        upload = store.get_upload(filename)
+        # Uploads are private to the session that made them.
+        if upload is None or upload[0] != session.sid:
+            return jsonify({"message": "File not found"}), 404
+        _, original_name, data = upload
+        # send_file quotes and RFC 5987-encodes the name for the Content-Disposition header.
+        return send_file(io.BytesIO(data), mimetype='application/octet-stream', as_attachment=True,
+                         download_name=original_name)
     except Exception as e:
         return jsonify({"message": f"Error serving file: {str(e)}"}), 500
 
@@ -0,0 +1,33 @@
+"""LLM answer cache table
+
+Revision ID: 5b1f3c9d2a47
+Revises: 290eb81a6e68
+Create Date: 2026-10-18 09:12:41.318204
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5b1f3c9d2a47'
+down_revision = '290eb81a6e68'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('llm_answer_cache',
+    sa.Column('cache_key', sa.String(length=64), nullable=False),
+    sa.Column('answer', sa.Text(), nullable=False),
+    sa.Column('model', sa.String(length=255), nullable=True),
+    sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=False),
+    sa.Column('expires_at', sa.DateTime(timezone=True), nullable=False),
+    sa.PrimaryKeyConstraint('cache_key')
+    )
+    op.create_index('llm_answer_cache_expires_at_idx', 'llm_answer_cache', ['expires_at'], unique=False)
+
+
+def downgrade():
+    op.drop_index('llm_answer_cache_expires_at_idx', table_name='llm_answer_cache')
+    op.drop_table('llm_answer_cache')
@@ -0,0 +1,26 @@
+"""Index chat_history by session and time
+
+Revision ID: 8e4a6d0c7b13
+Revises: 5b1f3c9d2a47
+Create Date: 2026-10-18 11:40:05.611872
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8e4a6d0c7b13'
+down_revision = '5b1f3c9d2a47'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # id breaks ties between turns with the same timestamp, so keyset pages never skip rows.
+    op.create_index('chat_history_session_timestamp_idx', 'chat_history',
+                    ['session_id', 'timestamp', 'id'], unique=False)
+
+
+def downgrade():
+    op.drop_index('chat_history_session_timestamp_idx', table_name='chat_history')
@@ -0,0 +1,44 @@
+"""Server-side session and upload store tables
+
+Revision ID: c3d9e2f4a518
+Revises: 8e4a6d0c7b13
+Create Date: 2026-10-18 13:05:22.904117
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision = 'c3d9e2f4a518'
+down_revision = '8e4a6d0c7b13'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('app_sessions',
+    sa.Column('session_id', sa.String(length=64), nullable=False),
+    sa.Column('data', postgresql.JSONB(astext_type=sa.Text()), nullable=False),
+    sa.Column('expires_at', sa.DateTime(timezone=True), nullable=False),
+    sa.PrimaryKeyConstraint('session_id')
+    )
+    op.create_index('app_sessions_expires_at_idx', 'app_sessions', ['expires_at'], unique=False)
+    op.create_table('app_uploads',
+    sa.Column('upload_id', sa.String(length=512), nullable=False),
+    sa.Column('session_id', sa.String(length=64), nullable=False),
+    sa.Column('filename', sa.Text(), nullable=False),
+    sa.Column('size', sa.BigInteger(), nullable=False),
+    sa.Column('data', sa.LargeBinary(), nullable=False),
+    sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=False),
+    sa.PrimaryKeyConstraint('upload_id')
+    )
+    op.create_index('app_uploads_session_id_idx', 'app_uploads', ['session_id'], unique=False)
+
+
+def downgrade():
+    op.drop_index('app_uploads_session_id_idx', table_name='app_uploads')
+    op.drop_table('app_uploads')
+    op.drop_index('app_sessions_expires_at_idx', table_name='app_sessions')
+    op.drop_table('app_sessions')
@@ -0,0 +1,128 @@
+# app/prompt_builder.py
+import logging
+import math
+import re
+import threading
+from collections import OrderedDict, deque
+
+from retrieval import chunk_heading
+
+logger = logging.getLogger(__name__)
+
+_WORD_RE = re.compile(r'\w+')
+
+def estimate_tokens(text):
+    """A cheap token estimate: about four characters per token for code and English."""
+    return math.ceil(len(text) / 4)
+
+def truncate_to_tokens(text, tokens):
+    """Cuts text to roughly `tokens` tokens at a line boundary where possible."""
+    limit = tokens * 4
+    if len(text) <= limit:
+        return text
+    cut = text.rfind('\n', 0, limit)
+    return text[:cut if cut > limit // 2 else limit].rstrip() + "\n..."
+
+def _shingles(text, size=5):
+    words = _WORD_RE.findall(text.lower())
+    if len(words) <= size:
+        return {' '.join(words)}
+    return {' '.join(words[i:i + size]) for i in range(len(words) - size + 1)}
+
+def drop_near_duplicates(hits, threshold=0.8):
+    """Keeps the first of any chunks whose 5-word shingles overlap by `threshold` (Jaccard) or more."""
+    kept, kept_shingles = [], []
+    for hit in hits:
+        shingles = _shingles(hit['chunk_text'])
+        if any(len(shingles & other) / max(len(shingles | other), 1) >= threshold for other in kept_shingles):
+            continue
+        kept.append(hit)
+        kept_shingles.append(shingles)
+    return kept
+
+class ConversationMemory:
+    """The last few turns of each session, kept in process for prompt context."""
+
+    def __init__(self, max_turns=3, max_sessions=10_000):
+        self.max_turns = max_turns
+        self.max_sessions = max_sessions
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+
+    def recent(self, session_id):
+        with self._lock:
+            turns = self._sessions.get(session_id)
+            return list(turns) if turns else []
+
+    def add(self, session_id, question, answer):
+        if self.max_turns <= 0:
+            return
+        with self._lock:
+            turns = self._sessions.get(session_id)
+            if turns is None:
+                turns = self._sessions[session_id] = deque(maxlen=self.max_turns)
+            self._sessions.move_to_end(session_id)
+            turns.append((question, answer))
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+
+class PromptBudget:
+    """Assembles the prompt within a token budget, in priority order.
+
+    The system prompt and the question always go in. The remaining budget is filled with
+    retrieved code chunks in rank order, then uploaded chunks, then recent conversation
+    turns (newest first); near-duplicate chunks are dropped, and the first item that does
+    not fit is trimmed if a useful amount of room is left, after which lower-priority
+    items are skipped.
+    """
+
+    def __init__(self, budget_tokens=8000, min_trimmed_tokens=200):
+        self.budget_tokens = budget_tokens
+        self.min_trimmed_tokens = min_trimmed_tokens
+
+    def assemble(self, system_prompt, question, code_hits=(), upload_hits=(), history=()):
+        """Returns (context, report). context is the text to put before the question."""
+        used = estimate_tokens(system_prompt) + estimate_tokens(question)
+        report = {'budget': self.budget_tokens, 'system': estimate_tokens(system_prompt),
+                  'question': estimate_tokens(question), 'duplicates_dropped': 0, 'skipped': 0, 'trimmed': 0}
+        sections = []
+        full = False
+
+        def add(entries, name, title):
+            nonlocal used, full
+            kept = []
+            for entry in entries:
+                # The section title is paid for by its first entry.
+                overhead = 0 if kept else estimate_tokens(title) + 1
+                cost = estimate_tokens(entry) + overhead
+                remaining = self.budget_tokens - used
+                if not full and cost <= remaining:
+                    kept.append(entry)
+                    used += cost
+                elif not full and remaining >= self.min_trimmed_tokens:
+                    kept.append(truncate_to_tokens(entry, remaining - overhead - 10))
+                    used += estimate_tokens(kept[-1]) + overhead
+                    report['trimmed'] += 1
+                    full = True
+                else:
+                    report['skipped'] += 1
+                    full = True
+            report[name] = len(kept)
+            return kept
+
+        for name, title, hits in (('code_chunks', "Relevant code from the repository:", code_hits),
+                                  ('upload_chunks', "Relevant parts of the uploaded files:", upload_hits)):
+            unique = drop_near_duplicates(list(hits))
+            report['duplicates_dropped'] += len(hits) - len(unique)
+            kept = add([f"{chunk_heading(hit)}\n{hit['chunk_text']}" for hit in unique],
+                       name, title)
+            if kept:
+                sections.append(title + "\n" + "\n\n".join(kept))
+
+        title = "Recent conversation:"
+        turns = add([f"User: {q}\nAssistant: {a}" for q, a in reversed(list(history))], 'history_turns', title)
+        if turns:
+            sections.append(title + "\n" + "\n\n".join(reversed(turns)))
+
+        report['used'] = used
+        return "\n\n".join(sections), report
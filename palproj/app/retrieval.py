@@ -0,0 +1,377 @@
+# app/retrieval.py
+import logging
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from contextlib import nullcontext
+
+logger = logging.getLogger(__name__)
+
+# --- Vector Search Configuration ---
+# VECTOR_DISTANCE must match the index built by the ingestion service (cosine | l2 | ip).
+# ef_search (HNSW) and probes (IVFFlat) trade recall for latency per query; tune them
+# with `ingestion_script.py --eval-recall`.
+VECTOR_DISTANCE = os.getenv('VECTOR_DISTANCE', 'cosine').lower()
+VECTOR_DISTANCE_OPERATORS = {'cosine': '<=>', 'l2': '<->', 'ip': '<#>'}
+VECTOR_EF_SEARCH = int(os.getenv('VECTOR_EF_SEARCH', '40'))
+VECTOR_IVFFLAT_PROBES = int(os.getenv('VECTOR_IVFFLAT_PROBES', '10'))
+RETRIEVAL_TOP_K = int(os.getenv('RETRIEVAL_TOP_K', '5'))
+QUERY_EMBEDDING_CACHE_SIZE = int(os.getenv('QUERY_EMBEDDING_CACHE_SIZE', '1024'))
+# Places listed per retrieved chunk; a chunk repeated in more files only reports the count.
+RETRIEVAL_MAX_OCCURRENCES = int(os.getenv('RETRIEVAL_MAX_OCCURRENCES', '5'))
+# Graph expansion: chunks reachable from the top hits through RUN and {include} references,
+# up to RETRIEVAL_EXPAND_HOPS hops (0 disables it), at most RETRIEVAL_EXPAND_PER_TARGET
+# chunks per reference and RETRIEVAL_EXPAND_LIMIT in total.
+RETRIEVAL_EXPAND_HOPS = int(os.getenv('RETRIEVAL_EXPAND_HOPS', '1'))
+RETRIEVAL_EXPAND_PER_TARGET = int(os.getenv('RETRIEVAL_EXPAND_PER_TARGET', '2'))
+RETRIEVAL_EXPAND_LIMIT = int(os.getenv('RETRIEVAL_EXPAND_LIMIT', '4'))
+# --- END Vector Search Configuration ---
+
+def apply_vector_search_settings(cursor):
+    """Sets the index search parameters for the current vector_db transaction."""
+    cursor.execute("SET LOCAL hnsw.ef_search = %s;", (VECTOR_EF_SEARCH,))
+    cursor.execute("SET LOCAL ivfflat.probes = %s;", (VECTOR_IVFFLAT_PROBES,))
+
+def vector_literal(vector):
+    """Formats a vector as pgvector's text input, e.g. '[0.1,0.2]'."""
+    return '[' + ','.join(repr(float(x)) for x in vector) + ']'
+
+def like_prefix(prefix):
+    """Returns a LIKE pattern matching strings that start with `prefix` literally."""
+    escaped = prefix.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+    return escaped + '%'
+
+def occurrences_sql(preferred="FALSE", limit="%s"):
+    """Joins each matched chunk (CTE alias m) to up to `limit` of its places and its total count.
+
+    Occurrences satisfying `preferred` are listed first, so the heading of a hit names the
+    file or procedure the search actually matched.
+    """
+    return (
+        "CROSS JOIN LATERAL (SELECT json_agg(json_build_object('file_path', o.file_path, "
+        "'procedure_name', o.procedure_name, 'start_line', o.start_line) ORDER BY o.place) AS occurrences "
+        "FROM (SELECT o.file_path, o.procedure_name, o.start_line, "
+        f"row_number() OVER (ORDER BY ({preferred}) DESC, o.file_path, o.ordinal) AS place "
+        "FROM chunk_occurrences o WHERE o.chunk_hash = m.chunk_hash "
+        f"ORDER BY ({preferred}) DESC, o.file_path, o.ordinal LIMIT {limit}) o) places "
+        "CROSS JOIN LATERAL (SELECT count(*) AS occurrence_count FROM chunk_occurrences o "
+        "WHERE o.chunk_hash = m.chunk_hash) counted"
+    )
+
+def make_hit(chunk_hash, chunk_text, distance, occurrences, occurrence_count, hops=0, via=None):
+    """A search hit; file_path and procedure_name are those of the chunk's first listed place.
+
+    hops is 0 for chunks the search found, and 1 or more for chunks reached through
+    references from them; via is then the reference followed, e.g. 'run ip-calc-tax'.
+    """
+    occurrences = occurrences or []
+    first = occurrences[0] if occurrences else {}
+    return {
+        'chunk_hash': chunk_hash, 'file_path': first.get('file_path'),
+        'procedure_name': first.get('procedure_name'), 'start_line': first.get('start_line'),
+        'chunk_text': chunk_text, 'distance': float(distance) if distance is not None else None,
+        'occurrences': occurrences, 'occurrence_count': int(occurrence_count or 0),
+        'hops': hops, 'via': via,
+    }
+
+# Walks chunk_symbols from the seed chunks. Each hop resolves a reference through an index:
+# 'run' targets by procedure name, program and include targets by base name (and then by
+# path suffix). UNION drops repeated (chunk, depth) rows, so cycles end at max_hops.
+EXPANSION_SQL = """
+WITH RECURSIVE walk (chunk_hash, depth, via) AS (
+    SELECT seed, 0, NULL::text FROM unnest(%(seeds)s::text[]) AS seed
+  UNION
+    SELECT target.chunk_hash, walk.depth + 1, s.kind || ' ' || s.target
+    FROM walk
+    JOIN chunk_symbols s ON s.chunk_hash = walk.chunk_hash AND s.kind IN ('run', 'program', 'include')
+    CROSS JOIN LATERAL (
+        (SELECT o.chunk_hash FROM chunk_occurrences o
+         WHERE s.kind = 'run' AND lower(o.procedure_name) = s.target
+         ORDER BY o.file_path, o.ordinal LIMIT %(per_target)s)
+        UNION
+        (SELECT o.chunk_hash FROM chunk_occurrences o
+         WHERE s.kind <> 'run' AND o.file_name = regexp_replace(s.target, '^.*/', '')
+           AND (lower(o.file_path) = s.target OR lower(o.file_path) LIKE '%%/' || s.target)
+         ORDER BY o.file_path, o.ordinal LIMIT %(per_target)s)
+    ) target
+    WHERE walk.depth < %(hops)s
+), m AS (
+    SELECT DISTINCT ON (chunk_hash) chunk_hash, depth, via
+    FROM walk
+    WHERE depth > 0 AND NOT chunk_hash = ANY(%(seeds)s::text[])
+    ORDER BY chunk_hash, depth, via
+), ranked AS (
+    SELECT * FROM m ORDER BY depth, via, chunk_hash LIMIT %(limit)s
+)
+SELECT m.chunk_hash, c.chunk_text, m.depth, m.via, places.occurrences, counted.occurrence_count
+FROM ranked m
+JOIN code_embeddings c ON c.chunk_hash = m.chunk_hash
+{occurrences}
+ORDER BY m.depth, m.via, m.chunk_hash;
+"""
+
+class LRUCache:
+    """A small thread-safe least-recently-used map."""
+
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            if key in self._items:
+                self._items.move_to_end(key)
+                self.hits += 1
+                return self._items[key]
+            self.misses += 1
+            return None
+
+    def put(self, key, value):
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._items[key] = value
+            self._items.move_to_end(key)
+            while len(self._items) > self.maxsize:
+                self._items.popitem(last=False)
+
+    def __len__(self):
+        return len(self._items)
+
+    def stats(self):
+        return {'size': len(self._items), 'hits': self.hits, 'misses': self.misses}
+
+class VectorRetriever:
+    """Finds the stored code chunks most relevant to a question.
+
+    Query embeddings are kept in an in-process LRU, so repeated and retried questions skip
+    the embedding API, and searches borrow connections from `pool` (the vector_db
+    db.EnginePool, or anything with a connection() context manager). The file_path prefix filter is applied to the index scan's
+    candidates, so a very narrow prefix may return fewer than k hits unless ef_search or
+    probes is raised.
+
+    Each stored chunk is unique; a hit lists where it occurs (up to
+    RETRIEVAL_MAX_OCCURRENCES places) and how many places there are in total.
+
+    search() then follows the RUN and {include} references of its hits through the
+    chunk_symbols table that ingestion fills, in one recursive query, and appends the
+    chunks reached after the hits themselves.
+
+    `timer(stage)`, if given, returns a context manager timing one stage ('query_embedding',
+    'lexical_search', 'vector_search' or 'graph_expansion'), e.g. a metrics histogram's time().
+    """
+
+    def __init__(self, embeddings, pool, cache_size=QUERY_EMBEDDING_CACHE_SIZE, timer=None):
+        self.embeddings = embeddings
+        self.pool = pool
+        self.query_cache = LRUCache(cache_size)
+        self.timer = timer or (lambda stage: nullcontext())
+
+    def embed_query(self, query):
+        vector = self.query_cache.get(query)
+        if vector is None:
+            with self.timer('query_embedding'):
+                vector = self.embeddings.embed_query(query)
+            self.query_cache.put(query, vector)
+        return vector
+
+    def _query(self, sql, params, vector_search=False, stage=None):
+        with self.timer(stage or ('vector_search' if vector_search else 'lexical_search')):
+            return self._run_query(sql, params, vector_search)
+
+    def _run_query(self, sql, params, vector_search):
+        import psycopg2
+        for attempt in (1, 2):
+            try:
+                with self.pool.connection() as conn:
+                    with conn.cursor() as cur:
+                        if vector_search:
+                            apply_vector_search_settings(cur)
+                        cur.execute(sql, params)
+                        rows = cur.fetchall()
+                    conn.commit()
+                return rows
+            except (psycopg2.OperationalError, psycopg2.InterfaceError) as e:
+                # Pre-ping catches most dead connections; one that dies mid-query is dropped, try once more.
+                if attempt == 2:
+                    raise
+                logger.warning(f"Retrying search on a fresh connection: {e}")
+
+    def lexical_search(self, terms, k=RETRIEVAL_TOP_K, path_prefix=None, identifiers=False):
+        """Full-text search over procedure names and chunk text for any of `terms`.
+
+        For identifiers, chunks occurring in a procedure with exactly that name and in files
+        whose path ends in it match too, and the procedure matches rank ahead of plain text
+        matches.
+        """
+        terms = list(terms)
+        tsquery = " || ".join(["plainto_tsquery('simple', %s)"] * len(terms))
+        name_match, name_params = "FALSE", []
+        preferred, preferred_params = "FALSE", []
+        conditions, where_params = [f"c.search_tsv @@ ({tsquery})"], list(terms)
+        if identifiers:
+            path_patterns = ['%' + like_prefix(term)[:-1] for term in terms]
+            name_match = ("EXISTS (SELECT 1 FROM chunk_occurrences o WHERE o.chunk_hash = c.chunk_hash "
+                          "AND lower(o.procedure_name) = ANY(%s))")
+            name_params = [terms]
+            path_match = " OR ".join(["lower(o.file_path) LIKE %s"] * len(terms))
+            conditions.append(name_match)
+            conditions.append(f"EXISTS (SELECT 1 FROM chunk_occurrences o WHERE o.chunk_hash = c.chunk_hash "
+                              f"AND ({path_match}))")
+            where_params += [terms] + path_patterns
+            preferred = f"lower(o.procedure_name) = ANY(%s) OR {path_match}"
+            preferred_params = [terms] + path_patterns
+        sql = (f"WITH m AS (SELECT c.chunk_hash, c.chunk_text, "
+               f"({name_match}) AS name_match, ts_rank_cd(c.search_tsv, {tsquery}) AS rank "
+               f"FROM code_embeddings c WHERE ({' OR '.join(conditions)})")
+        params = name_params + terms + where_params
+        if path_prefix:
+            sql += (" AND EXISTS (SELECT 1 FROM chunk_occurrences o WHERE o.chunk_hash = c.chunk_hash "
+                    "AND o.file_path LIKE %s)")
+            params.append(like_prefix(path_prefix))
+            preferred = f"o.file_path LIKE %s AND ({preferred})" if identifiers else "o.file_path LIKE %s"
+            preferred_params = [like_prefix(path_prefix)] + preferred_params
+        sql += " ORDER BY name_match DESC, rank DESC LIMIT %s) "
+        params.append(k)
+        sql += (f"SELECT m.chunk_hash, m.chunk_text, places.occurrences, counted.occurrence_count "
+                f"FROM m {occurrences_sql(preferred)} ORDER BY m.name_match DESC, m.rank DESC;")
+        params += preferred_params + preferred_params + [RETRIEVAL_MAX_OCCURRENCES]
+        return [
+            make_hit(chunk_hash, chunk_text, None, occurrences, occurrence_count)
+            for chunk_hash, chunk_text, occurrences, occurrence_count in self._query(sql, params)
+        ]
+
+    def vector_search(self, query, k=RETRIEVAL_TOP_K, path_prefix=None):
+        """Nearest chunks to the query's embedding."""
+        vector = vector_literal(self.embed_query(query))
+        operator = VECTOR_DISTANCE_OPERATORS.get(VECTOR_DISTANCE, '<=>')
+        sql = (f"WITH m AS (SELECT c.chunk_hash, c.chunk_text, c.embedding {operator} %s::vector AS distance "
+               f"FROM code_embeddings c")
+        params = [vector]
+        preferred, preferred_params = "FALSE", []
+        if path_prefix:
+            sql += (" WHERE EXISTS (SELECT 1 FROM chunk_occurrences o WHERE o.chunk_hash = c.chunk_hash "
+                    "AND o.file_path LIKE %s)")
+            params.append(like_prefix(path_prefix))
+            preferred, preferred_params = "o.file_path LIKE %s", [like_prefix(path_prefix)]
+        sql += " ORDER BY distance LIMIT %s) "
+        params.append(k)
+        sql += (f"SELECT m.chunk_hash, m.chunk_text, m.distance, places.occurrences, counted.occurrence_count "
+                f"FROM m {occurrences_sql(preferred)} ORDER BY m.distance;")
+        params += preferred_params + preferred_params + [RETRIEVAL_MAX_OCCURRENCES]
+        return [
+            make_hit(chunk_hash, chunk_text, distance, occurrences, occurrence_count)
+            for chunk_hash, chunk_text, distance, occurrences, occurrence_count
+            in self._query(sql, params, vector_search=True)
+        ]
+
+    def expand(self, hits, hops=RETRIEVAL_EXPAND_HOPS, limit=RETRIEVAL_EXPAND_LIMIT,
+               per_target=RETRIEVAL_EXPAND_PER_TARGET):
+        """Chunks reached from `hits` by following up to `hops` RUN/{include} references."""
+        if not hits or hops <= 0 or limit <= 0:
+            return []
+        params = {'seeds': [hit['chunk_hash'] for hit in hits], 'hops': hops, 'limit': limit,
+                  'per_target': per_target, 'max_occurrences': RETRIEVAL_MAX_OCCURRENCES}
+        sql = EXPANSION_SQL.format(occurrences=occurrences_sql(limit='%(max_occurrences)s'))
+        return [
+            make_hit(chunk_hash, chunk_text, None, occurrences, occurrence_count, hops=depth, via=via)
+            for chunk_hash, chunk_text, depth, via, occurrences, occurrence_count
+            in self._query(sql, params, stage='graph_expansion')
+        ]
+
+    def search(self, query, k=RETRIEVAL_TOP_K, path_prefix=None, expand=True):
+        """Returns up to k hits as dicts with file_path, procedure_name, chunk_text and distance,
+        followed (with expand) by up to RETRIEVAL_EXPAND_LIMIT chunks they reference.
+
+        Lexical search runs first. When the question names identifiers (procedures, include
+        files, hyphenated ABL names) and they are found, those hits are the answer and the
+        embedding API is not called at all; otherwise lexical and vector results are merged
+        with reciprocal rank fusion. distance is None for chunks only found lexically.
+        """
+        started = time.perf_counter()
+        identifiers = identifier_terms(query)
+        terms = identifiers or keyword_terms(query)
+        lexical = self.lexical_search(terms, k, path_prefix, identifiers=bool(identifiers)) if terms else []
+        if identifiers and lexical:
+            hits = lexical
+            logger.debug(f"Identifier query answered lexically with {len(lexical)} chunks "
+                         f"in {(time.perf_counter() - started) * 1000:.1f} ms.")
+        else:
+            vector = self.vector_search(query, k, path_prefix)
+            hits = rrf_fuse([lexical, vector], k)
+            logger.debug(f"Retrieved {len(hits)} chunks ({len(lexical)} lexical, {len(vector)} vector) "
+                         f"in {(time.perf_counter() - started) * 1000:.1f} ms.")
+        if expand:
+            try:
+                hits = hits + self.expand(hits)
+            except Exception as e:
+                # The references only add context; the hits stand on their own.
+                logger.warning(f"Graph expansion failed, using the search hits alone: {e}")
+        return hits
+
+# Hyphenated or underscored ABL names, file names with an ABL extension, or `quoted` words.
+_IDENTIFIER_RE = re.compile(
+    r'`([^`\s]+)`'
+    r'|((?:[\w./\\-]+/)?[\w-]+\.(?:p|i|w|cls|t|df)\b)'
+    r'|\b([A-Za-z_][\w]*(?:[-_][\w]+)+)\b',
+    re.IGNORECASE
+)
+_WORD_RE = re.compile(r'[A-Za-z][\w-]{2,}')
+_STOP_WORDS = frozenset(
+    'the and for are was what does how where when which who why with this that from into have has '
+    'can could should would will use used uses using code file files procedure procedures function '
+    'functions program programs about explain show find tell there their them then than'.split()
+)
+
+def identifier_terms(query):
+    """Lowercased identifiers named in the question, e.g. 'ip-calc-tax' or 'gltrans.p'."""
+    terms = []
+    for match in _IDENTIFIER_RE.finditer(query):
+        term = next(group for group in match.groups() if group).lower()
+        if term not in terms:
+            terms.append(term)
+    return terms
+
+def keyword_terms(query):
+    """Lowercased significant words of a natural-language question, for the lexical leg."""
+    terms = []
+    for word in _WORD_RE.findall(query):
+        word = word.lower()
+        if word not in _STOP_WORDS and word not in terms:
+            terms.append(word)
+    return terms
+
+def rrf_fuse(result_lists, k, constant=60):
+    """Merges ranked hit lists with reciprocal rank fusion: score = sum of 1 / (constant + rank)."""
+    scores = {}
+    merged = {}
+    for results in result_lists:
+        for rank, hit in enumerate(results, start=1):
+            key = hit['chunk_hash']
+            scores[key] = scores.get(key, 0.0) + 1.0 / (constant + rank)
+            if key not in merged or merged[key]['distance'] is None:
+                merged[key] = hit
+    ranked = sorted(scores, key=scores.get, reverse=True)
+    return [merged[key] for key in ranked[:k]]
+
+def chunk_heading(hit):
+    """The label of a chunk in the prompt, e.g. '--- a.p (main) [also in 2 other places] ---'."""
+    others = hit.get('occurrence_count', 1) - 1
+    also = f" [also in {others} other place{'s' if others > 1 else ''}]" if others > 0 else ""
+    via = f" [referenced: {hit['via']}]" if hit.get('via') else ""
+    return f"--- {hit['file_path']} ({hit['procedure_name']}){also}{via} ---"
+
+def source_list(hits):
+    """The hits without their text, as returned to API clients."""
+    return [
+        {'file_path': hit['file_path'], 'procedure_name': hit['procedure_name'],
+         'distance': round(hit['distance'], 4) if hit['distance'] is not None else None,
+         'occurrences': hit.get('occurrences', []), 'occurrence_count': hit.get('occurrence_count', 1),
+         'hops': hit.get('hops', 0), 'via': hit.get('via')}
+        for hit in hits
+    ]
@@ -0,0 +1,301 @@
+# app/session_store.py
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from contextlib import nullcontext
+
+from flask.sessions import SessionInterface, SessionMixin
+from itsdangerous import BadSignature, Signer
+from werkzeug.datastructures import CallbackDict
+
+logger = logging.getLogger(__name__)
+
+class QuotaExceeded(Exception):
+    """Raised when an upload would take a session or the store over its size quota."""
+
+class MemoryStore:
+    """Sessions and uploaded files held in this process, with TTL expiry and size quotas.
+
+    Fast and dependency-free, but private to one process: with several app replicas or
+    workers use PostgresStore, or every request of a session must reach the same process.
+    """
+
+    def __init__(self, session_quota_bytes, total_quota_bytes):
+        self.session_quota_bytes = session_quota_bytes
+        self.total_quota_bytes = total_quota_bytes
+        self._sessions = {}
+        self._uploads = {}
+        self._lock = threading.Lock()
+
+    def get_session(self, session_id):
+        with self._lock:
+            entry = self._sessions.get(session_id)
+            if entry is None or entry[1] <= time.time():
+                return None
+            return json.loads(entry[0])
+
+    def save_session(self, session_id, data, ttl):
+        with self._lock:
+            self._sessions[session_id] = (json.dumps(data), time.time() + ttl)
+
+    def touch_session(self, session_id, ttl):
+        with self._lock:
+            entry = self._sessions.get(session_id)
+            if entry is not None:
+                self._sessions[session_id] = (entry[0], time.time() + ttl)
+
+    def delete_session(self, session_id):
+        with self._lock:
+            self._sessions.pop(session_id, None)
+            for upload_id in [u for u, entry in self._uploads.items() if entry[0] == session_id]:
+                del self._uploads[upload_id]
+
+    def save_upload(self, session_id, upload_id, filename, data, replaces=None):
+        """Stores an upload; the upload it `replaces` (deleted after) is left out of the quotas."""
+        with self._lock:
+            kept = [entry for u, entry in self._uploads.items() if u != replaces]
+            session_bytes = sum(len(entry[2]) for entry in kept if entry[0] == session_id)
+            total_bytes = sum(len(entry[2]) for entry in kept)
+            if session_bytes + len(data) > self.session_quota_bytes:
+                raise QuotaExceeded("This session's upload quota is used up.")
+            if total_bytes + len(data) > self.total_quota_bytes:
+                raise QuotaExceeded("Upload storage is full.")
+            self._uploads[upload_id] = (session_id, filename, data)
+
+    def get_upload(self, upload_id):
+        """Returns (session_id, filename, data), or None."""
+        with self._lock:
+            return self._uploads.get(upload_id)
+
+    def delete_upload(self, upload_id):
+        with self._lock:
+            self._uploads.pop(upload_id, None)
+
+    def sweep(self):
+        """Drops expired sessions and uploads whose session is gone; returns (sessions, uploads) removed."""
+        now = time.time()
+        with self._lock:
+            expired = [sid for sid, (_, expires_at) in self._sessions.items() if expires_at <= now]
+            for sid in expired:
+                del self._sessions[sid]
+            orphans = [u for u, entry in self._uploads.items() if entry[0] not in self._sessions]
+            for upload_id in orphans:
+                del self._uploads[upload_id]
+        return len(expired), len(orphans)
+
+class PostgresStore:
+    """Sessions and uploaded files in app_db (tables app_sessions and app_uploads, see migrations).
+
+    Shared by every worker and replica, so requests of one session can go anywhere.
+    `pool` is the app_db db.EnginePool.
+    """
+
+    def __init__(self, pool, session_quota_bytes, total_quota_bytes):
+        self.pool = pool
+        self.session_quota_bytes = session_quota_bytes
+        self.total_quota_bytes = total_quota_bytes
+
+    def _execute(self, sql, params=(), fetch=False):
+        with self.pool.connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute(sql, params)
+                rows = cur.fetchall() if fetch else None
+                count = cur.rowcount
+            conn.commit()
+        return rows if fetch else count
+
+    def get_session(self, session_id):
+        rows = self._execute(
+            "SELECT data FROM app_sessions WHERE session_id = %s AND expires_at > NOW();", (session_id,), fetch=True
+        )
+        # psycopg2 decodes JSONB itself.
+        return rows[0][0] if rows else None
+
+    def save_session(self, session_id, data, ttl):
+        self._execute("""
+            INSERT INTO app_sessions (session_id, data, expires_at)
+            VALUES (%s, %s, NOW() + make_interval(secs => %s))
+            ON CONFLICT (session_id) DO UPDATE SET data = EXCLUDED.data, expires_at = EXCLUDED.expires_at;
+        """, (session_id, json.dumps(data), ttl))
+
+    def touch_session(self, session_id, ttl):
+        self._execute(
+            "UPDATE app_sessions SET expires_at = NOW() + make_interval(secs => %s) WHERE session_id = %s;",
+            (ttl, session_id)
+        )
+
+    def delete_session(self, session_id):
+        self._execute("DELETE FROM app_uploads WHERE session_id = %s;", (session_id,))
+        self._execute("DELETE FROM app_sessions WHERE session_id = %s;", (session_id,))
+
+    def save_upload(self, session_id, upload_id, filename, data, replaces=None):
+        """Stores an upload; the upload it `replaces` (deleted after) is left out of the quotas."""
+        import psycopg2
+        with self.pool.connection() as conn:
+            with conn.cursor() as cur:
+                # Serialise quota checks so concurrent uploads cannot both squeeze under it.
+                cur.execute("LOCK TABLE app_uploads IN SHARE ROW EXCLUSIVE MODE;")
+                cur.execute("""
+                    SELECT COALESCE(SUM(size) FILTER (WHERE session_id = %s), 0), COALESCE(SUM(size), 0)
+                    FROM app_uploads
+                    WHERE upload_id IS DISTINCT FROM %s;
+                """, (session_id, replaces))
+                session_bytes, total_bytes = cur.fetchone()
+                if session_bytes + len(data) > self.session_quota_bytes:
+                    raise QuotaExceeded("This session's upload quota is used up.")
+                if total_bytes + len(data) > self.total_quota_bytes:
+                    raise QuotaExceeded("Upload storage is full.")
+                cur.execute(
+                    "INSERT INTO app_uploads (upload_id, session_id, filename, size, data) VALUES (%s, %s, %s, %s, %s);",
+                    (upload_id, session_id, filename, len(data), psycopg2.Binary(data))
+                )
+            conn.commit()
+
+    def get_upload(self, upload_id):
+        rows = self._execute(
+            "SELECT session_id, filename, data FROM app_uploads WHERE upload_id = %s;", (upload_id,), fetch=True
+        )
+        return (rows[0][0], rows[0][1], bytes(rows[0][2])) if rows else None
+
+    def delete_upload(self, upload_id):
+        self._execute("DELETE FROM app_uploads WHERE upload_id = %s;", (upload_id,))
+
+    def sweep(self):
+        sessions = self._execute("DELETE FROM app_sessions WHERE expires_at <= NOW();")
+        uploads = self._execute("""
+            DELETE FROM app_uploads u
+            WHERE NOT EXISTS (SELECT 1 FROM app_sessions s WHERE s.session_id = u.session_id);
+        """)
+        return sessions, uploads
+
+def sweep_legacy_upload_dir(directory, max_age):
+    """Deletes files older than max_age seconds left in the old uploads/ directory."""
+    if not os.path.isdir(directory):
+        return 0
+    removed = 0
+    cutoff = time.time() - max_age
+    for entry in os.scandir(directory):
+        try:
+            if entry.is_file() and entry.stat().st_mtime < cutoff:
+                os.remove(entry.path)
+                removed += 1
+        except OSError as e:
+            logger.warning(f"Could not remove old upload {entry.path}: {e}")
+    return removed
+
+class Sweeper:
+    """Runs `sweep` every `interval` seconds on a daemon thread."""
+
+    def __init__(self, sweep, interval):
+        self.sweep = sweep
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="store-sweeper", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.sweep()
+            except Exception as e:
+                logger.error(f"Error sweeping expired sessions and uploads: {e}")
+
+    def stop(self):
+        self._stop.set()
+
+class ServerSession(CallbackDict, SessionMixin):
+    """A session dict that tracks whether a request read it, so requests that never look
+    at the session do not push its expiry out (a store write and a Set-Cookie each)."""
+
+    def __init__(self, initial=None, sid=None, new=False):
+        def on_update(self):
+            self.modified = True
+            self.accessed = True
+        super().__init__(initial, on_update)
+        self.sid = sid
+        self.new = new
+        self.modified = False
+        self.accessed = False
+
+    def __getitem__(self, key):
+        self.accessed = True
+        return super().__getitem__(key)
+
+    def get(self, key, default=None):
+        self.accessed = True
+        return super().get(key, default)
+
+    def __contains__(self, key):
+        self.accessed = True
+        return super().__contains__(key)
+
+class StoreSessionInterface(SessionInterface):
+    """Flask sessions kept server side in a MemoryStore or PostgresStore.
+
+    The cookie carries only a signed random session id. A session expires `ttl` seconds
+    after the last request that used it: reading it pushes the expiry out, changing it
+    rewrites it, and requests that do neither leave the store and the cookie alone.
+    `timer(stage)`, if given, times store reads ('session_read') and writes ('session_write');
+    `on_delete(sid)`, if given, is called after a cleared session is deleted from the store.
+    """
+
+    def __init__(self, store, ttl, timer=None, on_delete=None):
+        self.store = store
+        self.ttl = ttl
+        self.timer = timer or (lambda stage: nullcontext())
+        self.on_delete = on_delete
+
+    def _signer(self, app):
+        return Signer(app.secret_key, salt='palantir-session')
+
+    def open_session(self, app, request):
+        cookie = request.cookies.get(self.get_cookie_name(app))
+        if cookie:
+            try:
+                sid = self._signer(app).unsign(cookie).decode()
+                with self.timer('session_read'):
+                    data = self.store.get_session(sid)
+                if data is not None:
+                    return ServerSession(data, sid=sid)
+            except BadSignature:
+                pass
+            except Exception as e:
+                logger.error(f"Error loading session, starting a new one: {e}")
+        return ServerSession(sid=uuid.uuid4().hex, new=True)
+
+    def save_session(self, app, session, response):
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+        if not session:
+            if session.modified and not session.new:
+                with self.timer('session_write'):
+                    self.store.delete_session(session.sid)
+                if self.on_delete:
+                    try:
+                        self.on_delete(session.sid)
+                    except Exception as e:
+                        logger.error(f"Error cleaning up after deleted session: {e}")
+                response.delete_cookie(name, domain=domain, path=path)
+            return
+        if session.modified or session.new:
+            with self.timer('session_write'):
+                self.store.save_session(session.sid, dict(session), self.ttl)
+        elif session.accessed:
+            with self.timer('session_write'):
+                self.store.touch_session(session.sid, self.ttl)
+        else:
+            return
+        response.set_cookie(
+            name,
+            self._signer(app).sign(session.sid.encode()).decode(),
+            max_age=self.ttl,
+            httponly=self.get_cookie_httponly(app),
+            secure=self.get_cookie_secure(app),
+            samesite=self.get_cookie_samesite(app),
+            domain=domain,
+            path=path,
+        )
@@ -0,0 +1,76 @@
+# palproj/app/tests/conftest.py
+import os
+import sys
+
+import pytest
+
+# Make the app modules importable when pytest is run from any directory, and the
+# modules in shared/ (on PYTHONPATH in the container) too.
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+sys.path.insert(1, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..', 'shared')))
+
+# Database tests run against their own scratch database next to app_db, never against
+# palantir_app_db itself; they are skipped when no server is reachable.
+TEST_APP_DB_NAME = os.environ.get("TEST_APP_DB_NAME", "palantir_test")
+
+
+@pytest.fixture
+def main_module(monkeypatch):
+    """The app with the fake LLM and embeddings, no retrieval hits and no database writes.
+
+    Each test gets an empty answer cache and conversation memory.
+    """
+    pytest.importorskip("flask_sqlalchemy")
+    pytest.importorskip("langchain_google_genai")
+    # main picks the fakes at import time.
+    monkeypatch.setenv("LLM_FAKE_LATENCY_SEC", os.environ.get("LLM_FAKE_LATENCY_SEC") or "0")
+    monkeypatch.setenv("EMBED_FAKE_LATENCY_SEC", os.environ.get("EMBED_FAKE_LATENCY_SEC") or "0")
+    import main
+    from llm_cache import AnswerCache
+    from prompt_builder import ConversationMemory
+
+    monkeypatch.setattr(main.retriever, "search", lambda query, k=None, path_prefix=None: [])
+    monkeypatch.setattr(main, "fetch_history_page", lambda session_id, limit, before=None: [])
+    monkeypatch.setattr(main.history_writer, "submit", lambda session_id, query, answer: None)
+    monkeypatch.setattr(main, "answer_cache", AnswerCache(model=main.LLM_MODEL))
+    monkeypatch.setattr(main, "conversation_memory", ConversationMemory(max_turns=3))
+    return main
+
+
+@pytest.fixture
+def app_db_pool():
+    """A db.EnginePool on an empty TEST_APP_DB_NAME, created if needed."""
+    psycopg2 = pytest.importorskip("psycopg2")
+    from sqlalchemy import create_engine
+    from sqlalchemy.engine import URL
+    from db import EnginePool
+
+    server = dict(
+        host=os.environ.get("APP_DB_HOST", "app_db"),
+        user=os.environ.get("APP_DB_USER", "palantir_user"),
+        password=os.environ.get("APP_DB_PASSWORD"),
+        connect_timeout=3,
+    )
+    try:
+        admin = psycopg2.connect(database=os.environ.get("APP_DB_NAME", "palantir_app_db"), **server)
+    except psycopg2.OperationalError as e:
+        pytest.skip(f"app_db is not reachable: {e}")
+    admin.autocommit = True
+    try:
+        with admin.cursor() as cur:
+            cur.execute("SELECT 1 FROM pg_database WHERE datname = %s;", (TEST_APP_DB_NAME,))
+            if cur.fetchone() is None:
+                cur.execute(f'CREATE DATABASE "{TEST_APP_DB_NAME}";')
+    finally:
+        admin.close()
+    engine = create_engine(URL.create(
+        "postgresql+psycopg2", username=server['user'], password=server['password'], host=server['host'],
+        database=TEST_APP_DB_NAME,
+    ))
+    pool = EnginePool(engine)
+    with pool.connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute("DROP SCHEMA public CASCADE; CREATE SCHEMA public;")
+        conn.commit()
+    yield pool
+    engine.dispose()
@@ -0,0 +1,86 @@
+# palproj/app/tests/test_chat_stream.py
+import json
+
+from fake_llm import FakeMessage
+
+
+def sse_frames(body):
+    """Parses an event stream into (event name or None, decoded data) pairs."""
+    frames = []
+    for block in body.split("\n\n"):
+        if not block:
+            continue
+        event, data = None, []
+        for line in block.split("\n"):
+            field, _, value = line.partition(": ")
+            if field == "event":
+                event = value
+            else:
+                assert field == "data", line
+                data.append(value)
+        frames.append((event, json.loads("\n".join(data))))
+    return frames
+
+
+def stream(client, query, **params):
+    response = client.get(f"/chat_stream/{query}", query_string=params)
+    assert response.status_code == 200
+    assert response.mimetype == "text/event-stream"
+    return sse_frames(response.get_data(as_text=True))
+
+
+def test_sse_event_keeps_multi_line_data_on_one_data_line(main_module):
+    assert main_module.sse_event({"token": "a\nb"}) == 'data: {"token": "a\\nb"}\n\n'
+    assert main_module.sse_event([], event="sources") == "event: sources\ndata: []\n\n"
+
+
+def test_stream_sends_sources_tokens_and_done(main_module, monkeypatch):
+    pieces = ["first line\nsecond line", "", "\n\nend"]
+    monkeypatch.setattr(main_module.llm, "stream", lambda messages: iter(map(FakeMessage, pieces)))
+    frames = stream(main_module.app.test_client(), "what does it do", nocache="1")
+
+    assert frames[0] == ("sources", [])
+    # Empty chunks are not sent; newlines inside tokens survive the framing.
+    assert frames[1:-1] == [(None, {"token": "first line\nsecond line"}), (None, {"token": "\n\nend"})]
+    event, done = frames[-1]
+    assert event == "done"
+    assert done["cached"] is False and done["total_ms"] >= done["ttft_ms"] >= 0
+    assert main_module.llm_gate.stats()["in_flight"] == 0
+
+
+def test_repeated_stream_is_answered_from_the_cache(main_module):
+    # Separate sessions, so neither has any history in its prompt.
+    first = stream(main_module.app.test_client(), "cache me")
+    second = stream(main_module.app.test_client(), "cache me")
+    answer = "".join(data["token"] for event, data in first if event is None)
+    assert [frame for frame in second if frame[0] is None] == [(None, {"token": answer})]
+    assert second[-1][0] == "done" and second[-1][1]["cached"] is True
+
+
+def test_llm_failure_mid_stream_ends_with_an_error_event(main_module, monkeypatch):
+    def failing_stream(messages):
+        yield FakeMessage("partial")
+        raise RuntimeError("upstream went away")
+
+    monkeypatch.setattr(main_module.llm, "stream", failing_stream)
+    frames = stream(main_module.app.test_client(), "break please")
+
+    assert [event for event, _ in frames] == ["sources", None, "error"]
+    assert frames[-1][1] == {"message": "Error communicating with LLM: upstream went away"}
+    assert main_module.llm_gate.stats()["in_flight"] == 0
+    assert main_module.answer_cache.stats()["size"] == 0
+
+
+def test_conversation_history_is_part_of_the_answer_key(main_module):
+    # The same question is a different prompt after another turn, so it is answered afresh
+    # rather than from the cache or a call shared with another session.
+    client = main_module.app.test_client()
+    calls = main_module.llm.calls
+    first = client.get("/chat/and the second one").get_json()
+    follow_up = client.get("/chat/and the second one").get_json()
+    assert (first["cached"], follow_up["cached"]) == (False, False)
+    assert main_module.llm.calls == calls + 2
+
+    # A new session with no history gets the first answer again.
+    fresh = main_module.app.test_client().get("/chat/and the second one").get_json()
+    assert fresh["cached"] is True and fresh["response"] == first["response"]
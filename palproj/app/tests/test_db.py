@@ -0,0 +1,63 @@
+# palproj/app/tests/test_db.py
+import pytest
+from flask import Flask
+
+from db import init_db
+
+
+@pytest.fixture
+def pools(tmp_path, monkeypatch):
+    """init_db's (app_db, vector_db) pools, on two SQLite files instead of PostgreSQL."""
+    monkeypatch.setenv("APP_DATABASE_URL", f"sqlite:///{tmp_path / 'app.sqlite3'}")
+    monkeypatch.setenv("VECTOR_DATABASE_URL", f"sqlite:///{tmp_path / 'vector.sqlite3'}")
+    monkeypatch.setenv("APP_DB_POOL_SIZE", "2")
+    monkeypatch.setenv("VECTOR_DB_POOL_SIZE", "3")
+    monkeypatch.setenv("DB_POOL_MAX_OVERFLOW", "1")
+    monkeypatch.setenv("DB_POOL_TIMEOUT_SEC", "4")
+    monkeypatch.setenv("DB_POOL_RECYCLE_SEC", "60")
+    app_pool, vector_pool = init_db(Flask(__name__))
+    yield app_pool, vector_pool
+    for pool in (app_pool, vector_pool):
+        pool.engine.dispose()
+
+
+def test_pools_are_configured_from_the_environment(pools):
+    app_pool, vector_pool = pools
+    assert app_pool.engine.url.database.endswith("app.sqlite3")
+    assert vector_pool.engine.url.database.endswith("vector.sqlite3")
+    assert app_pool.engine.pool.size() == 2
+    # The vector bind has its own pool size and shares the other options.
+    assert vector_pool.engine.pool.size() == 3
+    for pool in pools:
+        assert pool.engine.pool._max_overflow == 1
+        assert pool.engine.pool._timeout == 4
+        assert pool.engine.pool._recycle == 60
+        assert pool.engine.pool._pre_ping is True
+
+
+def test_connections_are_reused_and_returned(pools):
+    app_pool, _ = pools
+    with app_pool.connection() as conn:
+        first = conn.dbapi_connection
+        assert app_pool.status()['checked_out'] == 1
+        cur = conn.cursor()
+        cur.execute("CREATE TABLE t (x INTEGER);")
+        conn.commit()
+    assert app_pool.status() == {'size': 2, 'checked_out': 0, 'checked_in': 1, 'overflow': -1}
+    with app_pool.connection() as conn:
+        assert conn.dbapi_connection is first
+    assert app_pool.ping() == 1
+    assert app_pool.status()['checked_out'] == 0
+
+
+def test_a_failing_block_still_returns_its_connection(pools):
+    app_pool, _ = pools
+    with pytest.raises(RuntimeError):
+        with app_pool.connection() as conn:
+            conn.cursor().execute("SELECT 1;")
+            raise RuntimeError("query failed")
+    assert app_pool.status()['checked_out'] == 0
+    with app_pool.connection() as conn:
+        cur = conn.cursor()
+        cur.execute("SELECT 1;")
+        assert cur.fetchone() == (1,)
@@ -0,0 +1,59 @@
+# palproj/app/tests/test_history_writer.py
+import threading
+import time
+
+from history_writer import HistoryWriter
+
+
+class RecordingSink:
+    def __init__(self, fail_first=False):
+        self.batches = []
+        self.fail_first = fail_first
+        self.lock = threading.Lock()
+
+    def __call__(self, rows):
+        with self.lock:
+            if self.fail_first:
+                self.fail_first = False
+                raise RuntimeError("app_db unavailable")
+            self.batches.append(list(rows))
+
+
+def test_full_batches_are_written_without_waiting_for_the_interval():
+    sink = RecordingSink()
+    writer = HistoryWriter(sink, batch_size=3, flush_interval=60)
+    for i in range(6):
+        writer.submit("s1", f"q{i}", f"a{i}")
+    deadline = time.monotonic() + 2
+    while writer.stats()['written'] < 6 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert [len(batch) for batch in sink.batches] == [3, 3]
+    assert [row[1] for row in sink.batches[0]] == ["q0", "q1", "q2"]
+    writer.close()
+
+
+def test_partial_batch_is_flushed_after_the_interval_and_on_close():
+    sink = RecordingSink()
+    writer = HistoryWriter(sink, batch_size=100, flush_interval=0.05)
+    writer.submit("s1", "q", "a")
+    time.sleep(0.3)
+    assert len(sink.batches) == 1
+
+    writer.submit("s1", "last", "turn")
+    writer.close()
+    assert sink.batches[-1][0][1] == "last"
+
+
+def test_overflow_is_dropped_and_errors_are_counted():
+    blocker = threading.Event()
+    writer = HistoryWriter(lambda rows: blocker.wait(), max_queue=2, batch_size=1, flush_interval=0.01)
+    for i in range(10):
+        writer.submit("s1", "q", "a")
+    assert writer.stats()['dropped'] >= 7
+    blocker.set()
+    writer.close()
+
+    failing = HistoryWriter(RecordingSink(fail_first=True), batch_size=1, flush_interval=0.01)
+    failing.submit("s1", "q", "a")
+    failing.close()
+    assert failing.stats()['errors'] == 1
@@ -0,0 +1,54 @@
+# palproj/app/tests/test_llm_cache.py
+import time
+
+from llm_cache import AnswerCache, cache_key, normalize_query
+
+
+class MemoryStore:
+    def __init__(self):
+        self.items = {}
+
+    def get(self, key):
+        return self.items.get(key)
+
+    def put(self, key, answer, model, ttl):
+        self.items[key] = answer
+
+    def delete(self, key):
+        self.items.pop(key, None)
+
+
+def test_key_ignores_spelling_but_not_context_or_model():
+    base = cache_key("How is the GL period closed?", "system", "ctx", "model-a")
+    assert normalize_query("  How is the GL   period closed? ") == "how is the gl period closed"
+    assert cache_key("how is the gl period closed", "system", "ctx", "model-a") == base
+    assert cache_key("How is the GL period closed?", "system", "other ctx", "model-a") != base
+    assert cache_key("How is the GL period closed?", "system", "ctx", "model-b") != base
+    assert cache_key("How is the GL period closed?", "other system", "ctx", "model-a") != base
+
+
+def test_lru_and_ttl_eviction():
+    cache = AnswerCache(maxsize=2, ttl=60)
+    cache.put("a", "A")
+    cache.put("b", "B")
+    assert cache.get("a") == "A"
+    cache.put("c", "C")
+    assert cache.get("b") is None
+
+    expiring = AnswerCache(maxsize=2, ttl=0.01)
+    expiring.put("a", "A")
+    time.sleep(0.02)
+    assert expiring.get("a") is None
+
+
+def test_store_hits_are_counted_and_invalidate_clears_both_tiers():
+    store = MemoryStore()
+    AnswerCache(store=store).put("k", "answer")
+    cache = AnswerCache(store=store)
+    assert cache.get("k") == "answer"
+    assert cache.get("k") == "answer"
+    assert cache.get("missing") is None
+    assert cache.stats()['hits'] == 1 and cache.stats()['store_hits'] == 1 and cache.stats()['misses'] == 1
+
+    cache.invalidate("k")
+    assert cache.get("k") is None and "k" not in store.items
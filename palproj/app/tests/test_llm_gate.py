@@ -0,0 +1,134 @@
+# palproj/app/tests/test_llm_gate.py
+import threading
+import time
+
+import pytest
+
+from fake_llm import FakeChatModel, FakeMessage
+from llm_gate import AdmissionController, LLMGate, Overloaded, SingleFlight
+
+
+def run_concurrently(count, fn):
+    results, errors = [None] * count, [None] * count
+
+    def worker(i):
+        try:
+            results[i] = fn(i)
+        except Exception as e:
+            errors[i] = e
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results, errors
+
+
+def test_identical_requests_share_one_upstream_call():
+    llm = FakeChatModel(latency=0.2)
+    gate = LLMGate(AdmissionController(max_concurrent=2, max_queue=10))
+    messages = [FakeMessage("how is the GL period closed")]
+    results, errors = run_concurrently(8, lambda i: gate.call("same-key", lambda: llm.invoke(messages)))
+    assert errors == [None] * 8
+    assert llm.calls == 1
+    assert len({result.content for result, _ in results}) == 1
+    assert sum(shared for _, shared in results) == 7
+    assert gate.stats()['coalesced'] == 7
+
+
+def test_errors_are_shared_too():
+    flight = SingleFlight()
+    started = threading.Event()
+
+    def failing():
+        started.set()
+        time.sleep(0.1)
+        raise ValueError("upstream failed")
+
+    def call(i):
+        if i:
+            started.wait()
+        return flight.do("k", failing)
+
+    _, errors = run_concurrently(3, call)
+    assert all(isinstance(e, ValueError) for e in errors)
+
+
+def test_queue_overflow_is_rejected_with_retry_after():
+    llm = FakeChatModel(latency=0.3)
+    gate = LLMGate(AdmissionController(max_concurrent=1, max_queue=1, queue_timeout=5))
+    messages = [FakeMessage("q")]
+
+    def call(i):
+        time.sleep(0.05 * i)  # arrive in order: runs, queues, rejected
+        return gate.call(f"key-{i}", lambda: llm.invoke(messages))
+
+    _, errors = run_concurrently(3, call)
+    assert errors[0] is None and errors[1] is None
+    assert isinstance(errors[2], Overloaded) and errors[2].retry_after >= 1
+    stats = gate.stats()
+    assert stats['rejected'] == 1 and stats['max_queue_depth'] == 1 and stats['admitted'] == 2
+    assert stats['wait_ms_p95'] > 0
+
+
+def test_queue_timeout():
+    admission = AdmissionController(max_concurrent=1, max_queue=5, queue_timeout=0.05)
+    admission.acquire()
+    with pytest.raises(Overloaded):
+        admission.acquire()
+    admission.release()
+    assert admission.stats()['timed_out'] == 1 and admission.stats()['in_flight'] == 0
+
+
+def wait_for_queue_depth(admission, depth):
+    deadline = time.monotonic() + 2
+    while admission.stats()['queue_depth'] != depth:
+        assert time.monotonic() < deadline
+        time.sleep(0.001)
+
+
+def test_waiters_are_admitted_in_arrival_order():
+    admission = AdmissionController(max_concurrent=1, max_queue=10, queue_timeout=5)
+    admission.acquire()
+    order = []
+
+    def waiter(i):
+        admission.acquire()
+        order.append(i)
+        admission.release()
+
+    threads = []
+    for i in range(5):
+        threads.append(threading.Thread(target=waiter, args=(i,)))
+        threads[-1].start()
+        wait_for_queue_depth(admission, i + 1)
+    admission.release()
+    for thread in threads:
+        thread.join()
+    assert order == [0, 1, 2, 3, 4]
+    assert admission.stats()['in_flight'] == 0
+
+
+def test_a_released_slot_goes_to_the_queue_not_a_newcomer():
+    admission = AdmissionController(max_concurrent=1, max_queue=5, queue_timeout=2)
+    admission.acquire()
+    admitted = threading.Event()
+    queued = threading.Thread(target=lambda: (admission.acquire(), admitted.set()))
+    queued.start()
+    wait_for_queue_depth(admission, 1)
+
+    admission.release()
+    admission.queue_timeout = 0.05
+    with pytest.raises(Overloaded):
+        admission.acquire()  # arrives as the slot frees up, but the queued caller has it
+    queued.join()
+    assert admitted.is_set()
+    stats = admission.stats()
+    assert stats['in_flight'] == 1 and stats['admitted'] == 2 and stats['timed_out'] == 1
+
+
+def test_fake_llm_streams_the_whole_answer():
+    llm = FakeChatModel(latency=0.05, tokens=5)
+    pieces = [chunk.content for chunk in llm.stream([FakeMessage("hello")])]
+    assert len(pieces) > 1 and "".join(pieces) == llm.invoke([FakeMessage("hello")]).content
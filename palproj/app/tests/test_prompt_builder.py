@@ -0,0 +1,45 @@
+# palproj/app/tests/test_prompt_builder.py
+from prompt_builder import ConversationMemory, PromptBudget, drop_near_duplicates, estimate_tokens
+
+
+def hit(name, text):
+    return {'file_path': f"{name}.p", 'procedure_name': name, 'chunk_text': text, 'distance': 0.1}
+
+
+def test_near_duplicates_are_dropped():
+    text = " ".join(f"word{i}" for i in range(50))
+    hits = [hit("a", text), hit("b", text + " extra"), hit("c", "something else entirely, not like the others")]
+    assert [h['procedure_name'] for h in drop_near_duplicates(hits)] == ["a", "c"]
+
+
+def test_budget_is_filled_in_priority_order():
+    budget = PromptBudget(budget_tokens=1000, min_trimmed_tokens=100)
+    code = [hit(f"p{i}", f"RUN step-{i}.\n" * 100) for i in range(5)]  # ~300 tokens each
+    uploads = [hit("upload:notes.txt", "uploaded notes " * 10)]
+    context, report = budget.assemble("system prompt", "what does p0 do?", code_hits=code,
+                                      upload_hits=uploads, history=[("earlier question", "earlier answer")])
+
+    assert report['used'] <= report['budget']
+    assert 1 <= report['code_chunks'] < 5
+    assert report['upload_chunks'] == 0 and report['history_turns'] == 0
+    assert report['skipped'] >= 2
+    assert "--- p0.p (p0) ---" in context and "uploaded notes" not in context
+
+
+def test_everything_fits_in_a_large_budget():
+    budget = PromptBudget(budget_tokens=100_000)
+    history = [("q1", "a1"), ("q2", "a2")]
+    context, report = budget.assemble("system", "question", code_hits=[hit("p", "x = 1.")],
+                                      upload_hits=[hit("upload:f.txt", "notes")], history=history)
+    assert report['code_chunks'] == 1 and report['upload_chunks'] == 1 and report['history_turns'] == 2
+    assert context.index("User: q1") < context.index("User: q2")
+    assert report['used'] >= estimate_tokens(context)
+
+
+def test_conversation_memory_keeps_recent_turns_per_session():
+    memory = ConversationMemory(max_turns=2, max_sessions=1)
+    for i in range(3):
+        memory.add("s1", f"q{i}", f"a{i}")
+    assert memory.recent("s1") == [("q1", "a1"), ("q2", "a2")]
+    memory.add("s2", "q", "a")
+    assert memory.recent("s1") == []
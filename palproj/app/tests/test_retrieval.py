@@ -0,0 +1,139 @@
+# palproj/app/tests/test_retrieval.py
+from retrieval import (LRUCache, VectorRetriever, chunk_heading, identifier_terms, keyword_terms, like_prefix,
+                       make_hit, rrf_fuse, source_list, vector_literal)
+
+
+class CountingEmbeddings:
+    def __init__(self):
+        self.calls = []
+
+    def embed_query(self, text):
+        self.calls.append(text)
+        return [float(len(text)), 0.5]
+
+
+class CannedRetriever(VectorRetriever):
+    """Answers lexical and vector queries from fixed rows instead of vector_db."""
+
+    def __init__(self, embeddings, lexical_rows, vector_rows, related_rows=()):
+        super().__init__(embeddings, pool=None)
+        self.lexical_rows = lexical_rows
+        self.vector_rows = vector_rows
+        self.related_rows = list(related_rows)
+        self.queries = []
+
+    def _query(self, sql, params, vector_search=False, stage=None):
+        self.queries.append((sql, params))
+        if stage == 'graph_expansion':
+            return self.related_rows
+        return self.vector_rows if vector_search else self.lexical_rows
+
+
+def places(file_path, procedure_name='main'):
+    return [{'file_path': file_path, 'procedure_name': procedure_name, 'start_line': 1}]
+
+
+def hit(chunk_hash, distance=None):
+    return {'chunk_hash': chunk_hash, 'file_path': f"{chunk_hash}.p", 'procedure_name': 'main',
+            'chunk_text': 'x', 'distance': distance}
+
+
+def test_lru_cache_evicts_least_recently_used():
+    cache = LRUCache(maxsize=2)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    assert cache.get("a") == 1
+    cache.put("c", 3)
+    assert cache.get("b") is None
+    assert cache.get("a") == 1 and cache.get("c") == 3
+    assert cache.stats() == {'size': 2, 'hits': 3, 'misses': 1}
+
+
+def test_query_embeddings_are_cached_in_process():
+    embeddings = CountingEmbeddings()
+    retriever = VectorRetriever(embeddings, pool=None)
+    assert retriever.embed_query("where is cust-bal updated?") == [26.0, 0.5]
+    retriever.embed_query("where is cust-bal updated?")
+    retriever.embed_query("another question")
+    assert embeddings.calls == ["where is cust-bal updated?", "another question"]
+
+
+def test_like_prefix_matches_literally():
+    assert like_prefix("src/ar_") == "src/ar\\_%"
+    assert like_prefix("100%\\x") == "100\\%\\\\x%"
+
+
+def test_vector_literal_and_sources():
+    assert vector_literal([1, 0.25, -2.5]) == "[1.0,0.25,-2.5]"
+    hits = [{'file_path': 'a.p', 'procedure_name': 'main', 'chunk_text': 'RUN x.', 'distance': 0.123456}]
+    assert chunk_heading(hits[0]) == "--- a.p (main) ---"
+    assert source_list(hits) == [{'file_path': 'a.p', 'procedure_name': 'main', 'distance': 0.1235,
+                                  'occurrences': [], 'occurrence_count': 1, 'hops': 0, 'via': None}]
+
+
+def test_hits_of_shared_chunks_name_their_first_place_and_count_the_rest():
+    places = [{'file_path': 'a.p', 'procedure_name': 'main', 'start_line': 1},
+              {'file_path': 'b.p', 'procedure_name': 'main', 'start_line': 40}]
+    shared = make_hit("h", "RUN x.", None, places, 3)
+    assert (shared['file_path'], shared['start_line'], shared['occurrence_count']) == ('a.p', 1, 3)
+    assert chunk_heading(shared) == "--- a.p (main) [also in 2 other places] ---"
+    assert source_list([shared])[0]['occurrences'] == places
+    assert make_hit("h", "x", 0.5, None, 0)['file_path'] is None
+
+
+def test_identifier_and_keyword_terms():
+    assert identifier_terms("what does ip-calc-tax do") == ["ip-calc-tax"]
+    assert identifier_terms("explain `custbal` in us/bbi/mfdeclre.i") == ["custbal", "us/bbi/mfdeclre.i"]
+    assert identifier_terms("how is the GL period closed") == []
+    assert keyword_terms("how is the GL period closed") == ["period", "closed"]
+
+
+def test_rrf_fuse_prefers_chunks_found_by_both_searches():
+    lexical = [hit("a"), hit("b")]
+    vector = [hit("c", 0.1), hit("b", 0.2)]
+    fused = rrf_fuse([lexical, vector], k=3)
+    assert [h['chunk_hash'] for h in fused] == ["b", "a", "c"]
+    assert fused[0]['distance'] == 0.2
+
+
+def test_identifier_query_skips_the_embedding_api():
+    embeddings = CountingEmbeddings()
+    retriever = CannedRetriever(embeddings, lexical_rows=[("a", "PROCEDURE ip-calc-tax:", places("a.p", "ip-calc-tax"), 1)],
+                                vector_rows=[])
+    hits = retriever.search("what does ip-calc-tax do", k=5, expand=False)
+    assert [h['procedure_name'] for h in hits] == ["ip-calc-tax"]
+    assert embeddings.calls == []
+    assert len(retriever.queries) == 1
+
+
+def test_natural_language_query_fuses_lexical_and_vector_hits():
+    embeddings = CountingEmbeddings()
+    retriever = CannedRetriever(embeddings, lexical_rows=[("a", "x", places("gl/a.p"), 1)],
+                                vector_rows=[("b", "y", 0.3, places("gl/b.p"), 1), ("a", "x", 0.4, places("gl/a.p"), 1)])
+    hits = retriever.search("how is the period closed", k=2, path_prefix="gl/", expand=False)
+    assert [h['chunk_hash'] for h in hits] == ["a", "b"]
+    assert embeddings.calls == ["how is the period closed"]
+    assert all("gl/%" in params and params[-1] == 5 for _, params in retriever.queries)
+
+
+def test_hits_are_followed_by_the_chunks_they_reference():
+    embeddings = CountingEmbeddings()
+    retriever = CannedRetriever(
+        embeddings,
+        lexical_rows=[("a", "PROCEDURE ip-post: RUN ip-calc-tax. END.", places("gl.p", "ip-post"), 1)],
+        vector_rows=[],
+        related_rows=[("b", "PROCEDURE ip-calc-tax: END.", 1, "run ip-calc-tax", places("tax.p", "ip-calc-tax"), 1)],
+    )
+    hits = retriever.search("what does ip-post do", k=5)
+    assert [(h['chunk_hash'], h['hops'], h['via']) for h in hits] == [("a", 0, None), ("b", 1, "run ip-calc-tax")]
+    sql, params = retriever.queries[-1]
+    assert "WITH RECURSIVE" in sql and params['seeds'] == ["a"] and params['hops'] == 1
+    assert chunk_heading(hits[1]) == "--- tax.p (ip-calc-tax) [referenced: run ip-calc-tax] ---"
+    assert embeddings.calls == []
+
+
+def test_failed_expansion_keeps_the_search_hits():
+    retriever = CannedRetriever(CountingEmbeddings(), lexical_rows=[("a", "x", places("a.p", "ip-a"), 1)], vector_rows=[])
+    retriever.related_rows = None  # unpacking fails like a missing chunk_symbols table would
+    assert [h['chunk_hash'] for h in retriever.search("what does ip-a do")] == ["a"]
+    assert retriever.expand([]) == []
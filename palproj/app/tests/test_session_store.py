@@ -0,0 +1,189 @@
+# palproj/app/tests/test_session_store.py
+import io
+import os
+import time
+
+import pytest
+
+pytest.importorskip("flask")
+
+from session_store import (MemoryStore, PostgresStore, QuotaExceeded, ServerSession, StoreSessionInterface,
+                           sweep_legacy_upload_dir)
+
+
+def test_sessions_round_trip_and_expire():
+    store = MemoryStore(1024, 4096)
+    store.save_session("s1", {"uploads": [{"filename": "a.p", "upload_id": "u1"}]}, ttl=60)
+    store.save_session("s2", {"session_id": "s2"}, ttl=-1)
+    assert store.get_session("s1") == {"uploads": [{"filename": "a.p", "upload_id": "u1"}]}
+    assert store.get_session("s2") is None
+    assert store.sweep() == (1, 0)
+
+
+def test_upload_quotas_are_enforced_per_session_and_in_total():
+    store = MemoryStore(session_quota_bytes=10, total_quota_bytes=15)
+    store.save_upload("s1", "u1", "a.p", b"x" * 8)
+    with pytest.raises(QuotaExceeded):
+        store.save_upload("s1", "u2", "b.p", b"x" * 3)
+    store.save_upload("s2", "u3", "c.p", b"x" * 7)
+    with pytest.raises(QuotaExceeded):
+        store.save_upload("s3", "u4", "d.p", b"x")
+    store.delete_upload("u1")
+    store.save_upload("s3", "u4", "d.p", b"x")
+    assert store.get_upload("u4") == ("s3", "d.p", b"x")
+
+
+def test_a_replaced_upload_does_not_count_against_the_quota():
+    store = MemoryStore(session_quota_bytes=10, total_quota_bytes=15)
+    store.save_upload("s1", "u1", "a.p", b"x" * 8)
+    with pytest.raises(QuotaExceeded):
+        store.save_upload("s1", "u2", "a.p", b"y" * 8)
+    store.save_upload("s1", "u2", "a.p", b"y" * 8, replaces="u1")
+    store.save_upload("s2", "u3", "b.p", b"z" * 7, replaces="u1")
+    with pytest.raises(QuotaExceeded):
+        store.save_upload("s2", "u4", "c.p", b"z" * 7, replaces="u3")  # u1 still counts for the total
+
+
+def test_sweep_drops_uploads_of_expired_sessions():
+    store = MemoryStore(1024, 4096)
+    store.save_session("live", {}, ttl=60)
+    store.save_session("gone", {}, ttl=-1)
+    store.save_upload("live", "u1", "a.p", b"keep")
+    store.save_upload("gone", "u2", "b.p", b"drop")
+    assert store.sweep() == (1, 1)
+    assert store.get_upload("u1") is not None
+    assert store.get_upload("u2") is None
+
+
+def test_legacy_upload_dir_sweep_only_removes_old_files(tmp_path):
+    old = tmp_path / "old.p"
+    new = tmp_path / "new.p"
+    old.write_text("x")
+    new.write_text("y")
+    stale = time.time() - 3600
+    os.utime(old, (stale, stale))
+    assert sweep_legacy_upload_dir(str(tmp_path), max_age=60) == 1
+    assert not old.exists() and new.exists()
+
+
+def test_uploads_belong_to_the_stored_session(main_module, monkeypatch):
+    # The upload is saved through StoreSessionInterface under the id the store keeps the
+    # session under, so sweeping keeps it and deleting the session removes it.
+    monkeypatch.setattr(main_module.upload_index, "add", lambda session_id, filename, text: 1)
+    store = main_module.store
+    client = main_module.app.test_client()
+    response = client.post("/upload_context", data={"file": (io.BytesIO(b"RUN x."), "a.p")})
+    assert response.status_code == 200
+    upload_id = response.get_json()["filename"]
+    owner = store.get_upload(upload_id)[0]
+    assert store.get_session(owner)["uploads"] == [{"filename": "a.p", "upload_id": upload_id}]
+
+    store.sweep()
+    assert store.get_upload(upload_id) is not None
+    assert client.get(f"/download/{upload_id}").data == b"RUN x."
+    assert main_module.app.test_client().get(f"/download/{upload_id}").status_code == 404
+
+    store.delete_session(owner)
+    assert store.get_upload(upload_id) is None
+
+
+def test_postgres_store_round_trips_sessions_and_uploads(app_db_pool):
+    with app_db_pool.connection() as conn:
+        with conn.cursor() as cur:
+            # As created by the c3d9e2f4a518 migration.
+            cur.execute("""
+                CREATE TABLE app_sessions (
+                    session_id VARCHAR(64) PRIMARY KEY, data JSONB NOT NULL, expires_at TIMESTAMPTZ NOT NULL
+                );
+                CREATE TABLE app_uploads (
+                    upload_id VARCHAR(512) PRIMARY KEY, session_id VARCHAR(64) NOT NULL, filename TEXT NOT NULL,
+                    size BIGINT NOT NULL, data BYTEA NOT NULL, created_at TIMESTAMPTZ NOT NULL DEFAULT now()
+                );
+            """)
+        conn.commit()
+    store = PostgresStore(app_db_pool, session_quota_bytes=10, total_quota_bytes=100)
+    data = {"session_id": "s1", "uploads": [{"filename": "a.p", "upload_id": "u1"}]}
+    store.save_session("s1", data, ttl=60)
+    store.save_session("s2", {}, ttl=-1)
+    assert store.get_session("s1") == data
+    assert store.get_session("s2") is None
+
+    store.save_upload("s1", "u1", "a.p", b"RUN x.")
+    store.save_upload("s2", "u2", "b.p", b"gone")
+    with pytest.raises(QuotaExceeded):
+        store.save_upload("s1", "u3", "c.p", b"too much")
+    store.save_upload("s1", "u3", "a.p", b"too much", replaces="u1")
+    store.delete_upload("u3")
+    assert store.sweep() == (1, 1)
+    assert store.get_upload("u1") == ("s1", "a.p", b"RUN x.")
+    assert store.get_upload("u2") is None
+
+    store.delete_session("s1")
+    assert store.get_session("s1") is None and store.get_upload("u1") is None
+
+
+def test_only_requests_that_use_the_session_extend_it(main_module, monkeypatch):
+    touched = []
+    monkeypatch.setattr(main_module.store, "touch_session", lambda session_id, ttl: touched.append(session_id))
+    client = main_module.app.test_client()
+    assert "Set-Cookie" in client.get("/history").headers  # creates the session
+
+    response = client.get("/healthz")
+    assert "Set-Cookie" not in response.headers and touched == []
+
+    response = client.get("/history")
+    assert "Set-Cookie" in response.headers and len(touched) == 1
+
+
+def test_server_session_records_reads_and_writes():
+    session = ServerSession({"uploads": []}, sid="s1")
+    assert not session.accessed and not session.modified
+    assert "uploads" in session and session.accessed
+
+    for read in (lambda s: s["uploads"], lambda s: s.get("missing")):
+        session = ServerSession({"uploads": []}, sid="s1")
+        read(session)
+        assert session.accessed and not session.modified
+
+    session = ServerSession(sid="s1", new=True)
+    session["session_id"] = "s1"
+    assert session.accessed and session.modified
+
+
+def test_clearing_a_session_deletes_it_with_its_uploads_and_calls_on_delete():
+    from flask import Flask, session
+
+    store = MemoryStore(1024, 4096)
+    deleted = []
+    app = Flask(__name__)
+    app.secret_key = "test"
+    app.session_interface = StoreSessionInterface(store, 60, on_delete=deleted.append)
+
+    @app.route("/start")
+    def start():
+        session["session_id"] = session.sid
+        store.save_upload(session.sid, "u1", "a.p", b"x")
+        return session.sid
+
+    @app.route("/logout")
+    def logout():
+        session.clear()
+        return ""
+
+    client = app.test_client()
+    sid = client.get("/start").get_data(as_text=True)
+    client.get("/logout")
+    assert deleted == [sid]
+    assert store.get_session(sid) is None and store.get_upload("u1") is None
+
+
+def test_download_encodes_the_stored_filename(main_module, monkeypatch):
+    monkeypatch.setattr(main_module.upload_index, "add", lambda session_id, filename, text: 1)
+    client = main_module.app.test_client()
+    name = "r\u00e9sum\u00e9; v2.p"
+    upload_id = client.post("/upload_context", data={"file": (io.BytesIO(b"RUN x."), name)}).get_json()["filename"]
+    response = client.get(f"/download/{upload_id}")
+    assert response.data == b"RUN x."
+    disposition = response.headers["Content-Disposition"]
+    assert disposition.startswith("attachment;")
+    assert "filename*=UTF-8''r%C3%A9sum%C3%A9%3B%20v2.p" in disposition
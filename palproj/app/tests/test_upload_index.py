@@ -0,0 +1,79 @@
+# palproj/app/tests/test_upload_index.py
+from contextlib import contextmanager
+
+from upload_index import UploadIndex, chunk_upload, decode_upload
+
+
+class RecordingPool:
+    """Stands in for db.EnginePool, recording the SQL run and returning no rows."""
+
+    def __init__(self):
+        self.statements = []
+
+    @contextmanager
+    def connection(self):
+        pool = self
+
+        class Cursor:
+            def __enter__(self):
+                return self
+
+            def __exit__(self, *exc):
+                return False
+
+            def execute(self, sql, params=None):
+                pool.statements.append(" ".join(sql.split()))
+
+            def fetchall(self):
+                return []
+
+        class Connection:
+            def cursor(self):
+                return Cursor()
+
+            def commit(self):
+                pass
+
+        yield Connection()
+
+
+def test_abl_uploads_are_chunked_per_procedure():
+    source = (
+        "DEFINE VARIABLE x AS INTEGER NO-UNDO.\n"
+        "PROCEDURE calc-tax:\n    x = 1.\nEND PROCEDURE.\n"
+        "PROCEDURE post-gl:\n    x = 2.\nEND PROCEDURE.\n"
+    )
+    labels = [label for label, _ in chunk_upload(source, "sotax.P")]
+    assert labels == ["FILE_HEADER", "calc-tax", "post-gl"]
+
+
+def test_other_uploads_are_split_by_size():
+    text = "\n".join(f"line {i} " + "x" * 40 for i in range(100))
+    chunks = chunk_upload(text, "notes.txt", max_chars=500)
+    assert len(chunks) > 1
+    assert all(len(chunk) <= 500 for _, chunk in chunks)
+    assert chunks[0][0] == "PART_1"
+
+
+def test_decode_upload_falls_back_to_latin1():
+    assert decode_upload("café".encode('utf-8')) == "café"
+    assert decode_upload("café".encode('latin-1')) == "café"
+
+
+def test_upload_chunks_table_is_created_at_startup_not_per_request():
+    pool = RecordingPool()
+    index = UploadIndex(pool, embeddings=None)
+    index.create_table()
+    created = len(pool.statements)
+    assert any("CREATE TABLE IF NOT EXISTS upload_chunks" in sql for sql in pool.statements)
+
+    index.search("sid", [0.0, 1.0])
+    index.clear("sid")
+    assert not any(sql.startswith("CREATE") for sql in pool.statements[created:])
+
+
+def test_upload_chunks_table_is_created_late_if_startup_could_not():
+    pool = RecordingPool()
+    UploadIndex(pool, embeddings=None).clear("sid")
+    assert pool.statements[0] == "CREATE EXTENSION IF NOT EXISTS vector;"
+    assert pool.statements[-1] == "DELETE FROM upload_chunks WHERE session_id = %s;"
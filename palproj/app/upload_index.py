@@ -0,0 +1,127 @@
+# app/upload_index.py
+import logging
+
+from openedge_chunker import chunk_openedge_code, split_oversized
+from retrieval import VECTOR_DISTANCE, VECTOR_DISTANCE_OPERATORS, vector_literal
+
+logger = logging.getLogger(__name__)
+
+ABL_EXTENSIONS = ('.p', '.i', '.w', '.cls', '.t')
+
+def chunk_upload(text, filename, max_chars=2000):
+    """Splits an uploaded file into (label, chunk_text) pairs.
+
+    ABL sources go through the same chunker as ingestion, one chunk per procedure or
+    function; anything else is split at line boundaries into pieces of max_chars.
+    """
+    if filename.lower().endswith(ABL_EXTENSIONS):
+        return [(chunk["procedure_name"], chunk["chunk_text"])
+                for chunk in chunk_openedge_code(text, filename, max_chunk_chars=max_chars)]
+    return [(f"PART_{i + 1}", piece) for i, piece in enumerate(split_oversized(text.strip(), max_chars))]
+
+def decode_upload(data):
+    """Decodes uploaded bytes as UTF-8, falling back to Latin-1 as the ingestion scanner does."""
+    try:
+        return data.decode('utf-8')
+    except UnicodeDecodeError:
+        return data.decode('latin-1')
+
+class UploadIndex:
+    """A per-session scratch index of uploaded files in vector_db's upload_chunks table.
+
+    Files are chunked and embedded once, at upload time; each chat turn then pulls only the
+    chunks closest to the question. Rows expire `ttl` seconds after the session last used
+    them and are swept on the next upload. `pool` is the vector_db db.EnginePool.
+    The table is created by create_table() at startup rather than by the requests using it.
+    """
+
+    def __init__(self, pool, embeddings, ttl=24 * 3600, max_chunk_chars=2000):
+        self.pool = pool
+        self.embeddings = embeddings
+        self.ttl = ttl
+        self.max_chunk_chars = max_chunk_chars
+        self._table_ready = False
+
+    def create_table(self):
+        """Creates upload_chunks and its indexes if missing; the app calls this once at startup."""
+        with self.pool.connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute("CREATE EXTENSION IF NOT EXISTS vector;")
+                cur.execute("""
+                    CREATE TABLE IF NOT EXISTS upload_chunks (
+                        id BIGSERIAL PRIMARY KEY,
+                        session_id TEXT NOT NULL,
+                        filename TEXT NOT NULL,
+                        procedure_name TEXT,
+                        chunk_text TEXT NOT NULL,
+                        embedding VECTOR(768),
+                        expires_at TIMESTAMP WITH TIME ZONE NOT NULL
+                    );
+                """)
+                cur.execute("CREATE INDEX IF NOT EXISTS upload_chunks_session_idx ON upload_chunks (session_id, filename);")
+                cur.execute("CREATE INDEX IF NOT EXISTS upload_chunks_expires_at_idx ON upload_chunks (expires_at);")
+            conn.commit()
+        self._table_ready = True
+
+    def _ensure_table(self):
+        # Only does anything if vector_db was unreachable when the app started.
+        if not self._table_ready:
+            self.create_table()
+
+    def add(self, session_id, filename, text):
+        """Chunks and embeds a file for the session, replacing an earlier upload of the same name."""
+        chunks = chunk_upload(text, filename, self.max_chunk_chars)
+        if not chunks:
+            return 0
+        vectors = self.embeddings.embed_documents([chunk_text for _, chunk_text in chunks])
+        rows = [
+            (session_id, filename, label, chunk_text, vector_literal(vector))
+            for (label, chunk_text), vector in zip(chunks, vectors)
+        ]
+        from psycopg2.extras import execute_values
+        self._ensure_table()
+        with self.pool.connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute("DELETE FROM upload_chunks WHERE expires_at <= NOW();")
+                cur.execute("DELETE FROM upload_chunks WHERE session_id = %s AND filename = %s;", (session_id, filename))
+                execute_values(
+                    cur,
+                    "INSERT INTO upload_chunks (session_id, filename, procedure_name, chunk_text, embedding, expires_at) VALUES %s;",
+                    rows,
+                    template=f"(%s, %s, %s, %s, %s::vector, NOW() + make_interval(secs => {int(self.ttl)}))"
+                )
+            conn.commit()
+        logger.info(f"Indexed upload '{filename}' for session {session_id[:8]} as {len(rows)} chunks.")
+        return len(rows)
+
+    def search(self, session_id, query_vector, k=5):
+        """Returns the session's k uploaded chunks closest to the query, extending their expiry."""
+        operator = VECTOR_DISTANCE_OPERATORS.get(VECTOR_DISTANCE, '<=>')
+        self._ensure_table()
+        with self.pool.connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute(
+                    "UPDATE upload_chunks SET expires_at = NOW() + make_interval(secs => %s) "
+                    "WHERE session_id = %s AND expires_at > NOW();",
+                    (int(self.ttl), session_id)
+                )
+                cur.execute(f"""
+                    SELECT filename, procedure_name, chunk_text, embedding {operator} %s::vector AS distance
+                    FROM upload_chunks
+                    WHERE session_id = %s AND expires_at > NOW()
+                    ORDER BY distance LIMIT %s;
+                """, (vector_literal(query_vector), session_id, k))
+                rows = cur.fetchall()
+            conn.commit()
+        return [
+            {'file_path': f"upload:{filename}", 'procedure_name': procedure_name, 'chunk_text': chunk_text,
+             'distance': float(distance)}
+            for filename, procedure_name, chunk_text, distance in rows
+        ]
+
+    def clear(self, session_id):
+        self._ensure_table()
+        with self.pool.connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute("DELETE FROM upload_chunks WHERE session_id = %s;", (session_id,))
+            conn.commit()
@@ -0,0 +1,78 @@
+"""Microbenchmark: the single-pass chunker against the original regex chunker.
+
+Usage: python bench_chunker.py [--procedures 100 500 2000] [--repeat 3]
+"""
+import argparse
+import re
+import time
+
+from openedge_chunker import chunk_openedge_code
+from synthetic_corpus import synthetic_abl_file
+
+def legacy_chunk_openedge_code(file_content, file_path):
+    """The original chunker, kept here as the baseline (and as a reference for tests)."""
+    chunks = []
+    procedure_regex = re.compile(
+        r'(?:PROCEDURE|FUNCTION)\s+(?:PRIVATE|PUBLIC|INTERNAL)?\s*([\w\-.]+)\s*(\(.*?\))?\s*:',
+        re.IGNORECASE | re.DOTALL
+    )
+    last_end = 0
+    for match in procedure_regex.finditer(file_content):
+        pre_code = file_content[last_end:match.start()].strip()
+        if pre_code:
+            chunks.append({
+                "file_path": file_path,
+                "procedure_name": "FILE_HEADER" if last_end == 0 else "INTER_PROCEDURE_CODE",
+                "chunk_text": pre_code
+            })
+        procedure_start = match.start()
+        procedure_name = match.group(1).strip()
+        end_match = re.search(
+            r'(?:END\s+PROCEDURE|END\s+FUNCTION)\s*(\.|,|$)',
+            file_content[procedure_start:],
+            re.IGNORECASE | re.DOTALL
+        )
+        chunk_end = len(file_content)
+        if end_match:
+            chunk_end = procedure_start + end_match.end()
+        chunk_text = file_content[procedure_start:chunk_end].strip()
+        if chunk_text:
+            chunks.append({
+                "file_path": file_path,
+                "procedure_name": procedure_name,
+                "chunk_text": chunk_text
+            })
+        last_end = chunk_end
+    remaining_code = file_content[last_end:].strip()
+    if remaining_code:
+        chunks.append({
+            "file_path": file_path,
+            "procedure_name": "FILE_FOOTER",
+            "chunk_text": remaining_code
+        })
+    return chunks
+
+def best_time(fn, source, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn(source, "bench.w")
+        best = min(best, time.perf_counter() - started)
+    return best
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--procedures', type=int, nargs='+', default=[100, 500, 2000])
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    print(f"{'procedures':>10} {'size KB':>9} {'legacy s':>10} {'new s':>10} {'speedup':>8} {'same':>5}")
+    for procedures in args.procedures:
+        source = synthetic_abl_file(procedures)
+        legacy = best_time(legacy_chunk_openedge_code, source, args.repeat)
+        new = best_time(chunk_openedge_code, source, args.repeat)
+        same = legacy_chunk_openedge_code(source, "bench.w") == chunk_openedge_code(source, "bench.w")
+        print(f"{procedures:>10} {len(source) / 1024:>9.0f} {legacy:>10.4f} {new:>10.4f} {legacy / new:>7.1f}x {str(same):>5}")
+
+if __name__ == '__main__':
+    main()
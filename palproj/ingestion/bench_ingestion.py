@@ -0,0 +1,139 @@
+"""Offline ingestion benchmarks: chunker throughput and end-to-end rows/sec, written to JSON.
+
+Runs against a generated synthetic corpus and fake embeddings (no Google API calls). The
+end-to-end runs need vector_db; they load into a separate database (BENCH_VECTOR_DB_NAME,
+default palantir_bench, created if missing) and never touch the real code_embeddings.
+
+Usage: python bench_ingestion.py [--programs 400] [--windows 20] [--embed-latency 0.05]
+                                 [--skip-db] [--output bench-ingestion.json]
+"""
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+from scanner import iter_source_files, scan_source_file
+from synthetic_corpus import generate_corpus
+
+def bench_chunker(corpus_dir, repeat=3):
+    """Reads, chunks and hashes every corpus file serially; best of `repeat` passes."""
+    files = list(iter_source_files(corpus_dir))
+    total_bytes = sum(os.path.getsize(path) for path, _ in files)
+    best, chunks = float('inf'), 0
+    for _ in range(repeat):
+        started = time.perf_counter()
+        chunks = 0
+        for path, relative_path in files:
+            _, rows, error = scan_source_file(path, relative_path, 8000)
+            if error:
+                raise RuntimeError(f"{relative_path}: {error}")
+            chunks += len(rows)
+        best = min(best, time.perf_counter() - started)
+    return {
+        'files': len(files),
+        'megabytes': round(total_bytes / 1024 / 1024, 2),
+        'chunks': chunks,
+        'seconds': round(best, 4),
+        'files_per_sec': round(len(files) / best, 1),
+        'chunks_per_sec': round(chunks / best, 1),
+        'mb_per_sec': round(total_bytes / 1024 / 1024 / best, 2),
+    }
+
+def ensure_bench_database(name):
+    """Creates the benchmark database next to the configured one if it does not exist."""
+    import psycopg2
+    conn = psycopg2.connect(
+        host=os.environ.get("VECTOR_DB_HOST", "vector_db"),
+        database=os.environ.get("VECTOR_DB_NAME", "palantir_vector_db"),
+        user=os.environ.get("VECTOR_DB_USER", "palantir_vector_user"),
+        password=os.environ.get("VECTOR_DB_PASSWORD"),
+    )
+    conn.autocommit = True
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SELECT 1 FROM pg_database WHERE datname = %s;", (name,))
+            if cur.fetchone() is None:
+                cur.execute(f'CREATE DATABASE "{name}";')
+    finally:
+        conn.close()
+
+def bench_end_to_end(corpus_dir, database, embed_latency, batch_size, workers):
+    """Full (INSERT and COPY) and no-op incremental runs of ingest_codebase on the corpus."""
+    ensure_bench_database(database)
+    # ingestion_script reads its configuration at import time.
+    os.environ.update({
+        'CODE_REPO_PATH': corpus_dir,
+        'VECTOR_DB_NAME': database,
+        'EMBED_FAKE_LATENCY_SEC': str(embed_latency),
+        'EMBEDDING_CACHE_PATH': '',
+    })
+    import ingestion_script
+
+    runs = {}
+    for name, kwargs in (
+        ('full_insert', {'full_rebuild': True}),
+        ('full_copy', {'full_rebuild': True, 'bulk': True}),
+        ('incremental_unchanged', {}),
+    ):
+        stats = ingestion_script.ingest_codebase(batch_size=batch_size, workers=workers, **kwargs)
+        if stats is None:
+            raise RuntimeError(f"Ingestion run {name} could not start")
+        elapsed = stats['elapsed_seconds']
+        runs[name] = {
+            'seconds': round(elapsed, 3),
+            'files_processed': stats['files_processed'],
+            'rows_written': stats['rows_written'],
+            'occurrences_written': stats['occurrences_written'],
+            'rows_per_sec': round(stats['rows_written'] / max(elapsed, 1e-9), 1),
+            'files_per_sec': round(stats['files_processed'] / max(elapsed, 1e-9), 1),
+            'write_seconds': round(stats['write_seconds'], 3),
+            'embedding_requests': stats['embedding']['requests'],
+            'failed_batches': stats['batches_failed'],
+        }
+    return runs
+
+def write_results(path, benchmark, params, results):
+    document = {
+        'benchmark': benchmark,
+        'started_at': datetime.now(timezone.utc).isoformat(),
+        'python': sys.version.split()[0],
+        'platform': platform.platform(),
+        'params': params,
+        'results': results,
+    }
+    with open(path, 'w') as f:
+        json.dump(document, f, indent=2)
+    print(json.dumps(results, indent=2))
+    print(f"Results written to {path}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--programs', type=int, default=400)
+    parser.add_argument('--includes', type=int, default=60)
+    parser.add_argument('--windows', type=int, default=20)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--embed-latency', type=float, default=0.05,
+                        help="Seconds per fake embedding request (default: 0.05).")
+    parser.add_argument('--batch-size', type=int, default=50)
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--database', default=os.environ.get('BENCH_VECTOR_DB_NAME', 'palantir_bench'))
+    parser.add_argument('--skip-db', action='store_true', help="Only run the chunker benchmark.")
+    parser.add_argument('--output', default='bench-ingestion.json')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix="palantir-corpus-") as corpus_dir:
+        corpus = generate_corpus(corpus_dir, args.programs, args.includes, args.windows, seed=args.seed)
+        results = {'corpus': corpus, 'chunker': bench_chunker(corpus_dir, args.repeat)}
+        if not args.skip_db:
+            results['ingestion'] = bench_end_to_end(
+                corpus_dir, args.database, args.embed_latency, args.batch_size, args.workers
+            )
+    write_results(args.output, 'ingestion', vars(args), results)
+
+if __name__ == '__main__':
+    main()
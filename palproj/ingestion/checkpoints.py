@@ -0,0 +1,149 @@
+import json
+import logging
+import random
+import time
+
+logger = logging.getLogger(__name__)
+
+def create_run_tables(cursor):
+    """Creates the tables that record ingestion runs, their committed batches and dead letters.
+
+    A checkpoint row is written in the same transaction as the batch it describes, so the
+    checkpoints of a run are exactly the batches that reached vector_db. Dead letters are
+    the files of batches that still failed after every retry; they are not recorded in
+    the manifest, so the next run tries them again.
+    """
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS ingestion_runs (
+            run_id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
+            mode TEXT NOT NULL,
+            bulk BOOLEAN NOT NULL DEFAULT FALSE,
+            status TEXT NOT NULL DEFAULT 'running',
+            started_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
+            updated_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
+            finished_at TIMESTAMP WITH TIME ZONE,
+            resumed INTEGER NOT NULL DEFAULT 0,
+            batches_committed INTEGER NOT NULL DEFAULT 0,
+            files_committed INTEGER NOT NULL DEFAULT 0,
+            chunks_committed INTEGER NOT NULL DEFAULT 0,
+            stats JSONB
+        );
+    """)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS ingestion_checkpoints (
+            run_id UUID NOT NULL REFERENCES ingestion_runs (run_id) ON DELETE CASCADE,
+            batch_no INTEGER NOT NULL,
+            files INTEGER NOT NULL,
+            chunks INTEGER NOT NULL,
+            occurrences INTEGER NOT NULL,
+            last_file_path TEXT,
+            committed_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
+            PRIMARY KEY (run_id, batch_no)
+        );
+    """)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS ingestion_dead_letters (
+            run_id UUID NOT NULL REFERENCES ingestion_runs (run_id) ON DELETE CASCADE,
+            file_path TEXT NOT NULL,
+            stage TEXT NOT NULL,
+            attempts INTEGER NOT NULL,
+            error TEXT,
+            created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
+            PRIMARY KEY (run_id, file_path)
+        );
+    """)
+    cursor.execute("CREATE INDEX IF NOT EXISTS ingestion_runs_status_idx ON ingestion_runs (status, started_at);")
+
+def start_run(cursor, mode, bulk):
+    """Records a new run and returns its ID.
+
+    A run over the whole tree (mode 'full' or 'incremental') supersedes any unfinished
+    one, which is marked 'abandoned' and can no longer be resumed. Watch-mode runs over
+    a few paths ('paths') leave them alone.
+    """
+    if mode != 'paths':
+        cursor.execute("UPDATE ingestion_runs SET status = 'abandoned', updated_at = NOW() "
+                       "WHERE status IN ('running', 'failed') AND mode <> 'paths';")
+    cursor.execute("INSERT INTO ingestion_runs (mode, bulk) VALUES (%s, %s) RETURNING run_id;", (mode, bulk))
+    return str(cursor.fetchone()[0])
+
+def find_resumable_run(cursor, run_id=None):
+    """Returns (run_id, mode, bulk, batches_committed) of the given or the latest unfinished
+    full/incremental run, or None."""
+    sql = ("SELECT run_id, mode, bulk, batches_committed FROM ingestion_runs "
+           "WHERE status IN ('running', 'failed') AND mode <> 'paths'")
+    params = ()
+    if run_id:
+        sql += " AND run_id = %s"
+        params = (run_id,)
+    cursor.execute(sql + " ORDER BY started_at DESC LIMIT 1;", params)
+    row = cursor.fetchone()
+    return (str(row[0]), row[1], row[2], row[3]) if row else None
+
+def reopen_run(cursor, run_id):
+    cursor.execute("UPDATE ingestion_runs SET status = 'running', resumed = resumed + 1, updated_at = NOW() "
+                   "WHERE run_id = %s;", (run_id,))
+
+def record_checkpoint(cursor, run_id, batch_no, files, chunks, occurrences, last_file_path=None):
+    """Records a batch as committed; call inside the batch's own transaction."""
+    cursor.execute("""
+        INSERT INTO ingestion_checkpoints (run_id, batch_no, files, chunks, occurrences, last_file_path)
+        VALUES (%s, %s, %s, %s, %s, %s);
+    """, (run_id, batch_no, files, chunks, occurrences, last_file_path))
+    cursor.execute("""
+        UPDATE ingestion_runs SET
+            batches_committed = batches_committed + 1,
+            files_committed = files_committed + %s,
+            chunks_committed = chunks_committed + %s,
+            updated_at = NOW()
+        WHERE run_id = %s;
+    """, (files, chunks, run_id))
+
+def next_batch_no(cursor, run_id):
+    cursor.execute("SELECT COALESCE(MAX(batch_no), 0) + 1 FROM ingestion_checkpoints WHERE run_id = %s;", (run_id,))
+    return cursor.fetchone()[0]
+
+def record_dead_letters(cursor, run_id, file_paths, stage, attempts, error):
+    """Records the files of a batch that failed `attempts` times at `stage` (embed | write)."""
+    for file_path in file_paths:
+        cursor.execute("""
+            INSERT INTO ingestion_dead_letters (run_id, file_path, stage, attempts, error)
+            VALUES (%s, %s, %s, %s, %s)
+            ON CONFLICT (run_id, file_path) DO UPDATE SET
+                stage = EXCLUDED.stage,
+                attempts = ingestion_dead_letters.attempts + EXCLUDED.attempts,
+                error = EXCLUDED.error,
+                created_at = NOW();
+        """, (run_id, file_path, stage, attempts, str(error)[:2000]))
+
+def finish_run(cursor, run_id, status, stats=None):
+    cursor.execute("UPDATE ingestion_runs SET status = %s, stats = %s, finished_at = NOW(), updated_at = NOW() "
+                   "WHERE run_id = %s;", (status, json.dumps(stats, default=str) if stats else None, run_id))
+
+def prune_runs(cursor, retention_days):
+    """Deletes runs that can no longer be resumed (and their checkpoints and dead letters)
+    once they are older than retention_days."""
+    if retention_days <= 0:
+        return 0
+    cursor.execute("DELETE FROM ingestion_runs WHERE (status IN ('completed', 'abandoned') OR mode = 'paths') "
+                   "AND updated_at < NOW() - make_interval(days => %s);", (retention_days,))
+    return cursor.rowcount
+
+def retry_with_backoff(attempt, max_attempts=3, backoff_base=2.0, backoff_max=60.0, label="Batch",
+                       sleep=time.sleep):
+    """Calls attempt(n) for n = 1, 2, ... until it returns without raising.
+
+    Sleeps backoff_base * 2**(n-1) seconds (capped at backoff_max, with jitter) between
+    tries. Returns (result, None, attempts) on success and (None, last_error, attempts)
+    once max_attempts tries have failed.
+    """
+    max_attempts = max(1, max_attempts)
+    for n in range(1, max_attempts + 1):
+        try:
+            return attempt(n), None, n
+        except Exception as e:
+            if n == max_attempts:
+                return None, e, n
+            delay = min(backoff_max, backoff_base * (2 ** (n - 1))) * random.uniform(0.8, 1.2)
+            logger.warning(f"{label} failed (attempt {n}/{max_attempts}), retrying in {delay:.1f}s: {e}")
+            sleep(delay)
@@ -0,0 +1,163 @@
+import logging
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+_QUOTA_ERROR_MARKERS = ('429', 'quota', 'rate limit', 'ratelimit', 'resource exhausted', 'resourceexhausted', 'too many requests')
+_TRANSIENT_ERROR_MARKERS = ('503', 'unavailable', 'deadline exceeded', 'timed out', 'timeout', 'connection reset')
+
+def is_quota_error(error):
+    """True if an embedding API error means we are being throttled."""
+    text = f"{type(error).__name__} {error}".lower()
+    return any(marker in text for marker in _QUOTA_ERROR_MARKERS)
+
+def is_transient_error(error):
+    """True if an embedding API error is worth retrying (throttling or a temporary outage)."""
+    text = f"{type(error).__name__} {error}".lower()
+    return is_quota_error(error) or any(marker in text for marker in _TRANSIENT_ERROR_MARKERS)
+
+class RateLimiter:
+    """Spaces calls evenly so that no more than `requests_per_minute` start in any minute."""
+
+    def __init__(self, requests_per_minute):
+        self.interval = 60.0 / requests_per_minute
+        self._lock = threading.Lock()
+        self._next_slot = time.monotonic()
+
+    def acquire(self):
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slot)
+            self._next_slot = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+class EmbeddingDispatcher:
+    """Keeps several embedding requests in flight while respecting the API's limits.
+
+    `embed_fn` is anything with the embed_documents(texts) -> vectors signature, e.g.
+    GoogleGenerativeAIEmbeddings.embed_documents. Each work item's texts are split into
+    requests of at most `max_batch_size` texts and `max_batch_chars` characters (a cheap
+    stand-in for the token budget), up to `max_in_flight` of them run at once on a thread
+    pool, starts are limited to `requests_per_minute`, and throttling or transient errors
+    are retried with exponential backoff, pausing every worker while the quota recovers.
+    """
+
+    def __init__(self, embed_fn, max_in_flight=4, max_batch_size=100, max_batch_chars=60_000,
+                 requests_per_minute=None, max_retries=5, backoff_base=1.0, backoff_max=60.0):
+        self.embed_fn = embed_fn
+        self.max_in_flight = max(1, max_in_flight)
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_batch_chars = max(1, max_batch_chars)
+        self.rate_limiter = RateLimiter(requests_per_minute) if requests_per_minute else None
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+
+        self._lock = threading.Lock()
+        self._paused_until = 0.0
+        self.requests = 0
+        self.retries = 0
+        self.texts_embedded = 0
+        self.chars_embedded = 0
+        self.started_at = None
+
+    def split(self, texts):
+        """Splits texts into request-sized lists under both the count and character budgets."""
+        batches = []
+        current, current_chars = [], 0
+        for text in texts:
+            if current and (len(current) >= self.max_batch_size or current_chars + len(text) > self.max_batch_chars):
+                batches.append(current)
+                current, current_chars = [], 0
+            current.append(text)
+            current_chars += len(text)
+        if current:
+            batches.append(current)
+        return batches
+
+    def embed(self, texts):
+        """Embeds one request's texts, retrying throttling and transient errors with backoff."""
+        attempt = 0
+        while True:
+            self._wait_for_slot()
+            try:
+                vectors = self.embed_fn(texts)
+                with self._lock:
+                    self.requests += 1
+                    self.texts_embedded += len(texts)
+                    self.chars_embedded += sum(len(text) for text in texts)
+                return vectors
+            except Exception as e:
+                attempt += 1
+                if attempt > self.max_retries or not is_transient_error(e):
+                    raise
+                delay = min(self.backoff_max, self.backoff_base * (2 ** (attempt - 1)))
+                delay *= random.uniform(0.8, 1.2)
+                with self._lock:
+                    self.retries += 1
+                    if is_quota_error(e):
+                        # Everyone waits, not just this worker, or the others keep burning quota.
+                        self._paused_until = max(self._paused_until, time.monotonic() + delay)
+                logger.warning(f"Embedding request failed (attempt {attempt}/{self.max_retries}), "
+                               f"retrying in {delay:.1f}s: {e}")
+                time.sleep(delay)
+
+    def _wait_for_slot(self):
+        while True:
+            with self._lock:
+                pause = self._paused_until - time.monotonic()
+            if pause <= 0:
+                break
+            time.sleep(pause)
+        if self.rate_limiter:
+            self.rate_limiter.acquire()
+
+    def map(self, items):
+        """Embeds (payload, texts) work items, yielding (payload, vectors, error) in input order.
+
+        Items are consumed lazily and at most about twice `max_in_flight` requests are ever
+        queued, so a streaming input stays streaming.
+        """
+        if self.started_at is None:
+            self.started_at = time.monotonic()
+        pending = deque()
+        outstanding = 0
+        with ThreadPoolExecutor(max_workers=self.max_in_flight, thread_name_prefix="embed") as pool:
+            for payload, texts in items:
+                futures = [pool.submit(self.embed, request) for request in self.split(texts)]
+                pending.append((payload, futures))
+                outstanding += len(futures)
+                while pending and outstanding > self.max_in_flight * 2:
+                    payload_done, done = pending.popleft()
+                    outstanding -= len(done)
+                    yield self._collect(payload_done, done)
+            while pending:
+                payload_done, done = pending.popleft()
+                yield self._collect(payload_done, done)
+
+    @staticmethod
+    def _collect(payload, futures):
+        vectors = []
+        try:
+            for future in futures:
+                vectors.extend(future.result())
+        except Exception as e:
+            return payload, None, e
+        return payload, vectors, None
+
+    def stats(self):
+        """Returns request/throughput counters; chunks_per_sec covers the time since map() started."""
+        elapsed = time.monotonic() - self.started_at if self.started_at else 0.0
+        return {
+            'requests': self.requests,
+            'retries': self.retries,
+            'chunks_embedded': self.texts_embedded,
+            'chars_embedded': self.chars_embedded,
+            'elapsed_sec': elapsed,
+            'chunks_per_sec': self.texts_embedded / elapsed if elapsed > 0 else 0.0,
+        }
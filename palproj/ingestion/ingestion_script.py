@@ -1,14 +1,32 @@
 import os
+import io
+import argparse
 import psycopg2
 from psycopg2.extras import execute_values
-import hashlib
-import re
 from tqdm import tqdm
+import struct
 import sys
+import time
 import logging
+import signal
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
 from langchain_google_genai import GoogleGenerativeAIEmbeddings
 from dotenv import load_dotenv
 
+from checkpoints import (create_run_tables, find_resumable_run, finish_run, next_batch_no, prune_runs,
+                         record_checkpoint, record_dead_letters, reopen_run, retry_with_backoff, start_run)
+from embedding_cache import open_embedding_cache
+from embedding_dispatcher import EmbeddingDispatcher
+from fake_embeddings import FakeEmbeddings
+from metrics import Registry, serve, write_textfile
+from openedge_chunker import extract_references
+from pipeline import Pipeline
+from scanner import iter_source_files, iter_source_paths, scan_in_order
+from watcher import Debouncer, open_watcher, watch
+
 # --- Configure Logging ---
 log_level_str = os.getenv('LOG_LEVEL', 'INFO').upper()
 log_level = getattr(logging, log_level_str, logging.INFO)
@@ -32,14 +50,86 @@ DB_USER = os.environ.get("VECTOR_DB_USER", "palantir_vector_user")
 DB_PASSWORD = os.environ.get("VECTOR_DB_PASSWORD")
 
 GOOGLE_API_KEY = os.environ.get("GOOGLE_API_KEY")
-if not GOOGLE_API_KEY or GOOGLE_API_KEY == "your_google_api_key_here":
+# EMBED_FAKE_LATENCY_SEC swaps in deterministic local embeddings, for benchmarks without the API.
+EMBED_FAKE_LATENCY_SEC = os.environ.get("EMBED_FAKE_LATENCY_SEC")
+if not EMBED_FAKE_LATENCY_SEC and (not GOOGLE_API_KEY or GOOGLE_API_KEY == "your_google_api_key_here"):
     logger.error("ERROR: GOOGLE_API_KEY not set or is placeholder. Embedding generation will fail.")
     sys.exit(1)
 
 CODE_REPO_PATH = os.environ.get("CODE_REPO_PATH", "/qad-code-repo")
 
+# Chunks longer than this are split at line boundaries; the embedding model truncates
+# its input at roughly 2048 tokens, so anything much past ~8000 characters is never seen.
+CHUNK_MAX_CHARS = int(os.environ.get("CHUNK_MAX_CHARS", "8000"))
+
+# ANN index on code_embeddings.embedding. VECTOR_DISTANCE must match the app's setting,
+# since a query only uses the index when it orders by the same operator.
+VECTOR_INDEX_METHOD = os.environ.get("VECTOR_INDEX_METHOD", "hnsw").lower()  # hnsw | ivfflat | none
+VECTOR_DISTANCE = os.environ.get("VECTOR_DISTANCE", "cosine").lower()  # cosine | l2 | ip
+HNSW_M = int(os.environ.get("HNSW_M", "16"))
+HNSW_EF_CONSTRUCTION = int(os.environ.get("HNSW_EF_CONSTRUCTION", "64"))
+IVFFLAT_LISTS = int(os.environ.get("IVFFLAT_LISTS", "0"))  # 0 = derive from the row count
+VECTOR_INDEX_BUILD_MEM = os.environ.get("VECTOR_INDEX_BUILD_MEM", "512MB")
+
+# Processes used by the scan stage to read and chunk files (1 = scan serially).
+INGEST_WORKERS = int(os.environ.get("INGEST_WORKERS", "1"))
+
+# Embedding dispatch limits; see EmbeddingDispatcher. EMBED_RPM=0 disables rate limiting.
+EMBED_CONCURRENCY = int(os.environ.get("EMBED_CONCURRENCY", "4"))
+EMBED_MAX_BATCH_SIZE = int(os.environ.get("EMBED_MAX_BATCH_SIZE", "100"))
+EMBED_MAX_BATCH_CHARS = int(os.environ.get("EMBED_MAX_BATCH_CHARS", "60000"))
+EMBED_RPM = int(os.environ.get("EMBED_RPM", "0"))
+
+# Local (model, chunk_hash) -> vector cache shared with the app; empty path disables it.
+EMBEDDING_CACHE_PATH = os.environ.get("EMBEDDING_CACHE_PATH", "/embedding-cache/embeddings.sqlite3")
+EMBEDDING_CACHE_MAX_MB = int(os.environ.get("EMBEDDING_CACHE_MAX_MB", "2048"))
+
+EMBEDDING_MODEL = "models/embedding-001"
+
+# Watch mode (--watch): WATCH_MODE is auto (inotify, else polling) | inotify | poll. A burst
+# of file events is ingested once WATCH_DEBOUNCE_SEC pass without a new one, and at the
+# latest WATCH_MAX_WAIT_SEC after its first event.
+WATCH_MODE = os.environ.get("WATCH_MODE", "auto").lower()
+WATCH_DEBOUNCE_SEC = float(os.environ.get("WATCH_DEBOUNCE_SEC", "2"))
+WATCH_MAX_WAIT_SEC = float(os.environ.get("WATCH_MAX_WAIT_SEC", "20"))
+WATCH_POLL_INTERVAL_SEC = float(os.environ.get("WATCH_POLL_INTERVAL_SEC", "10"))
+
+# A batch that fails to embed or write is tried INGEST_BATCH_MAX_ATTEMPTS times in all, backing
+# off exponentially from INGEST_RETRY_BACKOFF_SEC, and then dead-lettered. Finished runs and
+# their checkpoints are pruned after INGEST_RUN_RETENTION_DAYS (0 keeps them forever).
+INGEST_BATCH_MAX_ATTEMPTS = int(os.environ.get("INGEST_BATCH_MAX_ATTEMPTS", "3"))
+INGEST_RETRY_BACKOFF_SEC = float(os.environ.get("INGEST_RETRY_BACKOFF_SEC", "2"))
+INGEST_RETRY_BACKOFF_MAX_SEC = float(os.environ.get("INGEST_RETRY_BACKOFF_MAX_SEC", "60"))
+INGEST_RUN_RETENTION_DAYS = int(os.environ.get("INGEST_RUN_RETENTION_DAYS", "30"))
+
+# --- Metrics ---
+# METRICS_PORT > 0 serves /metrics (Prometheus text format) while ingestion runs;
+# METRICS_TEXTFILE, if set, receives the final values when a run ends (for node_exporter's
+# textfile collector, since a one-shot run is usually gone before it can be scraped).
+METRICS_PORT = int(os.environ.get("METRICS_PORT", "0"))
+METRICS_TEXTFILE = os.environ.get("METRICS_TEXTFILE", "")
+metrics = Registry()
+FILES = metrics.counter('palantir_ingest_files_total', 'Source files seen, by outcome.', ['outcome'])
+CHUNKS = metrics.counter('palantir_ingest_chunks_total', 'Chunks generated, embedded, written and deleted, and occurrences recorded.', ['outcome'])
+ERRORS = metrics.counter('palantir_ingest_errors_total', 'Failed files and batches, by stage.', ['stage'])
+EMBED_SECONDS = metrics.histogram('palantir_ingest_embed_request_duration_seconds',
+                                  'One embedding API request attempt.')
+WRITE_SECONDS = metrics.histogram('palantir_ingest_write_duration_seconds',
+                                  'Writing one batch to vector_db, including its commit.', ['writer'])
+THROUGHPUT = metrics.gauge('palantir_ingest_throughput_per_second', 'Files and chunks per second of the current run.',
+                           ['unit'])
+LAST_RUN = metrics.gauge('palantir_ingest_last_run_timestamp_seconds', 'When the last run finished.')
+WATCH_LAG_SECONDS = metrics.histogram('palantir_ingest_watch_lag_seconds',
+                                      'From the first file event of a burst to its rows being committed.',
+                                      buckets=(1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0, 120.0, 300.0))
+# --- END Metrics ---
+
 try:
-    embeddings = GoogleGenerativeAIEmbeddings(model="models/embedding-001", google_api_key=GOOGLE_API_KEY)
+    if EMBED_FAKE_LATENCY_SEC:
+        embeddings = FakeEmbeddings(latency=float(EMBED_FAKE_LATENCY_SEC))
+        logger.warning(f"Using fake embeddings with {EMBED_FAKE_LATENCY_SEC}s latency per request.")
+    else:
+        embeddings = GoogleGenerativeAIEmbeddings(model=EMBEDDING_MODEL, google_api_key=GOOGLE_API_KEY)
 except Exception as e:
     logger.error(f"Failed to initialize GoogleGenerativeAIEmbeddings: {e}")
     sys.exit(1)
@@ -60,164 +150,1218 @@ def get_db_connection():
         return None
 
 def create_embeddings_table(cursor):
-    """Creates the 'code_embeddings' table if it doesn't exist."""
+    """Creates the content-addressed chunk store if it doesn't exist.
+
+    code_embeddings holds one row per unique chunk text (keyed by chunk_hash) and its
+    embedding; chunk_occurrences records every place a chunk appears (file, procedure,
+    position). A block repeated in 40 files is embedded and stored once but listed 40 times.
+    """
     try:
         cursor.execute("CREATE EXTENSION IF NOT EXISTS vector;")
         cursor.execute("""
             CREATE TABLE IF NOT EXISTS code_embeddings (
                 id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
-                file_path TEXT NOT NULL,
-                procedure_name TEXT,
                 chunk_text TEXT NOT NULL,
                 chunk_hash TEXT NOT NULL UNIQUE,
                 embedding VECTOR(768),
                 last_updated TIMESTAMP WITH TIME ZONE DEFAULT NOW()
             );
         """)
-        logger.info("Ensured 'code_embeddings' table and 'vector' extension exist.")
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS chunk_occurrences (
+                file_path TEXT NOT NULL,
+                ordinal INTEGER NOT NULL,
+                chunk_hash TEXT NOT NULL,
+                procedure_name TEXT,
+                start_offset INTEGER,
+                end_offset INTEGER,
+                start_line INTEGER,
+                PRIMARY KEY (file_path, ordinal)
+            );
+        """)
+        cursor.execute("CREATE INDEX IF NOT EXISTS chunk_occurrences_chunk_hash_idx ON chunk_occurrences (chunk_hash);")
+        migrate_to_chunk_occurrences(cursor)
+        create_lexical_search_indexes(cursor)
+        create_symbol_index(cursor)
+        logger.info("Ensured 'code_embeddings', 'chunk_occurrences' and 'chunk_symbols' tables and the 'vector' extension exist.")
     except Exception as e:
         logger.error(f"Error creating table/extension: {e}")
         raise
 
+def migrate_to_chunk_occurrences(cursor):
+    """Moves file_path/procedure_name out of a code_embeddings table from before chunk_occurrences.
+
+    Each old row becomes one occurrence (positions unknown) and no embedding is lost. The
+    manifest is emptied so the next run re-chunks every file to record all occurrences
+    and their positions; the chunks are already stored, so nothing is re-embedded.
+    """
+    cursor.execute("""
+        SELECT 1 FROM information_schema.columns
+        WHERE table_name = 'code_embeddings' AND column_name = 'file_path';
+    """)
+    if cursor.fetchone() is None:
+        return
+    logger.info("Migrating code_embeddings to one row per unique chunk plus chunk_occurrences...")
+    cursor.execute("""
+        INSERT INTO chunk_occurrences (file_path, ordinal, chunk_hash, procedure_name)
+        SELECT file_path, (row_number() OVER (PARTITION BY file_path ORDER BY last_updated, id))::int - 1,
+               chunk_hash, procedure_name
+        FROM code_embeddings
+        ON CONFLICT (file_path, ordinal) DO NOTHING;
+    """)
+    # search_tsv is generated from procedure_name; it is re-added over chunk_text alone.
+    cursor.execute("ALTER TABLE code_embeddings DROP COLUMN IF EXISTS search_tsv;")
+    cursor.execute("ALTER TABLE code_embeddings DROP COLUMN file_path, DROP COLUMN procedure_name;")
+    cursor.execute("DROP TABLE IF EXISTS code_embeddings_staging;")
+    cursor.execute("SELECT to_regclass('ingestion_manifest');")
+    if cursor.fetchone()[0] is not None:
+        cursor.execute("TRUNCATE ingestion_manifest;")
+
+def create_symbol_index(cursor):
+    """Creates chunk_symbols, the references each unique chunk makes, for retrieval's graph expansion.
+
+    One row per (chunk_hash, kind, target), as extracted by extract_references: kind is
+    run | program | include | table. Rows follow their chunk through ON DELETE CASCADE.
+    Edges are resolved when the app queries them: 'run' targets against
+    lower(procedure_name) and file targets against chunk_occurrences.file_name (the
+    lowercased base name), both indexed. When the table is first created, the references
+    of the chunks already stored are extracted from their text, so nothing is re-embedded.
+    """
+    cursor.execute("SELECT to_regclass('chunk_symbols');")
+    exists = cursor.fetchone()[0] is not None
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS chunk_symbols (
+            chunk_hash TEXT NOT NULL REFERENCES code_embeddings (chunk_hash) ON DELETE CASCADE,
+            kind TEXT NOT NULL,
+            target TEXT NOT NULL,
+            PRIMARY KEY (chunk_hash, kind, target)
+        );
+    """)
+    cursor.execute("CREATE INDEX IF NOT EXISTS chunk_symbols_target_idx ON chunk_symbols (kind, target);")
+    cursor.execute("""
+        ALTER TABLE chunk_occurrences ADD COLUMN IF NOT EXISTS file_name TEXT
+        GENERATED ALWAYS AS (lower(regexp_replace(file_path, '^.*/', ''))) STORED;
+    """)
+    cursor.execute("CREATE INDEX IF NOT EXISTS chunk_occurrences_file_name_idx ON chunk_occurrences (file_name);")
+    cursor.execute("CREATE INDEX IF NOT EXISTS chunk_occurrences_procedure_name_idx "
+                   "ON chunk_occurrences (lower(procedure_name));")
+    if not exists:
+        backfill_chunk_symbols(cursor)
+
+def backfill_chunk_symbols(cursor, page_size=1000):
+    """Extracts and stores the references of every chunk in code_embeddings."""
+    rows = 0
+    with cursor.connection.cursor(name="chunk_symbols_backfill") as source:
+        source.itersize = page_size
+        source.execute("SELECT chunk_hash, chunk_text FROM code_embeddings;")
+        while True:
+            page = source.fetchmany(page_size)
+            if not page:
+                break
+            symbols = [(chunk_hash, kind, target)
+                       for chunk_hash, chunk_text in page
+                       for kind, target in extract_references(chunk_text)]
+            insert_symbols(cursor, symbols)
+            rows += len(symbols)
+    if rows:
+        logger.info(f"Backfilled {rows} chunk references into 'chunk_symbols'.")
+
+def insert_symbols(cursor, rows):
+    """Inserts (chunk_hash, kind, target) rows into chunk_symbols."""
+    if not rows:
+        return
+    execute_values(cursor, "INSERT INTO chunk_symbols (chunk_hash, kind, target) VALUES %s ON CONFLICT DO NOTHING;",
+                   rows, page_size=1000)
+
+def create_lexical_search_indexes(cursor):
+    """Adds what the app's exact-identifier search needs to code_embeddings and chunk_occurrences.
+
+    search_tsv is a generated column, so it is filled by every INSERT and COPY without the
+    writers knowing about it. The 'simple' configuration keeps ABL identifiers intact:
+    'ip-calc-tax' is indexed as itself as well as 'ip', 'calc' and 'tax', and include paths
+    such as 'us/bbi/mfdeclre.i' as one token. Trigram indexes on the lowercased procedure
+    name and file path of each occurrence serve exact and suffix lookups ("which file is
+    gltrans.p").
+    """
+    cursor.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm;")
+    cursor.execute("""
+        ALTER TABLE code_embeddings ADD COLUMN IF NOT EXISTS search_tsv TSVECTOR
+        GENERATED ALWAYS AS (to_tsvector('simple', chunk_text)) STORED;
+    """)
+    cursor.execute("CREATE INDEX IF NOT EXISTS code_embeddings_search_tsv_idx ON code_embeddings USING gin (search_tsv);")
+    cursor.execute("CREATE INDEX IF NOT EXISTS chunk_occurrences_procedure_name_trgm_idx "
+                   "ON chunk_occurrences USING gin (lower(procedure_name) gin_trgm_ops);")
+    cursor.execute("CREATE INDEX IF NOT EXISTS chunk_occurrences_file_path_trgm_idx "
+                   "ON chunk_occurrences USING gin (lower(file_path) gin_trgm_ops);")
+
+def create_manifest_table(cursor):
+    """Creates the 'ingestion_manifest' table used to detect unchanged files between runs."""
+    try:
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS ingestion_manifest (
+                file_path TEXT PRIMARY KEY,
+                file_size BIGINT NOT NULL,
+                file_mtime DOUBLE PRECISION NOT NULL,
+                content_hash TEXT NOT NULL,
+                last_ingested TIMESTAMP WITH TIME ZONE DEFAULT NOW()
+            );
+        """)
+        logger.info("Ensured 'ingestion_manifest' table exists.")
+    except Exception as e:
+        logger.error(f"Error creating manifest table: {e}")
+        raise
+
 def clear_embeddings_table(cursor):
-    """Deletes all data from the code_embeddings table."""
+    """Deletes all data from the code_embeddings, chunk_symbols, chunk_occurrences and ingestion_manifest tables."""
     try:
-        cursor.execute("TRUNCATE TABLE code_embeddings RESTART IDENTITY;")
-        logger.info("Cleared existing data from 'code_embeddings' table.")
+        cursor.execute("TRUNCATE TABLE code_embeddings, chunk_symbols, chunk_occurrences, ingestion_manifest "
+                       "RESTART IDENTITY;")
+        logger.info("Cleared existing data from 'code_embeddings', 'chunk_symbols', 'chunk_occurrences' and "
+                    "'ingestion_manifest' tables.")
     except Exception as e:
         logger.error(f"Error truncating table: {e}")
         raise
 
-def chunk_openedge_code(file_content, file_path):
-    """Splits OpenEdge ABL code into meaningful chunks."""
-    chunks = []
-    procedure_regex = re.compile(
-        r'(?:PROCEDURE|FUNCTION)\s+(?:PRIVATE|PUBLIC|INTERNAL)?\s*([\w\-.]+)\s*(\(.*?\))?\s*:',
-        re.IGNORECASE | re.DOTALL
+def load_manifest(cursor, paths=None):
+    """Returns {file_path: (file_size, file_mtime, content_hash)} for every previously ingested
+    file, or only for those at or under the relative `paths`."""
+    if paths is None:
+        cursor.execute("SELECT file_path, file_size, file_mtime, content_hash FROM ingestion_manifest;")
+    else:
+        paths = [os.path.normpath(path) for path in paths]
+        prefixes = [path.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '/%' for path in paths]
+        cursor.execute("SELECT file_path, file_size, file_mtime, content_hash FROM ingestion_manifest "
+                       "WHERE file_path = ANY(%s) OR file_path LIKE ANY(%s);", (paths, prefixes))
+    return {row[0]: (row[1], row[2], row[3]) for row in cursor.fetchall()}
+
+def upsert_manifest(cursor, entries):
+    """Records (file_path, file_size, file_mtime, content_hash) tuples as ingested."""
+    if not entries:
+        return
+    execute_values(cursor, """
+        INSERT INTO ingestion_manifest (file_path, file_size, file_mtime, content_hash)
+        VALUES %s
+        ON CONFLICT (file_path) DO UPDATE SET
+            file_size = EXCLUDED.file_size,
+            file_mtime = EXCLUDED.file_mtime,
+            content_hash = EXCLUDED.content_hash,
+            last_ingested = NOW();
+    """, entries)
+
+def delete_orphan_chunks(cursor, chunk_hashes=None):
+    """Deletes chunks (of chunk_hashes, or all) that no longer occur in any file. Returns the row count."""
+    sql = ("DELETE FROM code_embeddings c "
+           "WHERE NOT EXISTS (SELECT 1 FROM chunk_occurrences o WHERE o.chunk_hash = c.chunk_hash)")
+    if chunk_hashes is None:
+        cursor.execute(sql + ";")
+    elif chunk_hashes:
+        cursor.execute(sql + " AND c.chunk_hash = ANY(%s);", (list(chunk_hashes),))
+    else:
+        return 0
+    return cursor.rowcount
+
+def insert_occurrences(cursor, rows):
+    """Inserts (file_path, ordinal, chunk_hash, procedure_name, start_offset, end_offset, start_line) rows."""
+    if not rows:
+        return
+    execute_values(cursor, """
+        INSERT INTO chunk_occurrences
+            (file_path, ordinal, chunk_hash, procedure_name, start_offset, end_offset, start_line)
+        VALUES %s
+        ON CONFLICT (file_path, ordinal) DO UPDATE SET
+            chunk_hash = EXCLUDED.chunk_hash,
+            procedure_name = EXCLUDED.procedure_name,
+            start_offset = EXCLUDED.start_offset,
+            end_offset = EXCLUDED.end_offset,
+            start_line = EXCLUDED.start_line;
+    """, rows, page_size=1000)
+
+def delete_removed_files(cursor, file_paths):
+    """Removes the occurrences and manifest entries of files that no longer exist in the code
+    repo, and the chunks that occurred nowhere else. Returns the chunks deleted."""
+    if not file_paths:
+        return 0
+    cursor.execute("DELETE FROM chunk_occurrences WHERE file_path = ANY(%s) RETURNING chunk_hash;", (file_paths,))
+    deleted = delete_orphan_chunks(cursor, {row[0] for row in cursor.fetchall()})
+    cursor.execute("DELETE FROM ingestion_manifest WHERE file_path = ANY(%s);", (file_paths,))
+    return deleted
+
+VECTOR_INDEX_NAME = "code_embeddings_embedding_idx"
+
+# distance -> (operator class, query operator)
+DISTANCE_OPERATORS = {
+    'cosine': ('vector_cosine_ops', '<=>'),
+    'l2': ('vector_l2_ops', '<->'),
+    'ip': ('vector_ip_ops', '<#>'),
+}
+
+def ivfflat_lists_for(row_count):
+    """pgvector's guidance: rows / 1000 up to 1M rows, sqrt(rows) beyond."""
+    if row_count <= 1_000_000:
+        return max(1, row_count // 1000)
+    return int(row_count ** 0.5)
+
+def current_vector_index(cursor):
+    """Returns (method, opclass, options) of the existing embedding index, or None."""
+    cursor.execute("""
+        SELECT am.amname, opc.opcname, COALESCE(i.reloptions, '{}')
+        FROM pg_class i
+        JOIN pg_am am ON am.oid = i.relam
+        JOIN pg_index x ON x.indexrelid = i.oid
+        JOIN pg_opclass opc ON opc.oid = x.indclass[0]
+        WHERE i.relname = %s;
+    """, (VECTOR_INDEX_NAME,))
+    row = cursor.fetchone()
+    if row is None:
+        return None
+    options = dict(option.split('=', 1) for option in row[2])
+    return row[0], row[1], options
+
+def drop_vector_index(cursor):
+    cursor.execute(f"DROP INDEX IF EXISTS {VECTOR_INDEX_NAME};")
+
+def ensure_vector_index(cursor, force=False):
+    """Creates or rebuilds the ANN index on code_embeddings.embedding to match the configuration.
+
+    An existing index is kept when its method, operator class and parameters already match;
+    for IVFFlat with derived lists it is only rebuilt once the row count has drifted by more
+    than 2x, since lists are fixed at build time. Best run after loading, not before.
+    """
+    if VECTOR_INDEX_METHOD == 'none':
+        drop_vector_index(cursor)
+        return
+    if VECTOR_INDEX_METHOD not in ('hnsw', 'ivfflat') or VECTOR_DISTANCE not in DISTANCE_OPERATORS:
+        raise ValueError(f"Unsupported vector index configuration: {VECTOR_INDEX_METHOD}/{VECTOR_DISTANCE}")
+    opclass = DISTANCE_OPERATORS[VECTOR_DISTANCE][0]
+
+    if VECTOR_INDEX_METHOD == 'hnsw':
+        options = {'m': str(HNSW_M), 'ef_construction': str(HNSW_EF_CONSTRUCTION)}
+    else:
+        lists = IVFFLAT_LISTS
+        if not lists:
+            cursor.execute("SELECT COUNT(*) FROM code_embeddings;")
+            lists = ivfflat_lists_for(cursor.fetchone()[0])
+        options = {'lists': str(lists)}
+
+    existing = current_vector_index(cursor)
+    if existing and not force and existing[:2] == (VECTOR_INDEX_METHOD, opclass):
+        if existing[2] == options:
+            logger.info(f"Vector index '{VECTOR_INDEX_NAME}' is up to date ({VECTOR_INDEX_METHOD}, {options}).")
+            return
+        if VECTOR_INDEX_METHOD == 'ivfflat' and not IVFFLAT_LISTS:
+            built_lists = int(existing[2].get('lists', 0) or 1)
+            if built_lists / 2 <= int(options['lists']) <= built_lists * 2:
+                logger.info(f"Vector index '{VECTOR_INDEX_NAME}' kept (lists={built_lists}, ideal {options['lists']}).")
+                return
+
+    drop_vector_index(cursor)
+    with_clause = ', '.join(f"{key} = {value}" for key, value in options.items())
+    logger.info(f"Building {VECTOR_INDEX_METHOD} index '{VECTOR_INDEX_NAME}' ({opclass}, {with_clause})...")
+    started = time.monotonic()
+    cursor.execute("SET LOCAL maintenance_work_mem = %s;", (VECTOR_INDEX_BUILD_MEM,))
+    cursor.execute(
+        f"CREATE INDEX {VECTOR_INDEX_NAME} ON code_embeddings "
+        f"USING {VECTOR_INDEX_METHOD} (embedding {opclass}) WITH ({with_clause});"
     )
-    last_end = 0
-    for match in procedure_regex.finditer(file_content):
-        pre_code = file_content[last_end:match.start()].strip()
-        if pre_code:
-            chunks.append({
-                "file_path": file_path,
-                "procedure_name": "FILE_HEADER" if last_end == 0 else "INTER_PROCEDURE_CODE",
-                "chunk_text": pre_code
-            })
-        procedure_start = match.start()
-        procedure_name = match.group(1).strip()
-        end_match = re.search(
-            r'(?:END\s+PROCEDURE|END\s+FUNCTION)\s*(\.|,|$)',
-            file_content[procedure_start:],
-            re.IGNORECASE | re.DOTALL
-        )
-        chunk_end = len(file_content)
-        if end_match:
-            chunk_end = procedure_start + end_match.end()
-        chunk_text = file_content[procedure_start:chunk_end].strip()
-        if chunk_text:
-            chunks.append({
-                "file_path": file_path,
-                "procedure_name": procedure_name,
-                "chunk_text": chunk_text
-            })
-        last_end = chunk_end
-    remaining_code = file_content[last_end:].strip()
-    if remaining_code:
-        chunks.append({
-            "file_path": file_path,
-            "procedure_name": "FILE_FOOTER",
-            "chunk_text": remaining_code
-        })
-    return chunks
-
-def ingest_codebase():
-    """Main function to orchestrate the code ingestion process."""
+    logger.info(f"Built vector index in {time.monotonic() - started:.1f}s.")
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))] if ordered else 0.0
+
+def evaluate_recall(sample_size=100, k=10, search_values=(40, 100, 200)):
+    """Measures recall@k and latency of the ANN index against exact search.
+
+    Embeddings of randomly sampled rows are used as queries. The exact top-k comes from
+    the same query with index scans disabled; each value in search_values is tried as
+    hnsw.ef_search (HNSW) or ivfflat.probes (IVFFlat).
+    """
     conn = get_db_connection()
     if conn is None:
-        logger.error("Cannot proceed without a database connection.")
+        logger.error("Cannot evaluate recall without a database connection.")
         return
+    operator = DISTANCE_OPERATORS[VECTOR_DISTANCE][1]
+    search_query = (f"SELECT chunk_hash FROM code_embeddings ORDER BY embedding {operator} %s::vector LIMIT %s;")
+    try:
+        with conn.cursor() as cur:
+            existing = current_vector_index(cur)
+            if existing is None:
+                logger.error(f"No vector index '{VECTOR_INDEX_NAME}' to evaluate; run ingestion or --reindex first.")
+                return
+            method = existing[0]
+            setting = 'hnsw.ef_search' if method == 'hnsw' else 'ivfflat.probes'
+            cur.execute("SELECT embedding::text FROM code_embeddings WHERE embedding IS NOT NULL "
+                        "ORDER BY random() LIMIT %s;", (sample_size,))
+            queries = [row[0] for row in cur.fetchall()]
+            conn.commit()
+
+            exact_results, exact_times = [], []
+            for query in queries:
+                cur.execute("SET LOCAL enable_indexscan = off;")
+                cur.execute("SET LOCAL enable_bitmapscan = off;")
+                started = time.perf_counter()
+                cur.execute(search_query, (query, k))
+                exact_results.append({row[0] for row in cur.fetchall()})
+                exact_times.append(time.perf_counter() - started)
+                conn.rollback()
+
+            logger.info(f"Recall@{k} for {method} index ({existing[2]}) over {len(queries)} sampled queries:")
+            logger.info(f"  exact search: p50 {percentile(exact_times, 0.5) * 1000:.1f} ms, "
+                        f"p95 {percentile(exact_times, 0.95) * 1000:.1f} ms")
+            for value in search_values:
+                recalls, times = [], []
+                for query, exact in zip(queries, exact_results):
+                    cur.execute(f"SET LOCAL {setting} = %s;", (value,))
+                    started = time.perf_counter()
+                    cur.execute(search_query, (query, k))
+                    found = {row[0] for row in cur.fetchall()}
+                    times.append(time.perf_counter() - started)
+                    conn.rollback()
+                    recalls.append(len(found & exact) / max(len(exact), 1))
+                logger.info(f"  {setting}={value}: recall {sum(recalls) / max(len(recalls), 1):.3f}, "
+                            f"p50 {percentile(times, 0.5) * 1000:.1f} ms, p95 {percentile(times, 0.95) * 1000:.1f} ms")
+    finally:
+        conn.close()
+
+def existing_chunk_hashes(cursor, chunk_hashes):
+    """Returns the subset of chunk_hashes already stored in code_embeddings."""
+    if not chunk_hashes:
+        return set()
+    cursor.execute("SELECT chunk_hash FROM code_embeddings WHERE chunk_hash = ANY(%s);", (list(chunk_hashes),))
+    return {row[0] for row in cursor.fetchall()}
+
+@dataclass
+class ScannedFile:
+    """A source file that changed since the last run, as produced by the scan stage."""
+    file_path: str
+    manifest_entry: tuple
+    previous: tuple = None
+    chunks: list = None  # None when only size/mtime changed and the content hash still matches
+
+@dataclass
+class IngestBatch:
+    """One unit of work for the embed and write stages, committed in a single transaction."""
+    chunks: list = field(default_factory=list)  # unique chunks not stored yet; only these are embedded
+    occurrences: list = field(default_factory=list)  # every chunk of the replaced files, as occurrence rows
+    replaced: list = field(default_factory=list)  # files whose previous occurrences are replaced
+    stale: list = field(default_factory=list)  # chunk hashes the replaced files no longer contain
+    borrowed: list = field(default_factory=list)  # chunks left to an earlier batch still in flight
+    manifest: list = field(default_factory=list)
+    embeddings: list = None
+    error: Exception = None
+
+class RecentHashes:
+    """A bounded set of the chunk hashes most recently queued for embedding.
+
+    Batches in flight are not yet committed, so the database alone cannot tell the planner
+    that a hash is already on its way; this catches duplicates across nearby batches
+    without letting memory grow with the corpus. The write stage discards the hashes of
+    batches it dead-letters, so batches planned after that embed them again.
+    """
+
+    def __init__(self, max_size=200_000):
+        self.max_size = max_size
+        self._hashes = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __contains__(self, chunk_hash):
+        with self._lock:
+            return chunk_hash in self._hashes
+
+    def add(self, chunk_hash):
+        with self._lock:
+            self._hashes[chunk_hash] = None
+            if len(self._hashes) > self.max_size:
+                self._hashes.popitem(last=False)
+
+    def discard(self, chunk_hashes):
+        with self._lock:
+            for chunk_hash in chunk_hashes:
+                self._hashes.pop(chunk_hash, None)
+
+def scan_files(source_files, manifest, stats, scan_errors, pool=None, window=64):
+    """Scan stage: skips unchanged files, reads, chunks and hashes the rest.
+
+    Files whose size and mtime match the manifest are skipped here with a stat(); the rest
+    go through scan_source_file, either inline or on `pool` (a process pool), in walk order
+    either way. Per-file errors are appended to `scan_errors` rather than logged.
+
+    Entries are popped from `manifest` as files are seen, so once the walk completes
+    whatever is left belongs to files that were deleted from the repo.
+    """
+    def tasks():
+        for file_path, relative_file_path in source_files:
+            stats['files_processed'] += 1
+            FILES.inc(outcome='processed')
+            previous = manifest.pop(relative_file_path, None)
+            try:
+                stat = os.stat(file_path)
+            except OSError as e:
+                scan_errors.append((relative_file_path, f"{type(e).__name__}: {e}"))
+                ERRORS.inc(stage='scan')
+                continue
+            if previous and previous[0] == stat.st_size and previous[1] == stat.st_mtime:
+                stats['files_unchanged'] += 1
+                FILES.inc(outcome='unchanged')
+                continue
+            previous_hash = previous[2] if previous else None
+            yield ((relative_file_path, stat, previous),
+                   (file_path, relative_file_path, CHUNK_MAX_CHARS, previous_hash))
+
+    for (relative_file_path, stat, previous), (content_hash, chunk_rows, error) in scan_in_order(tasks(), pool, window):
+        if error:
+            scan_errors.append((relative_file_path, error))
+            ERRORS.inc(stage='scan')
+            continue
+        manifest_entry = (relative_file_path, stat.st_size, stat.st_mtime, content_hash)
+        if chunk_rows is None:
+            # Touched but not modified: just refresh size/mtime.
+            stats['files_unchanged'] += 1
+            FILES.inc(outcome='unchanged')
+            yield ScannedFile(relative_file_path, manifest_entry, previous)
+            continue
+        chunks = [
+            {"file_path": relative_file_path, "procedure_name": procedure_name,
+             "chunk_text": chunk_text, "chunk_hash": chunk_hash, "ordinal": ordinal,
+             "start_offset": start_offset, "end_offset": end_offset, "start_line": start_line,
+             "references": references}
+            for ordinal, (procedure_name, chunk_text, chunk_hash, start_offset, end_offset, start_line, references)
+            in enumerate(chunk_rows)
+        ]
+        stats['chunks_generated'] += len(chunks)
+        CHUNKS.inc(len(chunks), outcome='generated')
+        yield ScannedFile(relative_file_path, manifest_entry, previous, chunks)
+
+def occurrence_row(chunk):
+    return (chunk["file_path"], chunk["ordinal"], chunk["chunk_hash"], chunk.get("procedure_name"),
+            chunk.get("start_offset"), chunk.get("end_offset"), chunk.get("start_line"))
+
+def plan_batches(scanned_files, cursor, batch_size, max_manifest_entries=1000, recent_hashes=None):
+    """Plan stage: replaces each changed file's occurrences and groups the unique chunks that
+    are not stored yet into batches of `batch_size`.
+
+    Chunks are deduplicated by hash before embedding: against code_embeddings, against
+    batches still in flight (`recent_hashes`) and within the batch, so embedding calls and
+    stored vectors scale with unique content. A chunk left to a batch in flight is kept in
+    the batch's `borrowed` list, in case that batch fails. Only reads from the database;
+    the writes it decides on travel with the batch and are applied by the write stage in
+    one transaction.
+    """
+    if recent_hashes is None:
+        recent_hashes = RecentHashes()
+    batch = IngestBatch()
+    batch_hashes = set()
+    for scanned in scanned_files:
+        if scanned.chunks is not None:
+            new_hashes = {chunk["chunk_hash"] for chunk in scanned.chunks}
+            if scanned.previous:
+                cursor.execute("SELECT DISTINCT chunk_hash FROM chunk_occurrences WHERE file_path = %s;",
+                               (scanned.file_path,))
+                batch.stale.extend(row[0] for row in cursor.fetchall() if row[0] not in new_hashes)
+            batch.replaced.append(scanned.file_path)
+            batch.occurrences.extend(occurrence_row(chunk) for chunk in scanned.chunks)
+
+            known_hashes = existing_chunk_hashes(cursor, {h for h in new_hashes if h not in recent_hashes})
+            for chunk in scanned.chunks:
+                if chunk["chunk_hash"] in known_hashes or chunk["chunk_hash"] in batch_hashes:
+                    continue
+                batch_hashes.add(chunk["chunk_hash"])
+                if chunk["chunk_hash"] in recent_hashes:
+                    batch.borrowed.append(chunk)
+                    continue
+                recent_hashes.add(chunk["chunk_hash"])
+                batch.chunks.append(chunk)
+        batch.manifest.append(scanned.manifest_entry)
+
+        if len(batch.chunks) >= batch_size or len(batch.manifest) >= max_manifest_entries:
+            yield batch
+            batch = IngestBatch()
+            batch_hashes = set()
+    if batch.chunks or batch.occurrences or batch.replaced or batch.manifest:
+        yield batch
+
+def embed_batches(batches, dispatcher, cache=None):
+    """Embed stage: attaches embeddings to each batch, or the error that prevented it.
+
+    Chunks already in the local embedding cache are never sent to the API. The dispatcher
+    keeps several requests in flight but yields batches in plan order.
+    """
+    def work():
+        for batch in batches:
+            cached = cache.get_many(EMBEDDING_MODEL, [chunk["chunk_hash"] for chunk in batch.chunks]) if cache else {}
+            missing = [chunk for chunk in batch.chunks if chunk["chunk_hash"] not in cached]
+            yield (batch, cached, missing), [chunk["chunk_text"] for chunk in missing]
 
-    total_files_processed = 0
-    total_chunks_generated = 0
-    total_chunks_ingested = 0
+    for (batch, cached, missing), vectors, error in dispatcher.map(work()):
+        batch.error = error
+        if error is None:
+            fresh = [(chunk["chunk_hash"], vector) for chunk, vector in zip(missing, vectors)]
+            CHUNKS.inc(len(fresh), outcome='embedded')
+            if cache and fresh:
+                cache.put_many(EMBEDDING_MODEL, fresh)
+            cached.update(fresh)
+            batch.embeddings = [cached[chunk["chunk_hash"]] for chunk in batch.chunks]
+        yield batch
+
+def reclaim_lost_chunks(batch, lost_hashes, dispatcher, cache=None):
+    """Moves the borrowed chunks whose batch was dead-lettered into `batch`, embedded.
+
+    `lost_hashes` holds the chunk hashes of dead-lettered batches. Without this, the
+    batch's occurrences of those chunks would point at rows that are never written.
+    Returns the hashes reclaimed; raises the embedding error if they cannot be embedded.
+    """
+    planned = {chunk["chunk_hash"] for chunk in batch.chunks}
+    lost = [chunk for chunk in batch.borrowed if chunk["chunk_hash"] in lost_hashes and chunk["chunk_hash"] not in planned]
+    if not lost:
+        return set()
+    reclaimed = next(embed_batches([IngestBatch(chunks=lost)], dispatcher, cache))
+    if reclaimed.error is not None:
+        raise reclaimed.error
+    batch.chunks.extend(lost)
+    batch.embeddings.extend(reclaimed.embeddings)
+    return {chunk["chunk_hash"] for chunk in lost}
+
+def embedding_rows(batch):
+    """(chunk_text, chunk_hash, embedding) tuples for a batch's new chunks."""
+    return [
+        (chunk["chunk_text"], chunk["chunk_hash"], embedding)
+        for chunk, embedding in zip(batch.chunks, batch.embeddings)
+    ]
+
+def symbol_rows(batch):
+    """(chunk_hash, kind, target) tuples for the references of a batch's new chunks."""
+    return [
+        (chunk["chunk_hash"], kind, target)
+        for chunk in batch.chunks
+        for kind, target in chunk.get("references", ())
+    ]
+
+def encode_copy_binary(rows):
+    """Encodes embedding rows in PostgreSQL's binary COPY format.
+
+    Text columns are sent as UTF-8 bytes and the vector in pgvector's binary form
+    (int16 dimensions, int16 unused, float4 values), so nothing is formatted as text.
+    """
+    buf = io.BytesIO()
+    buf.write(b'PGCOPY\n\xff\r\n\x00' + struct.pack('!ii', 0, 0))
+    for *texts, embedding in rows:
+        buf.write(struct.pack('!h', len(texts) + 1))
+        for text in texts:
+            if text is None:
+                buf.write(struct.pack('!i', -1))
+            else:
+                data = text.encode('utf-8')
+                buf.write(struct.pack('!i', len(data)))
+                buf.write(data)
+        vector = struct.pack(f'!hh{len(embedding)}f', len(embedding), 0, *embedding)
+        buf.write(struct.pack('!i', len(vector)))
+        buf.write(vector)
+    buf.write(struct.pack('!h', -1))
+    buf.seek(0)
+    return buf
+
+def drop_secondary_indexes(cursor):
+    """Drops code_embeddings indexes that back no constraint; returns their definitions."""
+    cursor.execute("""
+        SELECT i.relname, pg_get_indexdef(i.oid)
+        FROM pg_index x
+        JOIN pg_class i ON i.oid = x.indexrelid
+        WHERE x.indrelid = 'code_embeddings'::regclass
+          AND NOT EXISTS (SELECT 1 FROM pg_constraint c WHERE c.conindid = x.indexrelid);
+    """)
+    indexes = cursor.fetchall()
+    for name, _ in indexes:
+        cursor.execute(f'DROP INDEX IF EXISTS "{name}";')
+    logger.info(f"Dropped {len(indexes)} secondary index(es) on 'code_embeddings' for the bulk load.")
+    return [definition for _, definition in indexes]
+
+def recreate_indexes(cursor, definitions):
+    for definition in definitions:
+        cursor.execute(definition)
+    logger.info(f"Rebuilt {len(definitions)} secondary index(es) on 'code_embeddings'.")
+
+class InsertWriter:
+    """Write stage that inserts each batch straight into code_embeddings and chunk_occurrences.
+
+    Chunks a batch's files no longer contain are only deleted by finish(), if nothing
+    references them by then: a chunk that moved to a file in a later batch was not
+    planned for embedding again, so deleting it with the first batch would leave the
+    later file's occurrences pointing at nothing. With sweep_orphans (a resumed run, whose
+    interrupted part never reached finish()) every orphaned chunk is deleted instead.
+    """
+
+    def __init__(self, cur, sweep_orphans=False):
+        self.cur = cur
+        self.sweep_orphans = sweep_orphans
+        self.stale = set()
+
+    def write(self, batch):
+        """Applies a batch's chunks, occurrences and manifest updates. Returns (written, 0)."""
+        if batch.replaced:
+            self.cur.execute("DELETE FROM chunk_occurrences WHERE file_path = ANY(%s);", (batch.replaced,))
+        if batch.chunks:
+            values_to_insert = embedding_rows(batch)
+            query = """
+                INSERT INTO code_embeddings (chunk_text, chunk_hash, embedding)
+                VALUES %s
+                ON CONFLICT (chunk_hash) DO NOTHING;
+            """
+            execute_values(self.cur, query, values_to_insert, page_size=len(values_to_insert))
+            insert_symbols(self.cur, symbol_rows(batch))
+        insert_occurrences(self.cur, batch.occurrences)
+        upsert_manifest(self.cur, batch.manifest)
+        self.stale.update(batch.stale)
+        return len(batch.chunks), 0
+
+    def finish(self):
+        """Deletes the stale chunks that no file references any more. Returns (None, deleted)."""
+        deleted = delete_orphan_chunks(self.cur, None if self.sweep_orphans else self.stale)
+        self.stale = set()
+        return None, deleted
+
+class CopyWriter:
+    """Bulk-load write stage: COPY each batch into unlogged staging tables, merge once at the end.
+
+    Occurrences and manifest entries are staged too and only merged together with the
+    chunks, so an interrupted load never marks files as ingested. With rebuild_indexes (full rebuilds)
+    the secondary indexes on code_embeddings are dropped for the merge and rebuilt after,
+    instead of being updated row by row. keep_staged leaves rows an interrupted run staged in
+    place, for a resumed run to merge with finish() before it continues.
+    """
+
+    def __init__(self, cur, rebuild_indexes=False, keep_staged=False):
+        self.cur = cur
+        self.rebuild_indexes = rebuild_indexes
+        cur.execute("""
+            CREATE UNLOGGED TABLE IF NOT EXISTS code_embeddings_staging (
+                chunk_text TEXT NOT NULL,
+                chunk_hash TEXT NOT NULL,
+                embedding VECTOR(768)
+            );
+        """)
+        cur.execute("""
+            CREATE UNLOGGED TABLE IF NOT EXISTS chunk_occurrences_staging (
+                file_path TEXT NOT NULL,
+                ordinal INTEGER NOT NULL,
+                chunk_hash TEXT NOT NULL,
+                procedure_name TEXT,
+                start_offset INTEGER,
+                end_offset INTEGER,
+                start_line INTEGER
+            );
+        """)
+        cur.execute("CREATE UNLOGGED TABLE IF NOT EXISTS ingestion_replaced_staging (file_path TEXT NOT NULL);")
+        cur.execute("""
+            CREATE UNLOGGED TABLE IF NOT EXISTS chunk_symbols_staging (
+                chunk_hash TEXT NOT NULL,
+                kind TEXT NOT NULL,
+                target TEXT NOT NULL
+            );
+        """)
+        cur.execute("""
+            CREATE UNLOGGED TABLE IF NOT EXISTS ingestion_manifest_staging (
+                file_path TEXT NOT NULL,
+                file_size BIGINT NOT NULL,
+                file_mtime DOUBLE PRECISION NOT NULL,
+                content_hash TEXT NOT NULL
+            );
+        """)
+        if not keep_staged:
+            self._truncate_staging()
+
+    def _truncate_staging(self):
+        self.cur.execute("TRUNCATE code_embeddings_staging, chunk_occurrences_staging, chunk_symbols_staging, "
+                         "ingestion_replaced_staging, ingestion_manifest_staging;")
+
+    def write(self, batch):
+        if batch.chunks:
+            self.cur.copy_expert(
+                "COPY code_embeddings_staging (chunk_text, chunk_hash, embedding) "
+                "FROM STDIN WITH (FORMAT binary);",
+                encode_copy_binary(embedding_rows(batch))
+            )
+            symbols = symbol_rows(batch)
+            if symbols:
+                execute_values(self.cur, "INSERT INTO chunk_symbols_staging VALUES %s;", symbols, page_size=1000)
+        if batch.occurrences:
+            execute_values(self.cur, "INSERT INTO chunk_occurrences_staging VALUES %s;", batch.occurrences,
+                           page_size=1000)
+        if batch.replaced:
+            execute_values(self.cur, "INSERT INTO ingestion_replaced_staging VALUES %s;",
+                           [(file_path,) for file_path in batch.replaced])
+        if batch.manifest:
+            execute_values(self.cur, "INSERT INTO ingestion_manifest_staging VALUES %s;", batch.manifest)
+        return len(batch.chunks), 0
+
+    def finish(self):
+        """Merges the staged rows into code_embeddings and chunk_occurrences.
+
+        Returns (chunks merged, orphaned chunks deleted).
+        """
+        index_definitions = drop_secondary_indexes(self.cur) if self.rebuild_indexes else []
+        self.cur.execute("""
+            INSERT INTO code_embeddings (chunk_text, chunk_hash, embedding)
+            SELECT DISTINCT ON (chunk_hash) chunk_text, chunk_hash, embedding
+            FROM code_embeddings_staging
+            ORDER BY chunk_hash
+            ON CONFLICT (chunk_hash) DO NOTHING;
+        """)
+        merged = self.cur.rowcount
+        self.cur.execute("""
+            INSERT INTO chunk_symbols (chunk_hash, kind, target)
+            SELECT DISTINCT chunk_hash, kind, target
+            FROM chunk_symbols_staging
+            ON CONFLICT DO NOTHING;
+        """)
+        self.cur.execute("""
+            DELETE FROM chunk_occurrences o
+            USING ingestion_replaced_staging r
+            WHERE o.file_path = r.file_path;
+        """)
+        self.cur.execute("""
+            INSERT INTO chunk_occurrences
+                (file_path, ordinal, chunk_hash, procedure_name, start_offset, end_offset, start_line)
+            SELECT DISTINCT ON (file_path, ordinal)
+                   file_path, ordinal, chunk_hash, procedure_name, start_offset, end_offset, start_line
+            FROM chunk_occurrences_staging
+            ORDER BY file_path, ordinal
+            ON CONFLICT (file_path, ordinal) DO NOTHING;
+        """)
+        # One anti-join over the whole store instead of per-batch stale lists.
+        deleted = delete_orphan_chunks(self.cur)
+        self.cur.execute("""
+            INSERT INTO ingestion_manifest (file_path, file_size, file_mtime, content_hash)
+            SELECT DISTINCT ON (file_path) file_path, file_size, file_mtime, content_hash
+            FROM ingestion_manifest_staging
+            ORDER BY file_path
+            ON CONFLICT (file_path) DO UPDATE SET
+                file_size = EXCLUDED.file_size,
+                file_mtime = EXCLUDED.file_mtime,
+                content_hash = EXCLUDED.content_hash,
+                last_ingested = NOW();
+        """)
+        recreate_indexes(self.cur, index_definitions)
+        self._truncate_staging()
+        return merged, deleted
+
+def timed_embed_documents(texts):
+    with EMBED_SECONDS.time():
+        return embeddings.embed_documents(texts)
+
+def ingest_codebase(full_rebuild=False, batch_size=50, queue_size=8, embed_concurrency=EMBED_CONCURRENCY,
+                    embed_rpm=EMBED_RPM, workers=1, bulk=False, paths=None, resume=None):
+    """Main function to orchestrate the code ingestion process.
+
+    By default the run is incremental: files whose size and mtime match the manifest are
+    skipped without being read, changed files only have their new chunks embedded, and rows
+    for chunks and files that disappeared are deleted. full_rebuild=True truncates first.
+
+    walk -> scan -> plan -> embed run as a streaming pipeline on background threads with
+    bounded queues in between, and this thread writes each batch as soon as it is embedded,
+    so memory use does not depend on the size of the repo. With workers > 1 the scan stage
+    reads and chunks files on a process pool; the output is identical to the serial path.
+    bulk=True loads through COPY and a staging table instead of per-batch INSERTs.
+    With `paths` (relative files or directories, as reported by watch mode) only those are
+    looked at: the ones that exist are re-chunked and upserted, the ones that are gone are
+    deleted, and the rest of the tree is not walked.
+
+    Each run is recorded in ingestion_runs, and each batch it commits is checkpointed in the
+    same transaction. A batch that fails to embed or write is retried with exponential
+    backoff and, after INGEST_BATCH_MAX_ATTEMPTS tries, dead-lettered; its files are left out
+    of the manifest, so the next run picks them up again. resume ('latest' or a run ID)
+    continues an interrupted full or incremental run in its own mode without truncating:
+    committed batches are already in the manifest, their chunks in code_embeddings (a bulk
+    run merges what it staged first), so nothing they contain is embedded again, and batches
+    that were embedded but not committed are served from the embedding cache, which resume
+    therefore requires.
+    Returns the run's stats (None if it could not start).
+    """
+    if not os.path.isdir(CODE_REPO_PATH):
+        logger.error(f"Code repo path {CODE_REPO_PATH} does not exist or is not a directory.")
+        return None
+
+    cache = open_embedding_cache(EMBEDDING_CACHE_PATH, EMBEDDING_CACHE_MAX_MB)
+    if resume and cache is None:
+        # The cache is the only place vectors of batches that were embedded but not yet
+        # committed survive the interrupted run; resuming without it would pay for them again.
+        logger.error("--resume needs the embedding cache (EMBEDDING_CACHE_PATH): without it, chunks the "
+                     "interrupted run embedded but did not commit would be embedded again.")
+        return None
+
+    conn = get_db_connection()
+    if conn is None:
+        logger.error("Cannot proceed without a database connection.")
+        if cache:
+            cache.close()
+        return None
+    plan_conn = None
+    run_id = None
+    pipeline = None
+    scan_pool = None
+    scan_errors = []
+    dead_lettered = []
+    recent_hashes = RecentHashes()
+    lost_hashes = set()  # chunks of dead-lettered batches that later batches may share
+    dispatcher = EmbeddingDispatcher(
+        timed_embed_documents,
+        max_in_flight=embed_concurrency,
+        max_batch_size=EMBED_MAX_BATCH_SIZE,
+        max_batch_chars=EMBED_MAX_BATCH_CHARS,
+        requests_per_minute=embed_rpm or None,
+    )
+
+    stats = {
+        'files_processed': 0,
+        'files_unchanged': 0,
+        'files_removed': 0,
+        'chunks_generated': 0,
+        'chunks_ingested': 0,
+        'chunks_deleted': 0,
+        'occurrences_written': 0,
+        'batches_failed': 0,
+        'batch_retries': 0,
+        'rows_written': 0,
+        'write_seconds': 0.0,
+    }
+    started_at = time.monotonic()
 
     try:
+        # Binary COPY sends text columns as raw UTF-8.
+        conn.set_client_encoding('UTF8')
         with conn.cursor() as cur:
             create_embeddings_table(cur)
-            clear_embeddings_table(cur)
+            create_manifest_table(cur)
+            create_run_tables(cur)
+            pruned = prune_runs(cur, INGEST_RUN_RETENTION_DAYS)
+            if pruned:
+                logger.info(f"Pruned {pruned} finished run(s) older than {INGEST_RUN_RETENTION_DAYS} days.")
+            resumed = None
+            if resume:
+                resumed = find_resumable_run(cur, None if resume == 'latest' else resume)
+                if resumed is None:
+                    logger.warning(f"No interrupted run to resume ({resume}); running incrementally instead.")
+            if resumed:
+                run_id, mode, bulk, batches_committed = resumed
+                full_rebuild = mode == 'full'
+                reopen_run(cur, run_id)
+                batch_no = next_batch_no(cur, run_id)
+                logger.info(f"Resuming {mode} run {run_id} after {batches_committed} committed batch(es).")
+            else:
+                mode = 'paths' if paths is not None else 'full' if full_rebuild else 'incremental'
+                run_id = start_run(cur, mode, bulk)
+                batch_no = 1
+                if full_rebuild:
+                    clear_embeddings_table(cur)
+            if full_rebuild:
+                # Building the ANN index once after the load is far cheaper than
+                # updating it for every inserted row.
+                drop_vector_index(cur)
+            conn.commit()
+
+            if bulk:
+                writer = CopyWriter(cur, rebuild_indexes=full_rebuild, keep_staged=bool(resumed))
+            else:
+                writer = InsertWriter(cur, sweep_orphans=bool(resumed))
+            conn.commit()
+            if resumed and bulk:
+                # Merge what the interrupted run staged, so the files are in the manifest and
+                # the chunks in code_embeddings before planning starts.
+                merged, deleted = writer.finish()
+                conn.commit()
+                stats['chunks_ingested'] += merged
+                stats['chunks_deleted'] += deleted
+                logger.info(f"Merged {merged} chunk(s) staged by the interrupted run.")
+
+            manifest = load_manifest(cur, paths)
             conn.commit()
+            scope = f"{len(paths)} changed path(s) in" if paths is not None else "code scanning in:"
+            logger.info(f"Starting {mode} run {run_id}: {scope} {CODE_REPO_PATH} "
+                        f"({len(manifest)} files in manifest)")
 
-            logger.info(f"Starting code scanning in: {CODE_REPO_PATH}")
-            all_chunks_to_ingest = []
-            explicit_extensions = ('.p', '.w', '.t')
-
-            for root, _, files in os.walk(CODE_REPO_PATH):
-                for file in files:
-                    _, ext = os.path.splitext(file.lower())
-                    if ext in explicit_extensions or ext.startswith('.i'):
-                        file_path = os.path.join(root, file)
-                        relative_file_path = os.path.relpath(file_path, CODE_REPO_PATH)
-                        logger.debug(f"Processing file: {relative_file_path}")
-                        total_files_processed += 1
-                        try:
-                            with open(file_path, 'r', encoding='latin-1', errors='ignore') as f:
-                                file_content = f.read()
-                            chunks = chunk_openedge_code(file_content, relative_file_path)
-                            for chunk in chunks:
-                                chunk_hash = hashlib.sha256(chunk["chunk_text"].encode('utf-8')).hexdigest()
-                                chunk["chunk_hash"] = chunk_hash
-                                all_chunks_to_ingest.append(chunk)
-                        except Exception as e:
-                            logger.error(f"Error processing {relative_file_path}: {e}")
-                            continue
-            
-            total_chunks_generated = len(all_chunks_to_ingest)
-            logger.info(f"Generated {total_chunks_generated} chunks. Generating embeddings and inserting into DB...")
-
-            batch_size = 50
-            for i in tqdm(range(0, len(all_chunks_to_ingest), batch_size), desc="Ingesting batches"):
-                batch_chunks = all_chunks_to_ingest[i:i + batch_size]
-                texts_to_embed = [chunk["chunk_text"] for chunk in batch_chunks]
+            # The plan stage only reads, on its own connection so it never sees or
+            # holds open the write stage's transaction.
+            plan_conn = get_db_connection()
+            if plan_conn is None:
+                raise RuntimeError("Could not open a second connection for the plan stage.")
+            plan_conn.autocommit = True
+
+            if workers > 1:
+                scan_pool = ProcessPoolExecutor(max_workers=workers)
+            pipeline = Pipeline(queue_size=queue_size)
+            walk = iter_source_files(CODE_REPO_PATH) if paths is None else iter_source_paths(CODE_REPO_PATH, paths)
+            source_files = pipeline.stage("walk", walk, maxsize=1000)
+            scanned_files = pipeline.stage("scan", scan_files(source_files, manifest, stats, scan_errors, scan_pool, window=workers * 4))
+            planned = pipeline.stage("plan", plan_batches(scanned_files, plan_conn.cursor(), batch_size,
+                                                          recent_hashes=recent_hashes))
+            embedded = pipeline.stage("embed", embed_batches(planned, dispatcher, cache), maxsize=2)
+
+            writer_name = 'copy' if bulk else 'insert'
+
+            def write_batch(batch, attempt):
+                """One try at a batch: re-embeds it if embedding failed, then writes and checkpoints it."""
+                if batch.error is not None and attempt > 1:
+                    next(embed_batches([batch], dispatcher, cache))
+                if batch.error is not None:
+                    raise batch.error
+                reclaim_lost_chunks(batch, lost_hashes, dispatcher, cache)
+                write_started = time.monotonic()
                 try:
-                    embeddings_list = embeddings.embed_documents(texts_to_embed)
-                    values_to_insert = [
-                        (
-                            chunk["file_path"],
-                            chunk.get("procedure_name"),
-                            chunk["chunk_text"],
-                            chunk["chunk_hash"],
-                            embedding
-                        ) for chunk, embedding in zip(batch_chunks, embeddings_list)
-                    ]
-                    query = """
-                        INSERT INTO code_embeddings (file_path, procedure_name, chunk_text, chunk_hash, embedding)
-                        VALUES %s
-                        ON CONFLICT (chunk_hash) DO NOTHING;
-                    """
-                    execute_values(cur, query, values_to_insert, page_size=batch_size)
+                    written, deleted = writer.write(batch)
+                    record_checkpoint(cur, run_id, batch_no, len(batch.manifest), len(batch.chunks),
+                                      len(batch.occurrences), batch.manifest[-1][0] if batch.manifest else None)
                     conn.commit()
-                    total_chunks_ingested += len(values_to_insert)
-                except Exception as e:
-                    logger.error(f"\nError during batch ingestion (batch {i}-{i+batch_size}): {e}")
+                except Exception:
                     conn.rollback()
+                    raise
+                # Stored now, whether reclaimed or planned again after the failure.
+                lost_hashes.difference_update(chunk["chunk_hash"] for chunk in batch.chunks)
+                return written, deleted, time.monotonic() - write_started
+
+            for batch in tqdm(embedded, desc="Ingesting batches"):
+                result, error, attempts = retry_with_backoff(
+                    lambda attempt: write_batch(batch, attempt),
+                    max_attempts=INGEST_BATCH_MAX_ATTEMPTS,
+                    backoff_base=INGEST_RETRY_BACKOFF_SEC,
+                    backoff_max=INGEST_RETRY_BACKOFF_MAX_SEC,
+                    label=f"Batch {batch_no} ({len(batch.chunks)} chunks)",
+                )
+                stats['batch_retries'] += attempts - 1
+                if error is not None:
+                    stage = 'embed' if batch.error is not None else 'write'
+                    logger.error(f"\nBatch {batch_no} ({len(batch.chunks)} chunks) failed to {stage} after "
+                                 f"{attempts} attempt(s), dead-lettering {len(batch.manifest)} file(s): {error}")
+                    stats['batches_failed'] += 1
+                    ERRORS.inc(stage=stage)
+                    dead_lettered.extend((entry[0], stage) for entry in batch.manifest)
+                    # Batches planned from now on embed these chunks again; ones already
+                    # planned reclaim them from their borrowed list when they are written.
+                    failed_hashes = {chunk["chunk_hash"] for chunk in batch.chunks}
+                    recent_hashes.discard(failed_hashes)
+                    lost_hashes.update(failed_hashes)
+                    try:
+                        record_dead_letters(cur, run_id, [entry[0] for entry in batch.manifest], stage, attempts, error)
+                        conn.commit()
+                    except Exception as e:
+                        logger.error(f"Could not record dead letters for batch {batch_no}: {e}")
+                        conn.rollback()
+                else:
+                    written, deleted, write_seconds = result
+                    batch_no += 1
+                    WRITE_SECONDS.observe(write_seconds, writer=writer_name)
+                    stats['write_seconds'] += write_seconds
+                    stats['rows_written'] += written
+                    stats['chunks_deleted'] += deleted
+                    stats['occurrences_written'] += len(batch.occurrences)
+                    CHUNKS.inc(written, outcome='written')
+                    CHUNKS.inc(len(batch.occurrences), outcome='occurrences')
+                    CHUNKS.inc(deleted, outcome='deleted')
+                    if not bulk:
+                        stats['chunks_ingested'] += written
+                elapsed = max(time.monotonic() - started_at, 1e-9)
+                THROUGHPUT.set(stats['files_processed'] / elapsed, unit='files')
+                THROUGHPUT.set(stats['chunks_generated'] / elapsed, unit='chunks')
+            pipeline.check()
+
+            write_started = time.monotonic()
+            merged, deleted = writer.finish()
+            conn.commit()
+            WRITE_SECONDS.observe(time.monotonic() - write_started, writer=f'{writer_name}_finish')
+            stats['write_seconds'] += time.monotonic() - write_started
+            if merged is not None:
+                stats['chunks_ingested'] += merged
+            stats['chunks_deleted'] += deleted
+            CHUNKS.inc(deleted, outcome='deleted')
+
+            # An empty walk against a non-empty manifest almost certainly means the repo
+            # mount is missing, so never treat that as "every file was deleted".
+            removed_files = list(manifest)
+            if removed_files and stats['files_processed'] == 0 and paths is None:
+                logger.warning("No source files found; not removing previously ingested files.")
+            elif removed_files:
+                deleted = delete_removed_files(cur, removed_files)
+                conn.commit()
+                stats['chunks_deleted'] += deleted
+                CHUNKS.inc(deleted, outcome='deleted')
+                stats['files_removed'] = len(removed_files)
+
+            ensure_vector_index(cur)
+            finish_run(cur, run_id, 'completed', stats)
+            conn.commit()
 
     except Exception as e:
         logger.error(f"An error occurred during ingestion: {e}")
+        ERRORS.inc(stage='run')
         if conn:
             conn.rollback()
+            if run_id:
+                # Its committed batches stay checkpointed; --resume carries on from them.
+                try:
+                    with conn.cursor() as cur:
+                        finish_run(cur, run_id, 'failed', stats)
+                    conn.commit()
+                except Exception as mark_error:
+                    logger.error(f"Could not mark run {run_id} as failed: {mark_error}")
     finally:
+        if pipeline:
+            pipeline.close()
+        if scan_pool:
+            scan_pool.shutdown(cancel_futures=True)
+        if plan_conn:
+            plan_conn.close()
         if conn:
             conn.close()
             logger.info("Database connection closed.")
+        if cache:
+            cache.close()
 
     logger.info("--- Ingestion Process Summary ---")
-    logger.info(f"Total files processed: {total_files_processed}")
-    logger.info(f"Total chunks generated: {total_chunks_generated}")
-    logger.info(f"Total chunks successfully ingested: {total_chunks_ingested}")
+    logger.info(f"Total files processed: {stats['files_processed']}")
+    logger.info(f"Total files unchanged (skipped): {stats['files_unchanged']}")
+    logger.info(f"Total files removed: {stats['files_removed']}")
+    logger.info(f"Total files failed: {len(scan_errors)}")
+    for relative_file_path, error in scan_errors[:20]:
+        logger.error(f"  {relative_file_path}: {error}")
+    if len(scan_errors) > 20:
+        logger.error(f"  ... and {len(scan_errors) - 20} more")
+    logger.info(f"Total chunks generated: {stats['chunks_generated']}")
+    logger.info(f"Total chunks successfully ingested: {stats['chunks_ingested']}")
+    logger.info(f"Total chunk occurrences written: {stats['occurrences_written']}")
+    logger.info(f"Total orphaned chunks deleted: {stats['chunks_deleted']}")
+    logger.info(f"Total failed batches: {stats['batches_failed']} ({stats['batch_retries']} retries)")
+    if dead_lettered:
+        logger.error(f"Dead-lettered files (run {run_id}, see ingestion_dead_letters):")
+        for relative_file_path, stage in dead_lettered[:20]:
+            logger.error(f"  {relative_file_path} ({stage})")
+        if len(dead_lettered) > 20:
+            logger.error(f"  ... and {len(dead_lettered) - 20} more")
+    logger.info(f"Rows written ({'COPY bulk load' if bulk else 'INSERT'}): {stats['rows_written']} in "
+                f"{stats['write_seconds']:.1f}s ({stats['rows_written'] / max(stats['write_seconds'], 1e-9):.0f} rows/sec)")
+    elapsed = time.monotonic() - started_at
+    logger.info(f"Elapsed: {elapsed:.1f}s ({stats['files_processed'] / max(elapsed, 1e-9):.1f} files/sec)")
+    THROUGHPUT.set(stats['files_processed'] / max(elapsed, 1e-9), unit='files')
+    THROUGHPUT.set(stats['chunks_generated'] / max(elapsed, 1e-9), unit='chunks')
+    embed_stats = dispatcher.stats()
+    logger.info(f"Embedding requests: {embed_stats['requests']} ({embed_stats['retries']} retries), "
+                f"{embed_stats['chunks_embedded']} chunks at {embed_stats['chunks_per_sec']:.1f} chunks/sec")
+    if cache:
+        cache_stats = cache.stats()
+        logger.info(f"Embedding cache: {cache_stats['hits']} hits, {cache_stats['misses']} misses")
     logger.info("--- End of Summary ---")
+    LAST_RUN.set(time.time())
+    if METRICS_TEXTFILE:
+        try:
+            write_textfile(metrics, METRICS_TEXTFILE)
+        except OSError as e:
+            logger.error(f"Could not write metrics to {METRICS_TEXTFILE}: {e}")
+    stats['run_id'] = run_id
+    stats['files_failed'] = len(scan_errors)
+    stats['elapsed_seconds'] = elapsed
+    stats['embedding'] = embed_stats
+    return stats
+
+def watch_codebase(mode=WATCH_MODE, debounce=WATCH_DEBOUNCE_SEC, max_wait=WATCH_MAX_WAIT_SEC,
+                   poll_interval=WATCH_POLL_INTERVAL_SEC, **ingest_kwargs):
+    """Keeps vector_db in step with CODE_REPO_PATH until SIGTERM or Ctrl-C.
+
+    The watcher is started first and an incremental run then catches up on whatever changed
+    while nothing was watching; after that each debounced burst of file events runs
+    ingest_codebase on just the touched paths. Lost events (inotify queue overflow) fall
+    back to one incremental run over the whole tree.
+    """
+    stop = threading.Event()
+    signal.signal(signal.SIGTERM, lambda signum, frame: stop.set())
+    watcher = open_watcher(CODE_REPO_PATH, mode, poll_interval)
+
+    def on_change(paths, first_event):
+        logger.info(f"Ingesting {len(paths)} changed path(s)...")
+        if ingest_codebase(paths=sorted(paths), **ingest_kwargs) is not None:
+            lag = time.monotonic() - first_event
+            WATCH_LAG_SECONDS.observe(lag)
+            logger.info(f"Changes reflected {lag:.1f}s after the first file event.")
+
+    try:
+        ingest_codebase(**ingest_kwargs)
+        logger.info(f"Watching {CODE_REPO_PATH} for changes (debounce {debounce}s, max wait {max_wait}s)...")
+        watch(watcher, on_change, lambda: ingest_codebase(**ingest_kwargs),
+              Debouncer(debounce, max_wait), should_stop=stop.is_set)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        watcher.close()
+    logger.info("Stopped watching.")
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Chunk, embed and load the OpenEdge code repo into vector_db.")
+    parser.add_argument('--full', action='store_true',
+                        help="Truncate code_embeddings and chunk_occurrences and re-embed everything instead of running incrementally.")
+    parser.add_argument('--batch-size', type=int, default=50,
+                        help="Chunks per insert transaction (default: 50).")
+    parser.add_argument('--queue-size', type=int, default=8,
+                        help="Maximum items buffered between pipeline stages (default: 8).")
+    parser.add_argument('--embed-concurrency', type=int, default=EMBED_CONCURRENCY,
+                        help=f"Embedding requests kept in flight at once (default: {EMBED_CONCURRENCY}).")
+    parser.add_argument('--embed-rpm', type=int, default=EMBED_RPM,
+                        help="Maximum embedding requests per minute, 0 for no limit (default: EMBED_RPM or 0).")
+    parser.add_argument('--bulk', action='store_true',
+                        help="Load rows with binary COPY into a staging table and merge them once at the end "
+                             "(with --full, secondary indexes are dropped and rebuilt around the merge).")
+    parser.add_argument('--workers', type=int, default=INGEST_WORKERS,
+                        help="Processes used to read and chunk files; 1 scans serially, 0 uses every CPU "
+                             f"(default: {INGEST_WORKERS}).")
+    parser.add_argument('--resume', nargs='?', const='latest', metavar='RUN_ID',
+                        help="Continue the latest (or the given) interrupted run from its last committed batch, "
+                             "in that run's own mode (--full and --bulk are taken from it). Needs EMBEDDING_CACHE_PATH.")
+    parser.add_argument('--watch', action='store_true',
+                        help="Stay running and ingest files as they change (inotify, or polling as a fallback; "
+                             "see WATCH_MODE and WATCH_DEBOUNCE_SEC).")
+    parser.add_argument('--reindex', action='store_true',
+                        help="Only (re)build the vector index with the configured parameters, then exit.")
+    parser.add_argument('--eval-recall', action='store_true',
+                        help="Only measure recall@k and latency of the vector index against exact search, then exit.")
+    parser.add_argument('--sample', type=int, default=100,
+                        help="Queries sampled for --eval-recall (default: 100).")
+    parser.add_argument('--k', type=int, default=10,
+                        help="k for --eval-recall (default: 10).")
+    parser.add_argument('--search-values', type=int, nargs='+', default=[40, 100, 200],
+                        help="hnsw.ef_search / ivfflat.probes values tried by --eval-recall (default: 40 100 200).")
+    args = parser.parse_args(argv)
+    if args.resume and (args.full or args.watch):
+        parser.error("--resume cannot be combined with --full or --watch")
+    return args
+
+def reindex():
+    """Rebuilds the vector index with the configured parameters."""
+    conn = get_db_connection()
+    if conn is None:
+        logger.error("Cannot reindex without a database connection.")
+        return
+    try:
+        with conn.cursor() as cur:
+            ensure_vector_index(cur, force=True)
+        conn.commit()
+    finally:
+        conn.close()
 
 if __name__ == '__main__':
+    args = parse_args()
+    if METRICS_PORT:
+        serve(metrics, METRICS_PORT)
+    if args.reindex:
+        reindex()
+        sys.exit(0)
+    if args.eval_recall:
+        evaluate_recall(sample_size=args.sample, k=args.k, search_values=args.search_values)
+        sys.exit(0)
     logger.info("Starting code ingestion script...")
-    ingest_codebase()
+    ingest_kwargs = dict(
+        batch_size=args.batch_size,
+        queue_size=args.queue_size,
+        embed_concurrency=args.embed_concurrency,
+        embed_rpm=args.embed_rpm,
+        workers=args.workers or os.cpu_count(),
+    )
+    if args.watch:
+        watch_codebase(**ingest_kwargs)
+    else:
+        ingest_codebase(full_rebuild=args.full, bulk=args.bulk, resume=args.resume, **ingest_kwargs)
     logger.info("Ingestion script finished.")
@@ -0,0 +1,77 @@
+import logging
+import queue
+import threading
+
+logger = logging.getLogger(__name__)
+
+_END = object()
+
+class Pipeline:
+    """Chains generator stages together on background threads with bounded queues between them.
+
+    Each call to stage() starts a thread that drains `items` into a queue of at most `maxsize`
+    entries and returns an iterator over that queue, which can be fed into the next stage.
+    A full queue blocks the producing stage, so memory stays flat however large the input is.
+    The first exception raised by any stage stops every stage and is re-raised by check().
+    """
+
+    def __init__(self, queue_size=8, poll_interval=0.1):
+        self.queue_size = queue_size
+        self.poll_interval = poll_interval
+        self.stop_event = threading.Event()
+        self.errors = []
+        self.threads = []
+
+    def stage(self, name, items, maxsize=None):
+        """Runs `items` on a new thread and returns an iterator over what it produces."""
+        out = queue.Queue(maxsize or self.queue_size)
+
+        def run():
+            try:
+                for item in items:
+                    if not self._put(out, item):
+                        return
+            except Exception as e:
+                logger.error(f"Pipeline stage '{name}' failed: {e}")
+                self.errors.append((name, e))
+                self.stop_event.set()
+            finally:
+                self._put(out, _END)
+
+        thread = threading.Thread(target=run, name=f"pipeline-{name}", daemon=True)
+        thread.start()
+        self.threads.append(thread)
+        return self._drain(out)
+
+    def _put(self, out, item):
+        while not self.stop_event.is_set():
+            try:
+                out.put(item, timeout=self.poll_interval)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _drain(self, source):
+        while True:
+            try:
+                item = source.get(timeout=self.poll_interval)
+            except queue.Empty:
+                if self.stop_event.is_set():
+                    return
+                continue
+            if item is _END:
+                return
+            yield item
+
+    def check(self):
+        """Raises the first stage error, if any stage failed."""
+        if self.errors:
+            name, error = self.errors[0]
+            raise RuntimeError(f"Pipeline stage '{name}' failed: {error}") from error
+
+    def close(self, timeout=5):
+        """Stops all stages and waits briefly for their threads to exit."""
+        self.stop_event.set()
+        for thread in self.threads:
+            thread.join(timeout)
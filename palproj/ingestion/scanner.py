@@ -0,0 +1,118 @@
+import hashlib
+import os
+from collections import deque
+
+from openedge_chunker import chunk_openedge_code
+
+def is_source_file(filename):
+    """Returns True for the OpenEdge source extensions we ingest (.p, .w, .t and .i*)."""
+    _, ext = os.path.splitext(filename.lower())
+    return ext in ('.p', '.w', '.t') or ext.startswith('.i')
+
+def iter_source_files(repo_path):
+    """Yields (file_path, relative_file_path) for every source file, in a stable order."""
+    for root, dirs, files in os.walk(repo_path):
+        dirs.sort()
+        for file in sorted(files):
+            if is_source_file(file):
+                file_path = os.path.join(root, file)
+                yield file_path, os.path.relpath(file_path, repo_path)
+
+def iter_source_paths(repo_path, relative_paths):
+    """Yields (file_path, relative_file_path) for the source files at or under each of
+    relative_paths that still exist, once each and in a stable order."""
+    seen = set()
+    for relative_path in sorted(set(relative_paths)):
+        path = os.path.join(repo_path, relative_path)
+        if os.path.isdir(path):
+            found = iter_source_files(path)
+            found = ((file_path, os.path.relpath(file_path, repo_path)) for file_path, _ in found)
+        elif os.path.isfile(path) and is_source_file(path):
+            found = [(path, os.path.normpath(relative_path))]
+        else:
+            continue
+        for file_path, relative_file_path in found:
+            if relative_file_path not in seen:
+                seen.add(relative_file_path)
+                yield file_path, relative_file_path
+
+def read_source_file(file_path):
+    """Reads a source file, returning (content_hash, text).
+
+    The hash is taken over the raw bytes; the text is latin-1 decoded with universal
+    newlines, exactly as the original text-mode read produced it.
+    """
+    with open(file_path, 'rb') as f:
+        raw = f.read()
+    text = raw.decode('latin-1').replace('\r\n', '\n').replace('\r', '\n')
+    return hashlib.sha256(raw).hexdigest(), text
+
+def chunk_hash(chunk_text):
+    """SHA-256 of a chunk's text, as stored in code_embeddings.chunk_hash."""
+    return hashlib.sha256(chunk_text.encode('utf-8')).hexdigest()
+
+def chunk_positions(text, chunk_texts):
+    """(start_offset, end_offset, start_line) of each chunk in the decoded file text.
+
+    Chunks are stripped, in-order pieces of the file, so each is found after the previous
+    one. Lines are 1-based.
+    """
+    positions = []
+    pos = 0
+    line = 1
+    for chunk_text in chunk_texts:
+        start = text.find(chunk_text, pos)
+        if start < 0:
+            start = pos
+        line += text.count('\n', pos, start)
+        end = start + len(chunk_text)
+        positions.append((start, end, line))
+        line += text.count('\n', start, end)
+        pos = end
+    return positions
+
+def scan_source_file(file_path, relative_file_path, max_chunk_chars=None, previous_hash=None):
+    """Reads, decodes, chunks and hashes one file.
+
+    Runs inside worker processes, so it never logs and only sends compact tuples back:
+    (content_hash, [(procedure_name, chunk_text, chunk_hash, start_offset, end_offset,
+    start_line, references), ...], error), references being extract_references() pairs. The chunk list is None when the content still hashes to
+    previous_hash; on failure only error is set.
+    """
+    try:
+        content_hash, text = read_source_file(file_path)
+        if content_hash == previous_hash:
+            return content_hash, None, None
+        chunks = chunk_openedge_code(text, relative_file_path, max_chunk_chars, references=True)
+        positions = chunk_positions(text, [chunk["chunk_text"] for chunk in chunks])
+        chunks = [
+            (chunk["procedure_name"], chunk["chunk_text"], chunk_hash(chunk["chunk_text"])) + position
+            + (chunk["references"],)
+            for chunk, position in zip(chunks, positions)
+        ]
+        return content_hash, chunks, None
+    except Exception as e:
+        return None, None, f"{type(e).__name__}: {e}"
+
+def _scan_task(task):
+    item, args = task
+    return item, scan_source_file(*args)
+
+def scan_in_order(tasks, pool=None, window=64):
+    """Runs scan_source_file over (item, args) tasks, yielding (item, result) in input order.
+
+    With a process pool at most `window` files are in flight at once, so a streaming walk
+    stays streaming; without one the files are scanned inline. Both paths yield the same
+    results in the same order.
+    """
+    if pool is None:
+        for task in tasks:
+            yield _scan_task(task)
+        return
+    pending = deque()
+    for task in tasks:
+        pending.append(pool.submit(_scan_task, task))
+        if len(pending) >= window:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
@@ -0,0 +1,124 @@
+"""Deterministic synthetic OpenEdge source trees, for benchmarks and tests.
+
+Usage: python synthetic_corpus.py OUTPUT_DIR [--programs 400] [--includes 60] [--windows 20] [--seed 0]
+"""
+import argparse
+import os
+import random
+
+TABLES = ('customer', 'order', 'order-line', 'item', 'invoice', 'gltrans', 'vendor', 'po-line')
+
+# Boilerplate pasted into many programs, as copy-paste and generated code are in real trees.
+BOILERPLATE = """/*------------------------------------------------------------------------
+  Copyright (c) Synthetic Corp. All rights reserved.
+  Generated by the synthetic corpus builder; do not edit by hand.
+------------------------------------------------------------------------*/
+DEFINE VARIABLE lOk AS LOGICAL NO-UNDO.
+DEFINE VARIABLE cMessage AS CHARACTER NO-UNDO.
+"""
+
+def synthetic_abl_file(procedures, statements_per_procedure=30, seed=0):
+    """Builds an AppBuilder-style .w/.p file with many internal procedures.
+
+    Only constructs the legacy and current chunkers agree on are used, so bench_chunker
+    can compare their outputs.
+    """
+    rng = random.Random(seed)
+    lines = [
+        "/* Synthetic ABL source for benchmarking. */",
+        "{src/adm2/widgetprto.i}",
+        "DEFINE VARIABLE cResult AS CHARACTER NO-UNDO.",
+        "DEFINE TEMP-TABLE ttLine NO-UNDO FIELD lineNo AS INTEGER FIELD amt AS DECIMAL.",
+    ]
+    for p in range(procedures):
+        lines.append(f"/* ---- ip-proc-{p}: generated procedure ---- */")
+        lines.append(f"PROCEDURE ip-proc-{p} :")
+        lines.append("  DEFINE INPUT PARAMETER ipValue AS INTEGER NO-UNDO.")
+        for s in range(statements_per_procedure):
+            choice = rng.randrange(4)
+            if choice == 0:
+                lines.append(f"  FOR EACH ttLine WHERE ttLine.lineNo > {s}: ttLine.amt = ttLine.amt * 1.1. END.")
+            elif choice == 1:
+                lines.append(f"  cResult = \"value {s} for ip-proc-{p}\" + STRING(ipValue).")
+            elif choice == 2:
+                lines.append(f"  IF ipValue > {s} THEN RUN ip-proc-{rng.randrange(procedures)} (INPUT ipValue - 1).")
+            else:
+                lines.append(f"  /* step {s}: recalculate totals */ ASSIGN ipValue = ipValue + {s}.")
+        lines.append("END PROCEDURE.")
+        lines.append("")
+    lines.append("RUN ip-proc-0 (INPUT 10).")
+    return "\n".join(lines) + "\n"
+
+def synthetic_include(index, rng):
+    """A small include file: shared definitions and a preprocessor guard."""
+    table = rng.choice(TABLES)
+    return (
+        f"/* inc/def{index:03d}.i - shared definitions */\n"
+        f"&IF DEFINED(DEF{index:03d}_I) = 0 &THEN\n"
+        f"&GLOBAL-DEFINE DEF{index:03d}_I yes\n"
+        f"DEFINE TEMP-TABLE tt{index:03d} NO-UNDO LIKE {table}.\n"
+        f"DEFINE VARIABLE dTotal{index:03d} AS DECIMAL NO-UNDO.\n"
+        f"&ENDIF\n"
+    )
+
+def synthetic_program(index, programs, includes, rng):
+    """A .p with a few internal procedures that RUN other programs and read tables."""
+    lines = [BOILERPLATE.rstrip("\n")]
+    for include in rng.sample(range(includes), min(includes, rng.randint(1, 3))):
+        lines.append(f"{{inc/def{include:03d}.i}}")
+    for p in range(rng.randint(2, 8)):
+        table = rng.choice(TABLES)
+        lines.append("")
+        lines.append(f"PROCEDURE ip-{index:04d}-{p} :")
+        lines.append("  DEFINE INPUT PARAMETER ipKey AS CHARACTER NO-UNDO.")
+        lines.append(f"  FOR EACH {table} NO-LOCK WHERE {table}.key-field BEGINS ipKey:")
+        for s in range(rng.randint(3, 25)):
+            lines.append(f"    ASSIGN dTotal = dTotal + {s} * {table}.amount. /* line {s} */")
+        lines.append("  END.")
+        if programs > 1:
+            lines.append(f"  RUN prog/p{rng.randrange(programs):04d}.p (INPUT ipKey).")
+        lines.append("END PROCEDURE.")
+    lines.append("")
+    lines.append(f"RUN ip-{index:04d}-0 (INPUT \"\").")
+    return "\n".join(lines) + "\n"
+
+def generate_corpus(output_dir, programs=400, includes=60, windows=20, window_procedures=200, seed=0):
+    """Writes programs (.p), includes (.i) and large AppBuilder windows (.w) under output_dir.
+
+    The same arguments always produce byte-identical files. Returns {'files': n, 'bytes': n}.
+    """
+    rng = random.Random(seed)
+    totals = {'files': 0, 'bytes': 0}
+
+    def write(relative_path, text):
+        path = os.path.join(output_dir, relative_path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        data = text.encode('latin-1')
+        with open(path, 'wb') as f:
+            f.write(data)
+        totals['files'] += 1
+        totals['bytes'] += len(data)
+
+    for i in range(includes):
+        write(f"inc/def{i:03d}.i", synthetic_include(i, rng))
+    for i in range(programs):
+        write(f"prog/p{i:04d}.p", synthetic_program(i, programs, max(includes, 1), rng))
+    for i in range(windows):
+        write(f"win/w{i:03d}.w", synthetic_abl_file(window_procedures, seed=seed + i))
+    return totals
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('output_dir')
+    parser.add_argument('--programs', type=int, default=400)
+    parser.add_argument('--includes', type=int, default=60)
+    parser.add_argument('--windows', type=int, default=20)
+    parser.add_argument('--window-procedures', type=int, default=200)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    totals = generate_corpus(args.output_dir, args.programs, args.includes, args.windows,
+                             args.window_procedures, args.seed)
+    print(f"Wrote {totals['files']} files ({totals['bytes'] / 1024 / 1024:.1f} MB) to {args.output_dir}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,72 @@
+# palproj/ingestion/tests/conftest.py
+import os
+import sys
+
+import pytest
+
+# Make the ingestion modules importable when pytest is run from any directory, and the
+# modules in shared/ (on PYTHONPATH in the container) too.
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+sys.path.insert(1, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..', 'shared')))
+
+# Database tests run against their own scratch database next to vector_db, never
+# against palantir_vector_db itself; they are skipped when no server is reachable.
+TEST_VECTOR_DB_NAME = os.environ.get("TEST_VECTOR_DB_NAME", "palantir_test")
+
+
+def connect_test_database():
+    """Returns an autocommit connection to an empty TEST_VECTOR_DB_NAME, creating it if needed."""
+    psycopg2 = pytest.importorskip("psycopg2")
+    server = dict(
+        host=os.environ.get("VECTOR_DB_HOST", "vector_db"),
+        user=os.environ.get("VECTOR_DB_USER", "palantir_vector_user"),
+        password=os.environ.get("VECTOR_DB_PASSWORD"),
+        connect_timeout=3,
+    )
+    try:
+        admin = psycopg2.connect(database=os.environ.get("VECTOR_DB_NAME", "palantir_vector_db"), **server)
+    except psycopg2.OperationalError as e:
+        pytest.skip(f"vector_db is not reachable: {e}")
+    admin.autocommit = True
+    try:
+        with admin.cursor() as cur:
+            cur.execute("SELECT 1 FROM pg_database WHERE datname = %s;", (TEST_VECTOR_DB_NAME,))
+            if cur.fetchone() is None:
+                cur.execute(f'CREATE DATABASE "{TEST_VECTOR_DB_NAME}";')
+    finally:
+        admin.close()
+    conn = psycopg2.connect(database=TEST_VECTOR_DB_NAME, **server)
+    conn.autocommit = True
+    with conn.cursor() as cur:
+        cur.execute("DROP SCHEMA public CASCADE; CREATE SCHEMA public;")
+    return conn
+
+
+@pytest.fixture
+def ingestion_script(monkeypatch):
+    """The ingestion_script module, importable without a Google API key."""
+    pytest.importorskip("psycopg2")
+    pytest.importorskip("langchain_google_genai")
+    # ingestion_script refuses to import without an API key unless embeddings are faked.
+    monkeypatch.setenv("EMBED_FAKE_LATENCY_SEC", os.environ.get("EMBED_FAKE_LATENCY_SEC") or "0")
+    import ingestion_script
+    return ingestion_script
+
+
+@pytest.fixture
+def vector_db(ingestion_script, monkeypatch, tmp_path):
+    """ingestion_script pointed at an empty scratch database, a repo under tmp_path and fake
+    embeddings. Yields (ingestion_script, autocommit connection, repo path)."""
+    from fake_embeddings import FakeEmbeddings
+
+    conn = connect_test_database()
+    repo = tmp_path / "repo"
+    repo.mkdir()
+    monkeypatch.setattr(ingestion_script, "DB_NAME", TEST_VECTOR_DB_NAME)
+    monkeypatch.setattr(ingestion_script, "CODE_REPO_PATH", str(repo))
+    monkeypatch.setattr(ingestion_script, "EMBEDDING_CACHE_PATH", "")
+    monkeypatch.setattr(ingestion_script, "embeddings", FakeEmbeddings(latency=0))
+    try:
+        yield ingestion_script, conn, repo
+    finally:
+        conn.close()
@@ -0,0 +1,9 @@
+# palproj/ingestion/tests/test_bench_chunker.py
+from bench_chunker import legacy_chunk_openedge_code
+from openedge_chunker import chunk_openedge_code
+from synthetic_corpus import synthetic_abl_file
+
+
+def test_matches_legacy_chunker_on_well_formed_code():
+    source = synthetic_abl_file(procedures=40, seed=7)
+    assert chunk_openedge_code(source, "x.p") == legacy_chunk_openedge_code(source, "x.p")
@@ -0,0 +1,47 @@
+# palproj/ingestion/tests/test_checkpoints.py
+from checkpoints import retry_with_backoff
+
+
+class Flaky:
+    """Fails the first `failures` calls, then returns the attempt number."""
+
+    def __init__(self, failures):
+        self.failures = failures
+        self.attempts = []
+
+    def __call__(self, attempt):
+        self.attempts.append(attempt)
+        if len(self.attempts) <= self.failures:
+            raise RuntimeError(f"failure {len(self.attempts)}")
+        return attempt
+
+
+def test_retry_succeeds_after_failures_with_growing_backoff():
+    sleeps = []
+    flaky = Flaky(failures=2)
+    result, error, attempts = retry_with_backoff(flaky, max_attempts=3, backoff_base=1.0, sleep=sleeps.append)
+    assert (result, error, attempts) == (3, None, 3)
+    assert flaky.attempts == [1, 2, 3]
+    assert len(sleeps) == 2
+    assert 0.8 <= sleeps[0] <= 1.2 and 1.6 <= sleeps[1] <= 2.4
+
+
+def test_retry_gives_up_after_max_attempts():
+    sleeps = []
+    result, error, attempts = retry_with_backoff(Flaky(failures=10), max_attempts=3, sleep=sleeps.append)
+    assert result is None
+    assert str(error) == "failure 3"
+    assert attempts == 3
+    assert len(sleeps) == 2  # no sleep after the last attempt
+
+
+def test_retry_backoff_is_capped():
+    sleeps = []
+    retry_with_backoff(Flaky(failures=10), max_attempts=6, backoff_base=10.0, backoff_max=15.0, sleep=sleeps.append)
+    assert max(sleeps) <= 15.0 * 1.2
+
+
+def test_retry_first_success_does_not_sleep():
+    sleeps = []
+    assert retry_with_backoff(lambda attempt: "ok", sleep=sleeps.append) == ("ok", None, 1)
+    assert sleeps == []
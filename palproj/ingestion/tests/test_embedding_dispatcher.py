@@ -0,0 +1,91 @@
+# palproj/ingestion/tests/test_embedding_dispatcher.py
+import threading
+import time
+
+import pytest
+
+from embedding_dispatcher import EmbeddingDispatcher, RateLimiter, is_quota_error
+
+
+class FakeEmbedder:
+    """Stands in for GoogleGenerativeAIEmbeddings: fixed latency, optional throttling."""
+
+    def __init__(self, latency=0.02, fail_first=0, error="429 Resource has been exhausted (e.g. check quota)."):
+        self.latency = latency
+        self.fail_first = fail_first
+        self.error = error
+        self.calls = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self._lock = threading.Lock()
+
+    def embed_documents(self, texts):
+        with self._lock:
+            self.calls.append(list(texts))
+            if len(self.calls) <= self.fail_first:
+                raise RuntimeError(self.error)
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        time.sleep(self.latency)
+        with self._lock:
+            self.in_flight -= 1
+        return [[float(len(text))] for text in texts]
+
+
+def test_results_come_back_in_order_with_requests_in_parallel():
+    fake = FakeEmbedder(latency=0.05)
+    dispatcher = EmbeddingDispatcher(fake.embed_documents, max_in_flight=4, max_batch_size=2)
+    items = [(n, ["x" * n, "y" * n]) for n in range(1, 13)]
+
+    started = time.monotonic()
+    results = list(dispatcher.map(iter(items)))
+    elapsed = time.monotonic() - started
+
+    assert [payload for payload, _, _ in results] == list(range(1, 13))
+    assert all(vectors == [[float(n)], [float(n)]] for n, vectors, _ in results)
+    assert 1 < fake.max_in_flight <= 4
+    assert elapsed < 12 * 0.05
+    assert dispatcher.stats()['chunks_embedded'] == 24
+
+
+def test_split_respects_count_and_character_budgets():
+    dispatcher = EmbeddingDispatcher(FakeEmbedder().embed_documents, max_batch_size=3, max_batch_chars=10)
+    assert dispatcher.split(["a", "b", "c", "d"]) == [["a", "b", "c"], ["d"]]
+    assert dispatcher.split(["aaaaaa", "bbbbbb", "c"]) == [["aaaaaa"], ["bbbbbb", "c"]]
+    # A single oversized text still goes out on its own.
+    assert dispatcher.split(["x" * 50]) == [["x" * 50]]
+
+
+def test_quota_errors_are_retried_with_backoff():
+    fake = FakeEmbedder(latency=0, fail_first=2)
+    dispatcher = EmbeddingDispatcher(fake.embed_documents, max_in_flight=1, backoff_base=0.01)
+    [(payload, vectors, error)] = list(dispatcher.map([("only", ["abc"])]))
+    assert error is None
+    assert vectors == [[3.0]]
+    assert dispatcher.stats()['retries'] == 2
+
+
+def test_non_transient_errors_are_reported_per_item():
+    fake = FakeEmbedder(latency=0, fail_first=1, error="400 invalid argument")
+    dispatcher = EmbeddingDispatcher(fake.embed_documents, max_in_flight=1, backoff_base=0.01)
+    results = list(dispatcher.map([("bad", ["a"]), ("good", ["bb"])]))
+    assert results[0][0] == "bad" and isinstance(results[0][2], RuntimeError)
+    assert results[1] == ("good", [[2.0]], None)
+    assert dispatcher.stats()['retries'] == 0
+
+
+def test_rate_limiter_spaces_requests():
+    limiter = RateLimiter(requests_per_minute=1200)  # one every 50ms
+    started = time.monotonic()
+    for _ in range(4):
+        limiter.acquire()
+    assert time.monotonic() - started >= 0.14
+
+
+@pytest.mark.parametrize("message,expected", [
+    ("429 Resource has been exhausted", True),
+    ("Quota exceeded for quota metric", True),
+    ("400 Request contains an invalid argument", False),
+])
+def test_is_quota_error(message, expected):
+    assert is_quota_error(RuntimeError(message)) is expected
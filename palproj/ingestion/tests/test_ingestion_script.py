@@ -0,0 +1,340 @@
+# palproj/ingestion/tests/test_ingestion_script.py
+import os
+import struct
+
+import pytest
+
+
+def abl_program(*procedures):
+    """A .p with a definition header and one internal procedure per (name, body)."""
+    lines = ["DEFINE VARIABLE x AS INTEGER NO-UNDO.", ""]
+    for name, body in procedures:
+        lines += [f"PROCEDURE {name} :", f"  {body}", "END PROCEDURE.", ""]
+    return "\n".join(lines)
+
+
+def write(repo, relative_path, text, mtime=None):
+    path = repo / relative_path
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(text)
+    if mtime is not None:
+        os.utime(path, (mtime, mtime))
+
+
+def query(conn, sql, params=None):
+    with conn.cursor() as cur:
+        cur.execute(sql, params)
+        return cur.fetchall()
+
+
+def occurrences(conn, file_path):
+    return query(conn, """
+        SELECT o.procedure_name, e.chunk_text IS NOT NULL
+        FROM chunk_occurrences o LEFT JOIN code_embeddings e USING (chunk_hash)
+        WHERE o.file_path = %s ORDER BY o.ordinal;
+    """, (file_path,))
+
+
+def test_unchanged_files_are_skipped_and_changed_files_replaced(vector_db):
+    ingestion_script, conn, repo = vector_db
+    write(repo, "a.p", abl_program(("ip-one", "x = 1."), ("ip-two", "x = 2.")))
+    write(repo, "b.p", abl_program(("ip-three", "x = 3.")))
+    stats = ingestion_script.ingest_codebase(batch_size=2)
+    assert stats['files_processed'] == 2 and stats['files_unchanged'] == 0
+    assert occurrences(conn, "a.p") == [("FILE_HEADER", True), ("ip-one", True), ("ip-two", True)]
+
+    stats = ingestion_script.ingest_codebase(batch_size=2)
+    assert stats['files_unchanged'] == 2
+    assert stats['chunks_generated'] == 0
+    assert stats['embedding']['requests'] == 0
+
+    write(repo, "a.p", abl_program(("ip-one", "x = 1."), ("ip-four", "x = 4.")), mtime=1_000_000)
+    stats = ingestion_script.ingest_codebase(batch_size=2)
+    assert stats['files_unchanged'] == 1
+    assert stats['rows_written'] == 1  # only ip-four is new; the header and ip-one are stored already
+    assert occurrences(conn, "a.p") == [("FILE_HEADER", True), ("ip-one", True), ("ip-four", True)]
+    assert query(conn, "SELECT count(*) FROM code_embeddings WHERE chunk_text LIKE '%ip-two%';") == [(0,)]
+    assert occurrences(conn, "b.p") == [("FILE_HEADER", True), ("ip-three", True)]
+
+    (repo / "b.p").unlink()
+    stats = ingestion_script.ingest_codebase(batch_size=2)
+    assert stats['files_removed'] == 1
+    assert occurrences(conn, "b.p") == []
+    assert query(conn, "SELECT count(*) FROM code_embeddings WHERE chunk_text LIKE '%ip-three%';") == [(0,)]
+    # The header is shared with a.p, so it stays.
+    assert occurrences(conn, "a.p")[0] == ("FILE_HEADER", True)
+
+
+def test_touched_file_with_the_same_content_is_not_re_chunked(vector_db):
+    ingestion_script, conn, repo = vector_db
+    write(repo, "a.p", abl_program(("ip-one", "x = 1.")))
+    ingestion_script.ingest_codebase()
+    os.utime(repo / "a.p", (2_000_000, 2_000_000))
+    stats = ingestion_script.ingest_codebase()
+    assert stats['files_unchanged'] == 1
+    assert stats['chunks_generated'] == 0
+    assert query(conn, "SELECT file_mtime FROM ingestion_manifest WHERE file_path = 'a.p';") == [(2_000_000,)]
+
+
+def test_chunk_moving_to_a_file_in_a_later_batch_is_kept(vector_db):
+    ingestion_script, conn, repo = vector_db
+    write(repo, "a.p", abl_program(("ip-one", "x = 1."), ("ip-move", "x = 9.")))
+    write(repo, "b.p", abl_program(("ip-two", "x = 2.")))
+    ingestion_script.ingest_codebase()
+
+    # ip-move leaves a.p (whose new ip-three closes the first batch) for b.p, in the second
+    # batch; it is stored already, so that batch does not embed it again.
+    write(repo, "a.p", abl_program(("ip-one", "x = 1."), ("ip-three", "x = 3.")), mtime=1_000_000)
+    write(repo, "b.p", abl_program(("ip-two", "x = 2."), ("ip-move", "x = 9.")), mtime=1_000_000)
+    stats = ingestion_script.ingest_codebase(batch_size=1)
+    assert stats['rows_written'] == 1 and stats['chunks_deleted'] == 0
+    assert occurrences(conn, "b.p") == [("FILE_HEADER", True), ("ip-two", True), ("ip-move", True)]
+
+    write(repo, "b.p", abl_program(("ip-two", "x = 2.")), mtime=2_000_000)
+    stats = ingestion_script.ingest_codebase(batch_size=1)
+    assert stats['chunks_deleted'] == 1
+    assert query(conn, "SELECT count(*) FROM code_embeddings WHERE chunk_text LIKE '%ip-move%';") == [(0,)]
+
+
+def test_chunks_shared_with_a_dead_lettered_batch_are_still_stored(vector_db, monkeypatch):
+    ingestion_script, conn, repo = vector_db
+    write(repo, "a.p", abl_program(("ip-shared", "x = 7."), ("ip-a", "x = 1.")))
+    write(repo, "b.p", abl_program(("ip-shared", "x = 7."), ("ip-b", "x = 2.")))
+    write(repo, "c.p", abl_program(("ip-shared", "x = 7."), ("ip-c", "x = 3.")))
+    insert_batch = ingestion_script.InsertWriter.write
+
+    def failing_write(writer, batch):
+        if "a.p" in batch.replaced:
+            raise RuntimeError("disk full")
+        return insert_batch(writer, batch)
+
+    monkeypatch.setattr(ingestion_script.InsertWriter, "write", failing_write)
+    monkeypatch.setattr(ingestion_script, "INGEST_BATCH_MAX_ATTEMPTS", 1)
+    # a.p's batch plans the header and ip-shared; b.p's and c.p's batches leave them to it.
+    stats = ingestion_script.ingest_codebase(batch_size=1)
+    assert stats['batches_failed'] == 1
+    assert occurrences(conn, "a.p") == []
+    assert occurrences(conn, "b.p") == [("FILE_HEADER", True), ("ip-shared", True), ("ip-b", True)]
+    assert occurrences(conn, "c.p") == [("FILE_HEADER", True), ("ip-shared", True), ("ip-c", True)]
+
+    monkeypatch.setattr(ingestion_script.InsertWriter, "write", insert_batch)
+    stats = ingestion_script.ingest_codebase(batch_size=1)
+    assert stats['files_unchanged'] == 2 and stats['rows_written'] == 1
+    assert occurrences(conn, "a.p") == [("FILE_HEADER", True), ("ip-shared", True), ("ip-a", True)]
+
+
+def test_plan_keeps_the_chunks_it_leaves_to_batches_in_flight(ingestion_script):
+    class NothingStored:
+        def execute(self, sql, params=None):
+            pass
+
+        def fetchall(self):
+            return []
+
+    def scanned(file_path, *hashes):
+        chunks = [{"file_path": file_path, "ordinal": i, "chunk_hash": h, "chunk_text": h}
+                  for i, h in enumerate(hashes)]
+        return ingestion_script.ScannedFile(file_path, (file_path, 1, 1.0, file_path), None, chunks)
+
+    recent_hashes = ingestion_script.RecentHashes()
+    first, second = ingestion_script.plan_batches(
+        [scanned("a.p", "h1", "h2"), scanned("b.p", "h2", "h3", "h2")], NothingStored(), batch_size=2,
+        recent_hashes=recent_hashes,
+    )
+    assert [c["chunk_hash"] for c in first.chunks] == ["h1", "h2"] and first.borrowed == []
+    assert [c["chunk_hash"] for c in second.chunks] == ["h3"]
+    assert [c["chunk_hash"] for c in second.borrowed] == ["h2"]
+    assert len(second.occurrences) == 3
+
+    # Once a batch is dead-lettered, its chunks are planned again.
+    recent_hashes.discard({"h1", "h2"})
+    (third,) = ingestion_script.plan_batches([scanned("c.p", "h2")], NothingStored(), batch_size=2,
+                                             recent_hashes=recent_hashes)
+    assert [c["chunk_hash"] for c in third.chunks] == ["h2"] and third.borrowed == []
+
+
+def test_resume_embeds_nothing_the_interrupted_run_already_embedded(vector_db, monkeypatch, tmp_path):
+    ingestion_script, conn, repo = vector_db
+    for name in ("a", "b", "c"):
+        write(repo, f"{name}.p", abl_program((f"ip-{name}", f"x = '{name}'.")))
+    insert_batch = ingestion_script.InsertWriter.write
+    embedded = []
+    embed_documents = ingestion_script.embeddings.embed_documents
+
+    def recording_embed_documents(texts):
+        embedded.extend(texts)
+        return embed_documents(texts)
+
+    def dying_write(writer, batch):
+        if "b.p" in batch.replaced:
+            raise KeyboardInterrupt  # the process dies; not a batch error to retry
+        return insert_batch(writer, batch)
+
+    monkeypatch.setattr(ingestion_script, "EMBEDDING_CACHE_PATH", str(tmp_path / "cache.sqlite3"))
+    monkeypatch.setattr(ingestion_script.embeddings, "embed_documents", recording_embed_documents)
+    monkeypatch.setattr(ingestion_script.InsertWriter, "write", dying_write)
+    with pytest.raises(KeyboardInterrupt):
+        ingestion_script.ingest_codebase(batch_size=1)
+    assert any("ip-b" in text for text in embedded)
+
+    monkeypatch.setattr(ingestion_script.InsertWriter, "write", insert_batch)
+    monkeypatch.setattr(ingestion_script, "EMBEDDING_CACHE_PATH", "")
+    assert ingestion_script.ingest_codebase(resume="latest") is None  # refused without the cache
+
+    monkeypatch.setattr(ingestion_script, "EMBEDDING_CACHE_PATH", str(tmp_path / "cache.sqlite3"))
+    stats = ingestion_script.ingest_codebase(resume="latest")
+    assert stats['files_unchanged'] == 1
+    assert occurrences(conn, "b.p") == [("FILE_HEADER", True), ("ip-b", True)]
+    # b.p's chunk was embedded before the run died (and maybe c.p's); none is sent twice.
+    assert len(embedded) == len(set(embedded)) == 4
+    assert query(conn, "SELECT count(*) FROM code_embeddings;") == [(4,)]
+
+
+def test_load_manifest_is_limited_to_the_given_paths(vector_db):
+    ingestion_script, conn, repo = vector_db
+    for relative_path in ("prog/a.p", "prog/sub/b.p", "prog_x/c.p", "progax/d.p", "top.p"):
+        write(repo, relative_path, abl_program(("ip-one", "x = 1.")))
+    ingestion_script.ingest_codebase()
+    with conn.cursor() as cur:
+        assert len(ingestion_script.load_manifest(cur)) == 5
+        assert set(ingestion_script.load_manifest(cur, ["prog"])) == {"prog/a.p", "prog/sub/b.p"}
+        # '_' is matched literally, not as LIKE's single-character wildcard.
+        assert set(ingestion_script.load_manifest(cur, ["prog_x"])) == {"prog_x/c.p"}
+        assert set(ingestion_script.load_manifest(cur, ["top.p", "gone.p"])) == {"top.p"}
+
+
+def test_encode_copy_binary_layout(ingestion_script):
+    data = ingestion_script.encode_copy_binary([
+        ("café", None, [1.5, -2.0]),
+        ("", "h", []),
+    ]).getvalue()
+    expected = (
+        b"PGCOPY\n\xff\r\n\x00" + struct.pack("!ii", 0, 0)  # signature, flags, header extension
+        # Tuple 1: 3 fields; text as UTF-8 (5 bytes for "café"), NULL as length -1, and the
+        # vector in pgvector's binary form: int16 dimensions, int16 unused, float4 values.
+        + struct.pack("!h", 3)
+        + struct.pack("!i", 5) + "café".encode("utf-8")
+        + struct.pack("!i", -1)
+        + struct.pack("!i", 12) + struct.pack("!hhff", 2, 0, 1.5, -2.0)
+        # Tuple 2: an empty string is length 0, not NULL; an empty vector is just its header.
+        + struct.pack("!h", 3)
+        + struct.pack("!i", 0)
+        + struct.pack("!i", 1) + b"h"
+        + struct.pack("!i", 4) + struct.pack("!hh", 0, 0)
+        + struct.pack("!h", -1)  # trailer
+    )
+    assert data == expected
+
+
+def test_encode_copy_binary_round_trips_through_pgvector(vector_db):
+    ingestion_script, conn, _ = vector_db
+    with conn.cursor() as cur:
+        cur.execute("CREATE EXTENSION IF NOT EXISTS vector;")
+        cur.execute("CREATE TEMP TABLE copy_check (chunk_text TEXT, chunk_hash TEXT, embedding VECTOR(3));")
+        cur.copy_expert(
+            "COPY copy_check FROM STDIN WITH (FORMAT binary);",
+            ingestion_script.encode_copy_binary([("naïve ♥", None, [0.5, -1.25, 3.0])]),
+        )
+        cur.execute("SELECT chunk_text, chunk_hash, embedding::text FROM copy_check;")
+        assert cur.fetchall() == [("naïve ♥", None, "[0.5,-1.25,3]")]
+
+
+class IndexCatalogCursor:
+    """Answers ensure_vector_index's two catalog queries and records everything else."""
+
+    def __init__(self, rows=0, existing=None):
+        self.rows = rows
+        self.existing = existing  # (amname, opcname, reloptions) or None
+        self.statements = []
+        self._result = None
+
+    def execute(self, sql, params=None):
+        sql = " ".join(sql.split())
+        self.statements.append(sql)
+        if sql.startswith("SELECT COUNT(*) FROM code_embeddings"):
+            self._result = (self.rows,)
+        elif "FROM pg_class i" in sql:
+            self._result = self.existing
+
+    def fetchone(self):
+        return self._result
+
+    def built(self):
+        return [sql for sql in self.statements if sql.startswith("CREATE INDEX")]
+
+
+def configure_index(monkeypatch, ingestion_script, method, distance="cosine", lists=0, m=16, ef_construction=64):
+    monkeypatch.setattr(ingestion_script, "VECTOR_INDEX_METHOD", method)
+    monkeypatch.setattr(ingestion_script, "VECTOR_DISTANCE", distance)
+    monkeypatch.setattr(ingestion_script, "IVFFLAT_LISTS", lists)
+    monkeypatch.setattr(ingestion_script, "HNSW_M", m)
+    monkeypatch.setattr(ingestion_script, "HNSW_EF_CONSTRUCTION", ef_construction)
+
+
+def test_ivfflat_lists_follow_the_row_count(ingestion_script):
+    lists_for = ingestion_script.ivfflat_lists_for
+    assert [lists_for(rows) for rows in (0, 999, 250_000, 1_000_000)] == [1, 1, 250, 1000]
+    assert lists_for(4_000_000) == 2000  # sqrt beyond a million rows
+
+
+def test_matching_hnsw_index_is_kept_and_a_changed_one_rebuilt(ingestion_script, monkeypatch):
+    configure_index(monkeypatch, ingestion_script, "hnsw", m=16, ef_construction=64)
+    current = ("hnsw", "vector_cosine_ops", ["m=16", "ef_construction=64"])
+
+    cursor = IndexCatalogCursor(existing=current)
+    ingestion_script.ensure_vector_index(cursor)
+    assert cursor.built() == []
+
+    cursor = IndexCatalogCursor(existing=current)
+    ingestion_script.ensure_vector_index(cursor, force=True)
+    assert len(cursor.built()) == 1
+
+    for changed in (dict(m=32), dict(distance="l2")):
+        configure_index(monkeypatch, ingestion_script, "hnsw", **changed)
+        cursor = IndexCatalogCursor(existing=current)
+        ingestion_script.ensure_vector_index(cursor)
+        assert "DROP INDEX IF EXISTS code_embeddings_embedding_idx;" in cursor.statements
+        assert len(cursor.built()) == 1
+
+
+def test_new_hnsw_index_uses_the_configured_parameters(ingestion_script, monkeypatch):
+    configure_index(monkeypatch, ingestion_script, "hnsw", distance="ip", m=24, ef_construction=100)
+    cursor = IndexCatalogCursor()
+    ingestion_script.ensure_vector_index(cursor)
+    assert cursor.built() == [
+        "CREATE INDEX code_embeddings_embedding_idx ON code_embeddings "
+        "USING hnsw (embedding vector_ip_ops) WITH (m = 24, ef_construction = 100);"
+    ]
+
+
+def test_derived_ivfflat_index_is_only_rebuilt_when_lists_drift_past_2x(ingestion_script, monkeypatch):
+    configure_index(monkeypatch, ingestion_script, "ivfflat")
+    built_with_100 = ("ivfflat", "vector_cosine_ops", ["lists=100"])
+
+    for rows in (50_000, 150_000, 200_000):
+        cursor = IndexCatalogCursor(rows=rows, existing=built_with_100)
+        ingestion_script.ensure_vector_index(cursor)
+        assert cursor.built() == [], rows
+
+    cursor = IndexCatalogCursor(rows=250_000, existing=built_with_100)
+    ingestion_script.ensure_vector_index(cursor)
+    assert cursor.built()[0].endswith("USING ivfflat (embedding vector_cosine_ops) WITH (lists = 250);")
+
+    cursor = IndexCatalogCursor(rows=40_000, existing=built_with_100)
+    ingestion_script.ensure_vector_index(cursor)
+    assert cursor.built()[0].endswith("WITH (lists = 40);")
+
+
+def test_explicit_ivfflat_lists_must_match_exactly(ingestion_script, monkeypatch):
+    configure_index(monkeypatch, ingestion_script, "ivfflat", lists=120)
+    cursor = IndexCatalogCursor(existing=("ivfflat", "vector_cosine_ops", ["lists=100"]))
+    ingestion_script.ensure_vector_index(cursor)
+    assert cursor.built()[0].endswith("WITH (lists = 120);")
+    assert not any(sql.startswith("SELECT COUNT(*)") for sql in cursor.statements)
+
+
+def test_method_none_drops_the_index(ingestion_script, monkeypatch):
+    configure_index(monkeypatch, ingestion_script, "none")
+    cursor = IndexCatalogCursor(existing=("hnsw", "vector_cosine_ops", ["m=16", "ef_construction=64"]))
+    ingestion_script.ensure_vector_index(cursor)
+    assert cursor.statements == ["DROP INDEX IF EXISTS code_embeddings_embedding_idx;"]
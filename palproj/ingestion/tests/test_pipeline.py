@@ -0,0 +1,52 @@
+# palproj/ingestion/tests/test_pipeline.py
+import time
+
+import pytest
+
+from pipeline import Pipeline
+
+
+def test_stages_preserve_order():
+    pipeline = Pipeline(queue_size=2)
+    numbers = pipeline.stage("numbers", iter(range(100)))
+    doubled = pipeline.stage("double", (n * 2 for n in numbers))
+    assert list(doubled) == [n * 2 for n in range(100)]
+    pipeline.check()
+    pipeline.close()
+
+
+def test_full_queue_blocks_the_producer():
+    produced = []
+
+    def producer():
+        for n in range(50):
+            produced.append(n)
+            yield n
+
+    pipeline = Pipeline(queue_size=3)
+    items = pipeline.stage("producer", producer())
+    time.sleep(0.3)
+    # Queue capacity plus the item the producer is blocked on.
+    assert len(produced) <= 4
+    assert list(items) == list(range(50))
+    pipeline.close()
+
+
+def test_stage_error_stops_pipeline_and_is_raised():
+    def failing():
+        yield 1
+        raise ValueError("boom")
+
+    def endless():
+        while True:
+            yield 0
+
+    pipeline = Pipeline(queue_size=2)
+    items = pipeline.stage("failing", failing())
+    other = pipeline.stage("endless", endless())
+    assert list(items) == [1]
+    list(other)  # returns once the failure stops the pipeline
+    with pytest.raises(RuntimeError, match="boom"):
+        pipeline.check()
+    pipeline.close()
+    assert not any(t.is_alive() for t in pipeline.threads)
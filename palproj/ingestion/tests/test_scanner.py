@@ -0,0 +1,62 @@
+# palproj/ingestion/tests/test_scanner.py
+from concurrent.futures import ProcessPoolExecutor
+
+from synthetic_corpus import synthetic_abl_file
+from scanner import chunk_positions, iter_source_files, iter_source_paths, scan_in_order, scan_source_file
+
+
+def make_tree(root):
+    (root / "b").mkdir()
+    (root / "a").mkdir()
+    for i in range(12):
+        folder = root / ("a" if i % 2 else "b")
+        (folder / f"prog{i:02d}.p").write_text(synthetic_abl_file(procedures=5 + i, seed=i), encoding="latin-1")
+    (root / "a" / "defs.i").write_bytes(b"DEFINE VARIABLE caf\xe9 AS CHARACTER.\r\n")
+    (root / "a" / "notes.txt").write_text("not ABL")
+
+
+def test_walk_order_is_stable_and_filters_extensions(tmp_path):
+    make_tree(tmp_path)
+    paths = [relative for _, relative in iter_source_files(str(tmp_path))]
+    assert paths == sorted(paths)
+    assert "a/notes.txt" not in paths
+    assert "a/defs.i" in paths
+
+
+def test_process_pool_scan_matches_serial_scan(tmp_path):
+    make_tree(tmp_path)
+    tasks = [(relative, (path, relative, 2000)) for path, relative in iter_source_files(str(tmp_path))]
+    serial = list(scan_in_order(iter(tasks)))
+    with ProcessPoolExecutor(max_workers=3) as pool:
+        parallel = list(scan_in_order(iter(tasks), pool, window=4))
+    assert parallel == serial
+    assert all(error is None for _, (_, _, error) in serial)
+
+
+def test_chunk_positions_locate_each_chunk_in_order():
+    text = "/* head */\nPROCEDURE a:\n  x = 1.\nEND PROCEDURE.\n\nPROCEDURE a:\n  x = 1.\nEND PROCEDURE.\n"
+    chunk = "PROCEDURE a:\n  x = 1.\nEND PROCEDURE."
+    assert chunk_positions(text, ["/* head */", chunk, chunk]) == [
+        (0, 10, 1), (11, 11 + len(chunk), 2), (text.rindex("PROCEDURE a"), len(text) - 1, 6),
+    ]
+
+
+def test_scan_source_file_reports_errors_and_unchanged_content(tmp_path):
+    path = tmp_path / "x.p"
+    path.write_bytes(b"MESSAGE 'hi'.\r\n")
+    content_hash, chunks, error = scan_source_file(str(path), "x.p")
+    assert error is None
+    assert chunks[0][:2] == ("FILE_FOOTER", "MESSAGE 'hi'.")
+    assert chunks[0][3:] == (0, 13, 1, [])
+    assert scan_source_file(str(path), "x.p", previous_hash=content_hash) == (content_hash, None, None)
+
+    missing = scan_source_file(str(tmp_path / "gone.p"), "gone.p")
+    assert missing[:2] == (None, None) and missing[2].startswith("FileNotFoundError")
+
+
+def test_iter_source_paths_expands_directories_and_skips_missing_paths(tmp_path):
+    make_tree(tmp_path)
+    found = [relative for _, relative in iter_source_paths(str(tmp_path), ["a", "b/prog00.p", "gone.p", "a/defs.i"])]
+    assert found == sorted(found)
+    assert "b/prog00.p" in found and "a/defs.i" in found and "gone.p" not in found
+    assert len(found) == len(set(found)) == 8
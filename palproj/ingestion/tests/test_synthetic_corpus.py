@@ -0,0 +1,25 @@
+# palproj/ingestion/tests/test_synthetic_corpus.py
+from scanner import iter_source_files, scan_source_file
+from synthetic_corpus import generate_corpus
+
+
+def read_tree(root):
+    return {relative: open(path, 'rb').read() for path, relative in iter_source_files(str(root))}
+
+
+def test_corpus_is_deterministic_and_has_every_file_kind(tmp_path):
+    totals = generate_corpus(str(tmp_path / "a"), programs=12, includes=4, windows=2, window_procedures=10)
+    generate_corpus(str(tmp_path / "b"), programs=12, includes=4, windows=2, window_procedures=10)
+    tree = read_tree(tmp_path / "a")
+    assert tree == read_tree(tmp_path / "b")
+    assert totals == {'files': 18, 'bytes': sum(len(data) for data in tree.values())}
+    assert {relative.rsplit('.', 1)[1] for relative in tree} == {'i', 'p', 'w'}
+
+
+def test_corpus_files_chunk_into_procedures(tmp_path):
+    generate_corpus(str(tmp_path), programs=5, includes=2, windows=1, window_procedures=10)
+    for path, relative in iter_source_files(str(tmp_path)):
+        _, chunks, error = scan_source_file(path, relative)
+        assert error is None
+        if relative.endswith(('.p', '.w')):
+            assert any(chunk[0].startswith("ip-") for chunk in chunks)
@@ -0,0 +1,79 @@
+# palproj/ingestion/tests/test_watcher.py
+import os
+
+import pytest
+
+from watcher import Debouncer, InotifyWatcher, PollingWatcher, watch
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_debouncer_waits_for_quiet_but_not_past_max_wait():
+    clock = FakeClock()
+    debouncer = Debouncer(quiet=2.0, max_wait=5.0, clock=clock)
+    assert debouncer.timeout() is None
+    debouncer.add({"a.p"})
+    clock.now += 1.5
+    debouncer.add({"b.p"})
+    assert debouncer.take() == (None, None)
+    assert debouncer.timeout() == 2.0
+    clock.now += 1.9
+    debouncer.add({"c.p"})
+    clock.now += 1.7
+    # Events kept coming, but the burst started 5.1s ago.
+    assert debouncer.take() == ({"a.p", "b.p", "c.p"}, 100.0)
+    assert debouncer.timeout() is None
+
+
+def test_polling_watcher_reports_created_modified_and_deleted_files(tmp_path):
+    (tmp_path / "src").mkdir()
+    (tmp_path / "src" / "a.p").write_text("RUN b.p.")
+    (tmp_path / "src" / "b.p").write_text("MESSAGE 1.")
+    watcher = PollingWatcher(str(tmp_path), interval=0)
+    (tmp_path / "src" / "a.p").write_text("RUN c.p. /* longer */")
+    (tmp_path / "src" / "b.p").unlink()
+    (tmp_path / "src" / "c.i").write_text("DEFINE VARIABLE x AS INTEGER.")
+    (tmp_path / "src" / "notes.txt").write_text("ignored")
+    assert watcher.poll(1.0) == {os.path.join("src", name) for name in ("a.p", "b.p", "c.i")}
+    assert watcher.poll(1.0) == set()
+
+
+def test_inotify_watcher_reports_files_and_new_directories(tmp_path):
+    try:
+        watcher = InotifyWatcher(str(tmp_path))
+    except OSError as e:
+        pytest.skip(f"inotify unavailable: {e}")
+    try:
+        (tmp_path / "a.p").write_text("RUN b.p.")
+        (tmp_path / "notes.txt").write_text("ignored")
+        (tmp_path / "new").mkdir()
+        assert watcher.poll(1.0) == {"a.p", "new"}
+        # The new directory is watched too.
+        (tmp_path / "new" / "b.w").write_text("MESSAGE 1.")
+        os.rename(tmp_path / "a.p", tmp_path / "new" / "a.p")
+        assert watcher.poll(1.0) == {"a.p", os.path.join("new", "b.w"), os.path.join("new", "a.p")}
+    finally:
+        watcher.close()
+
+
+def test_watch_hands_debounced_batches_to_the_callback():
+    clock = FakeClock()
+    # Polls 3s apart: a.p and b.p form one burst, c.p's burst is superseded by the overflow.
+    events = [{"a.p"}, {"b.p"}, set(), {"c.p"}, None, set()]
+    batches, overflows = [], []
+
+    class ScriptedWatcher:
+        def poll(self, timeout):
+            clock.now += 3.0
+            return events.pop(0)
+
+    watch(ScriptedWatcher(), lambda paths, first: batches.append(sorted(paths)), lambda: overflows.append(1),
+          Debouncer(quiet=2.0, max_wait=30.0, clock=clock), should_stop=lambda: not events)
+    assert batches == [["a.p", "b.p"]]
+    assert overflows == [1]
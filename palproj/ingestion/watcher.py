@@ -0,0 +1,252 @@
+import ctypes
+import ctypes.util
+import errno
+import logging
+import os
+import select
+import struct
+import time
+
+from scanner import is_source_file
+
+logger = logging.getLogger(__name__)
+
+# inotify(7) event bits.
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+
+WATCH_MASK = (IN_CLOSE_WRITE | IN_ATTRIB | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+              | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR)
+_EVENT = struct.Struct('iIII')
+
+class InotifyWatcher:
+    """Reports changed source files under `root` through Linux inotify, via ctypes.
+
+    Every directory gets a watch; directories created later are watched as they appear.
+    poll() returns the relative paths touched since the last call: source files, and
+    directories that appeared or disappeared (the caller expands or removes everything
+    under them). It returns None when the kernel queue overflowed and events were lost,
+    in which case the caller should fall back to a full incremental scan.
+
+    Raises OSError when inotify is unavailable or the watch limit
+    (fs.inotify.max_user_watches) is too low for the tree.
+    """
+
+    def __init__(self, root):
+        self.root = os.path.abspath(root)
+        libc_name = ctypes.util.find_library('c') or 'libc.so.6'
+        self._libc = ctypes.CDLL(libc_name, use_errno=True)
+        if not hasattr(self._libc, 'inotify_init1'):
+            raise OSError(errno.ENOSYS, "inotify is not available")
+        self._fd = self._libc.inotify_init1(os.O_CLOEXEC | os.O_NONBLOCK)
+        if self._fd < 0:
+            raise self._error("inotify_init1")
+        self._paths = {}  # watch descriptor -> relative directory path
+        self._wds = {}  # relative directory path -> watch descriptor
+        try:
+            self._watch_tree('')
+        except OSError:
+            self.close()
+            raise
+        logger.info(f"Watching {len(self._wds)} directories under {self.root} with inotify.")
+
+    def _error(self, call):
+        code = ctypes.get_errno()
+        return OSError(code, f"{call}: {os.strerror(code)}")
+
+    def _add_watch(self, relative_dir):
+        path = os.path.join(self.root, relative_dir)
+        wd = self._libc.inotify_add_watch(self._fd, os.fsencode(path), WATCH_MASK)
+        if wd < 0:
+            error = self._error("inotify_add_watch")
+            if error.errno in (errno.ENOENT, errno.ENOTDIR):
+                return False
+            raise error
+        self._paths[wd] = relative_dir
+        self._wds[relative_dir] = wd
+        return True
+
+    def _watch_tree(self, relative_dir):
+        if not self._add_watch(relative_dir):
+            return
+        for root, dirs, _ in os.walk(os.path.join(self.root, relative_dir)):
+            dirs.sort()
+            for name in dirs:
+                self._add_watch(os.path.relpath(os.path.join(root, name), self.root))
+
+    def _forget_tree(self, relative_dir):
+        prefix = relative_dir + os.sep
+        for path in [p for p in self._wds if p == relative_dir or p.startswith(prefix)]:
+            wd = self._wds.pop(path)
+            self._paths.pop(wd, None)
+            self._libc.inotify_rm_watch(self._fd, wd)
+
+    def poll(self, timeout):
+        """Waits up to `timeout` seconds for events; returns the touched relative paths."""
+        readable, _, _ = select.select([self._fd], [], [], timeout)
+        if not readable:
+            return set()
+        touched = set()
+        overflowed = False
+        while True:
+            try:
+                data = os.read(self._fd, 64 * 1024)
+            except BlockingIOError:
+                break
+            offset = 0
+            while offset < len(data):
+                wd, mask, _, length = _EVENT.unpack_from(data, offset)
+                name = os.fsdecode(data[offset + _EVENT.size:offset + _EVENT.size + length].rstrip(b'\0'))
+                offset += _EVENT.size + length
+                if mask & IN_Q_OVERFLOW:
+                    overflowed = True
+                    continue
+                if mask & IN_IGNORED:
+                    path = self._paths.pop(wd, None)
+                    if path is not None and self._wds.get(path) == wd:
+                        del self._wds[path]
+                    continue
+                directory = self._paths.get(wd)
+                if directory is None or not name:
+                    continue
+                relative_path = os.path.normpath(os.path.join(directory, name))
+                if mask & IN_ISDIR:
+                    if mask & (IN_CREATE | IN_MOVED_TO):
+                        try:
+                            self._watch_tree(relative_path)
+                        except OSError as e:
+                            logger.warning(f"Could not watch new directory {relative_path}: {e}")
+                    elif mask & (IN_DELETE | IN_MOVED_FROM):
+                        self._forget_tree(relative_path)
+                    touched.add(relative_path)
+                elif is_source_file(name):
+                    touched.add(relative_path)
+        return None if overflowed else touched
+
+    def close(self):
+        if self._fd >= 0:
+            os.close(self._fd)
+            self._fd = -1
+
+class PollingWatcher:
+    """Reports changed source files under `root` by comparing stat() snapshots.
+
+    The fallback where inotify is unavailable (non-Linux hosts, some network mounts). Each
+    poll walks the tree but only stats files; nothing is read unless it changed.
+    """
+
+    def __init__(self, root, interval=10.0):
+        self.root = os.path.abspath(root)
+        self.interval = interval
+        self._snapshot = self._scan()
+        self._next_scan = time.monotonic() + interval
+        logger.info(f"Polling {len(self._snapshot)} source files under {self.root} every {interval}s.")
+
+    def _scan(self):
+        snapshot = {}
+        for root, dirs, files in os.walk(self.root):
+            for name in files:
+                if is_source_file(name):
+                    path = os.path.join(root, name)
+                    try:
+                        stat = os.stat(path)
+                    except OSError:
+                        continue
+                    snapshot[os.path.relpath(path, self.root)] = (stat.st_size, stat.st_mtime_ns)
+        return snapshot
+
+    def poll(self, timeout):
+        """Sleeps until the next scan is due (at most `timeout` seconds); returns the changed paths."""
+        wait = self._next_scan - time.monotonic()
+        if wait > timeout:
+            time.sleep(timeout)
+            return set()
+        if wait > 0:
+            time.sleep(wait)
+        self._next_scan = time.monotonic() + self.interval
+        snapshot = self._scan()
+        previous, self._snapshot = self._snapshot, snapshot
+        return {path for path in previous.keys() | snapshot.keys() if previous.get(path) != snapshot.get(path)}
+
+    def close(self):
+        pass
+
+def open_watcher(root, mode='auto', poll_interval=10.0):
+    """Returns an InotifyWatcher, or a PollingWatcher if mode is 'poll' or inotify fails under 'auto'."""
+    if mode in ('auto', 'inotify'):
+        try:
+            return InotifyWatcher(root)
+        except (OSError, AttributeError) as e:
+            if mode == 'inotify':
+                raise
+            logger.warning(f"inotify unavailable ({e}); falling back to polling.")
+    return PollingWatcher(root, poll_interval)
+
+class Debouncer:
+    """Coalesces bursts of file events into one batch of paths.
+
+    A batch is released once no new path has arrived for `quiet` seconds, or `max_wait`
+    seconds after its first event even if events keep coming, so a long checkout is
+    ingested in slices instead of waiting for it to finish.
+    """
+
+    def __init__(self, quiet=2.0, max_wait=30.0, clock=time.monotonic):
+        self.quiet = quiet
+        self.max_wait = max_wait
+        self.clock = clock
+        self.paths = set()
+        self.first_event = None
+        self.last_event = None
+
+    def add(self, paths):
+        if not paths:
+            return
+        now = self.clock()
+        if not self.paths:
+            self.first_event = now
+        self.paths |= set(paths)
+        self.last_event = now
+
+    def timeout(self):
+        """Seconds until the pending batch is due (None when nothing is pending)."""
+        if not self.paths:
+            return None
+        now = self.clock()
+        return max(0.0, min(self.last_event + self.quiet, self.first_event + self.max_wait) - now)
+
+    def clear(self):
+        self.paths, self.first_event, self.last_event = set(), None, None
+
+    def take(self):
+        """Returns (paths, first_event) if a batch is due, else (None, None)."""
+        if not self.paths or self.timeout() > 0:
+            return None, None
+        paths, first_event = self.paths, self.first_event
+        self.clear()
+        return paths, first_event
+
+def watch(watcher, on_change, on_overflow, debouncer, idle_timeout=1.0, should_stop=lambda: False):
+    """Feeds watcher events through the debouncer and calls on_change(paths, first_event)
+    for each batch, or on_overflow() when events were lost. Runs until should_stop()."""
+    while not should_stop():
+        pending = debouncer.timeout()
+        touched = watcher.poll(idle_timeout if pending is None else min(pending, idle_timeout))
+        if touched is None:
+            logger.warning("File event queue overflowed; running a full incremental scan.")
+            debouncer.clear()
+            on_overflow()
+            continue
+        debouncer.add(touched)
+        paths, first_event = debouncer.take()
+        if paths:
+            on_change(paths, first_event)
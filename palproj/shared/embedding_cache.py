@@ -0,0 +1,187 @@
+# shared/embedding_cache.py - used by both app and ingestion.
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+from array import array
+
+logger = logging.getLogger(__name__)
+
+def text_hash(text):
+    """SHA-256 of the UTF-8 text; identical to the chunk_hash stored in code_embeddings."""
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+class EmbeddingCache:
+    """A local, content-addressed embedding store keyed by (model, chunk_hash).
+
+    Vectors are stored as float32 blobs in a SQLite file, so they survive table rebuilds,
+    database switches and branch checkouts, and can be shared by every process that mounts
+    the same file (WAL mode lets the app read while ingestion writes). Once the stored
+    vectors exceed `max_bytes`, the least recently used entries are evicted.
+
+    Hits only refresh an entry's last_used once it is more than `touch_interval` seconds
+    old, and those refreshes are written together (every `touch_batch` of them, every
+    `touch_interval` seconds, before evicting and on close), so reads stay reads.
+    """
+
+    def __init__(self, path, max_bytes=2 * 1024 ** 3, touch_interval=60.0, touch_batch=256):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self.max_bytes = max_bytes
+        self.touch_interval = touch_interval
+        self.touch_batch = touch_batch
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL;")
+        self._conn.execute("PRAGMA synchronous=NORMAL;")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS embeddings (
+                model TEXT NOT NULL,
+                chunk_hash TEXT NOT NULL,
+                vector BLOB NOT NULL,
+                last_used REAL NOT NULL,
+                PRIMARY KEY (model, chunk_hash)
+            );
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS embeddings_last_used_idx ON embeddings (last_used);")
+        self._total_bytes = self._stored_bytes()
+        self._touched = {}  # (model, chunk_hash) -> last use not yet written
+        self._touches_flushed_at = time.monotonic()
+
+    def _stored_bytes(self):
+        return self._conn.execute("SELECT COALESCE(SUM(LENGTH(vector)), 0) FROM embeddings;").fetchone()[0]
+
+    def get_many(self, model, chunk_hashes):
+        """Returns {chunk_hash: vector} for the hashes present in the cache."""
+        chunk_hashes = list(dict.fromkeys(chunk_hashes))
+        found = {}
+        now = time.time()
+        with self._lock:
+            # Stay well under SQLite's bound-parameter limit.
+            for i in range(0, len(chunk_hashes), 500):
+                part = chunk_hashes[i:i + 500]
+                rows = self._conn.execute(
+                    f"SELECT chunk_hash, vector, last_used FROM embeddings WHERE model = ? AND chunk_hash IN ({','.join('?' * len(part))});",
+                    [model, *part]
+                ).fetchall()
+                for chunk_hash, blob, last_used in rows:
+                    found[chunk_hash] = array('f', blob).tolist()
+                    if last_used < now - self.touch_interval:
+                        self._touched[(model, chunk_hash)] = now
+            if self._touched and (len(self._touched) >= self.touch_batch
+                                  or time.monotonic() - self._touches_flushed_at >= self.touch_interval):
+                self._flush_touches()
+            self.hits += len(found)
+            self.misses += len(chunk_hashes) - len(found)
+        return found
+
+    def put_many(self, model, items):
+        """Stores (chunk_hash, vector) pairs, evicting old entries if the cache is over size."""
+        now = time.time()
+        blobs = {chunk_hash: array('f', vector).tobytes() for chunk_hash, vector in items}
+        if not blobs:
+            return
+        hashes = list(blobs)
+        with self._lock:
+            self._conn.execute("BEGIN;")
+            # Rows being replaced give their bytes back.
+            replaced_bytes = 0
+            for i in range(0, len(hashes), 500):
+                part = hashes[i:i + 500]
+                replaced_bytes += self._conn.execute(
+                    f"SELECT COALESCE(SUM(LENGTH(vector)), 0) FROM embeddings WHERE model = ? AND chunk_hash IN ({','.join('?' * len(part))});",
+                    [model, *part]
+                ).fetchone()[0]
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (model, chunk_hash, vector, last_used) VALUES (?, ?, ?, ?);",
+                [(model, chunk_hash, blob, now) for chunk_hash, blob in blobs.items()]
+            )
+            self._conn.execute("COMMIT;")
+            self._total_bytes += sum(len(blob) for blob in blobs.values()) - replaced_bytes
+            if self._total_bytes > self.max_bytes:
+                self._evict()
+
+    def _flush_touches(self):
+        if self._touched:
+            self._conn.execute("BEGIN;")
+            self._conn.executemany(
+                "UPDATE embeddings SET last_used = MAX(last_used, ?) WHERE model = ? AND chunk_hash = ?;",
+                [(used, model, chunk_hash) for (model, chunk_hash), used in self._touched.items()]
+            )
+            self._conn.execute("COMMIT;")
+            self._touched = {}
+        self._touches_flushed_at = time.monotonic()
+
+    def _evict(self):
+        self._flush_touches()
+        # Other processes may share the file, so recount before deciding how much to drop.
+        self._total_bytes = self._stored_bytes()
+        target = int(self.max_bytes * 0.9)
+        if self._total_bytes <= target:
+            return
+        count, = self._conn.execute("SELECT COUNT(*) FROM embeddings;").fetchone()
+        average = self._total_bytes / max(count, 1)
+        to_delete = int((self._total_bytes - target) / average) + 1
+        self._conn.execute(
+            "DELETE FROM embeddings WHERE rowid IN (SELECT rowid FROM embeddings ORDER BY last_used LIMIT ?);",
+            (to_delete,)
+        )
+        self._total_bytes = self._stored_bytes()
+        logger.info(f"Evicted {to_delete} entries from embedding cache {self.path}.")
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'bytes': self._total_bytes}
+
+    def close(self):
+        with self._lock:
+            self._flush_touches()
+            self._conn.close()
+
+class CachedEmbeddings:
+    """Wraps a LangChain embeddings object so texts already embedded are served from the cache.
+
+    Query embeddings are cached under a separate key because the API embeds queries and
+    documents with different task types.
+    """
+
+    def __init__(self, embeddings, cache, model):
+        self.embeddings = embeddings
+        self.cache = cache
+        self.model = model
+
+    def embed_documents(self, texts):
+        hashes = [text_hash(text) for text in texts]
+        found = self.cache.get_many(self.model, hashes)
+        missing = {h: text for h, text in zip(hashes, texts) if h not in found}
+        if missing:
+            vectors = self.embeddings.embed_documents(list(missing.values()))
+            fresh = list(zip(missing.keys(), vectors))
+            self.cache.put_many(self.model, fresh)
+            found.update(fresh)
+        return [found[h] for h in hashes]
+
+    def embed_query(self, text):
+        model = f"{self.model}:query"
+        h = text_hash(text)
+        found = self.cache.get_many(model, [h])
+        if h in found:
+            return found[h]
+        vector = self.embeddings.embed_query(text)
+        self.cache.put_many(model, [(h, vector)])
+        return vector
+
+def open_embedding_cache(path, max_mb):
+    """Opens the cache at `path`, or returns None if caching is disabled or the file is unusable."""
+    if not path:
+        return None
+    try:
+        return EmbeddingCache(path, max_bytes=max_mb * 1024 * 1024)
+    except (sqlite3.Error, OSError) as e:
+        logger.error(f"Could not open embedding cache at {path}, continuing without it: {e}")
+        return None
@@ -0,0 +1,51 @@
+# shared/fake_embeddings.py - used by both app and ingestion.
+import hashlib
+import math
+import re
+import struct
+import threading
+import time
+
+_TOKEN_RE = re.compile(r'[\w-]+')
+
+class FakeEmbeddings:
+    """A stand-in for GoogleGenerativeAIEmbeddings with configurable latency and no network access.
+
+    Vectors are deterministic: each word of the text is hashed into a few of `dimensions`
+    buckets and the result is normalised, so the same text always gets the same vector (in
+    the app and in ingestion) and texts sharing words are closer than unrelated ones.
+    embed_documents() sleeps `latency` seconds per call, embed_query() too. Set
+    EMBED_FAKE_LATENCY_SEC to run the app or ingestion against it.
+    """
+
+    def __init__(self, latency=0.0, dimensions=768):
+        self.latency = latency
+        self.dimensions = dimensions
+        self.calls = 0
+        self.texts = 0
+        self._lock = threading.Lock()
+
+    def vector(self, text):
+        values = [0.0] * self.dimensions
+        for token in _TOKEN_RE.findall(text.lower()):
+            digest = hashlib.blake2b(token.encode('utf-8'), digest_size=12).digest()
+            for offset in (0, 4, 8):
+                (bucket,) = struct.unpack_from('<I', digest, offset)
+                values[bucket % self.dimensions] += 1.0 if bucket & 1 else -1.0
+        norm = math.sqrt(sum(v * v for v in values)) or 1.0
+        return [v / norm for v in values]
+
+    def _record(self, count):
+        with self._lock:
+            self.calls += 1
+            self.texts += count
+        if self.latency:
+            time.sleep(self.latency)
+
+    def embed_documents(self, texts):
+        self._record(len(texts))
+        return [self.vector(text) for text in texts]
+
+    def embed_query(self, text):
+        self._record(1)
+        return self.vector(text)
@@ -0,0 +1,271 @@
+# shared/openedge_chunker.py - used by both app and ingestion.
+import re
+
+# Scanning runs over an ASCII-uppercased copy of the file (same length, same offsets), so
+# every pattern can be case-sensitive. _TOKEN_RE deliberately has no groups and every
+# alternative starts with a literal character: that lets the regex engine skip ahead with
+# its first-character prefilter, and strings, complete comments, // comments and
+# preprocessor lines are consumed without the Python loop seeing what is inside them.
+# The string and comment patterns are "unrolled" so they can only backtrack linearly.
+_TOKEN_RE = re.compile(
+    r'"[^"~]*(?:~.[^"~]*)*"?'
+    r"|'[^'~]*(?:~.[^'~]*)*'?"
+    r'|/\*[^*/]*(?:(?:\*(?!/)|/(?!\*))[^*/]*)*\*/'
+    r'|/\*'
+    r'|//[^\n]*'
+    r'|\n[ \t]*&[^\n]*'
+    r'|PROCEDURE|FUNCTION'
+    r'|END[ \t\r\n]+(?:PROCEDURE|FUNCTION)',
+    re.DOTALL
+)
+_PREPROCESSOR_AT_START_RE = re.compile(r'[ \t]*&[^\n]*')
+_COMMENT_RE = re.compile(r'/\*|\*/')
+_STRING_RES = {
+    '"': re.compile(r'~.|"', re.DOTALL),
+    "'": re.compile(r"~.|'", re.DOTALL),
+}
+_SPACE_RE = re.compile(r'\s*')
+_NAME_RE = re.compile(r'[\w\-.]*[\w\-]')
+_HEADER_STOP_RE = re.compile(r'/\*|"|\'|[.:](?=\s|$)')
+_ACCESS_MODIFIERS = {'PRIVATE', 'PUBLIC', 'INTERNAL'}
+_ASCII_UPPER = {c: c - 32 for c in range(ord('a'), ord('z') + 1)}
+_WORD_CHARS = frozenset('ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789_-&')
+
+# References a chunk makes, matched on the uppercased copy with comments and strings blanked.
+_SKIP_RE = re.compile(r'"|\'|/\*')
+_RUN_RE = re.compile(r'(?<![\w-])RUN\s+([\w\-./\\]*[\w\-])')
+_INCLUDE_RE = re.compile(r'\{\s*([\w\-./\\]*\.[\w]+)(?=[\s}])')
+_TABLE_RE = re.compile(
+    r'(?:(?:(?<![\w-])FOR\s+|,\s*)(?:EACH|FIRST|LAST)\s+'
+    r'|(?<![\w-])FIND(?:\s+(?:FIRST|LAST|NEXT|PREV|CURRENT))?\s+'
+    r'|(?<![\w-])CAN-FIND\s*\(\s*(?:(?:FIRST|LAST)\s+)?'
+    r'|(?<![\w-])BUFFER\s+[\w\-]+\s+FOR\s+)'
+    r'([A-Z][\w\-]*(?:\.[A-Z][\w\-]*)?)'
+)
+_TEMP_TABLE_RE = re.compile(r'(?<![\w-])TEMP-TABLE\s+([A-Z][\w\-]*)')
+_NOT_RUN_TARGETS = {'VALUE', 'SUPER'}
+_NOT_TABLES = {'FIRST', 'LAST', 'NEXT', 'PREV', 'CURRENT', 'EACH', 'TEMP-TABLE'}
+
+def _skip_comment(text, pos):
+    """Returns the position just after the comment opened before `pos`. ABL comments nest."""
+    depth = 1
+    while depth:
+        match = _COMMENT_RE.search(text, pos)
+        if not match:
+            return len(text)
+        depth += 1 if match.group() == '/*' else -1
+        pos = match.end()
+    return pos
+
+def _skip_string(text, pos, quote):
+    """Returns the position just after the string opened before `pos`; ~ escapes a character."""
+    string_re = _STRING_RES[quote]
+    while True:
+        match = string_re.search(text, pos)
+        if not match:
+            return len(text)
+        pos = match.end()
+        if match.group() == quote:
+            return pos
+
+def _skip_space_and_comments(text, pos):
+    while True:
+        pos = _SPACE_RE.match(text, pos).end()
+        if text.startswith('/*', pos):
+            pos = _skip_comment(text, pos + 2)
+        else:
+            return pos
+
+def _standalone(text, start, end):
+    """True if text[start:end] is a whole ABL word, i.e. not part of THIS-PROCEDURE etc."""
+    return ((start == 0 or text[start - 1] not in _WORD_CHARS)
+            and (end == len(text) or text[end] not in _WORD_CHARS))
+
+def _parse_block_header(text, pos):
+    """Parses what follows a PROCEDURE/FUNCTION keyword.
+
+    Returns (name_start, name_end, header_end) when the statement opens a block, i.e. ends
+    in ':'. Forward declarations, prototypes and IN SUPER functions end in '.' and return None.
+    """
+    pos = _skip_space_and_comments(text, pos)
+    match = _NAME_RE.match(text, pos)
+    if not match:
+        return None
+    if match.group() in _ACCESS_MODIFIERS:
+        following = _NAME_RE.match(text, _skip_space_and_comments(text, match.end()))
+        if following:
+            match = following
+    pos = match.end()
+    while True:
+        stop = _HEADER_STOP_RE.search(text, pos)
+        if not stop:
+            return None
+        token = stop.group()
+        if token == '/*':
+            pos = _skip_comment(text, stop.end())
+        elif token in _STRING_RES:
+            pos = _skip_string(text, stop.end(), token)
+        elif token == ':':
+            return match.start(), match.end(), stop.end()
+        else:
+            return None
+
+def _block_end(text, pos):
+    """Returns where a block ends, given the position just after its END PROCEDURE/FUNCTION."""
+    after = _SPACE_RE.match(text, pos).end()
+    if after < len(text) and text[after] in '.,':
+        return after + 1
+    return pos
+
+def _code_only(text):
+    """`text` with comments and string literals replaced by spaces, offsets unchanged."""
+    parts = []
+    pos = 0
+    while True:
+        match = _SKIP_RE.search(text, pos)
+        if not match:
+            parts.append(text[pos:])
+            return ''.join(parts)
+        parts.append(text[pos:match.start()])
+        token = match.group()
+        end = _skip_comment(text, match.end()) if token == '/*' else _skip_string(text, match.end(), token)
+        parts.append(' ' * (end - match.start()))
+        pos = end
+
+def _normalise_target(name):
+    name = name.lower().replace('\\', '/')
+    return name[2:] if name.startswith('./') else name
+
+def extract_references(chunk_text):
+    """Returns the (kind, target) references a chunk makes, in order of first appearance.
+
+    kind is 'run' (an internal procedure), 'program' (a RUN of a .p/.w file), 'include'
+    (a {file.i} reference) or 'table' (a FOR EACH / FIND / CAN-FIND / DEFINE BUFFER FOR
+    target that is not a TEMP-TABLE defined in the same chunk). Targets are lowercased and
+    paths use '/'. RUN VALUE(...) and preprocessor references cannot be resolved statically
+    and are skipped.
+    """
+    code = _code_only(chunk_text.translate(_ASCII_UPPER))
+    found = []
+    for match in _RUN_RE.finditer(code):
+        if match.group(1) in _NOT_RUN_TARGETS:
+            continue
+        target = _normalise_target(chunk_text[match.start(1):match.end(1)])
+        found.append((match.start(), 'program' if '.' in target.rsplit('/', 1)[-1] else 'run', target))
+    for match in _INCLUDE_RE.finditer(code):
+        found.append((match.start(), 'include', _normalise_target(chunk_text[match.start(1):match.end(1)])))
+    temp_tables = {match.group(1) for match in _TEMP_TABLE_RE.finditer(code)}
+    for match in _TABLE_RE.finditer(code):
+        if match.group(1) in _NOT_TABLES or match.group(1) in temp_tables:
+            continue
+        found.append((match.start(), 'table', chunk_text[match.start(1):match.end(1)].lower()))
+    references = []
+    for _, kind, target in sorted(found):
+        if (kind, target) not in references:
+            references.append((kind, target))
+    return references
+
+def split_oversized(text, max_chars):
+    """Splits text into pieces of at most max_chars, breaking at line boundaries where possible."""
+    if not max_chars or len(text) <= max_chars:
+        return [text]
+    pieces = []
+    current = []
+    current_len = 0
+    for line in text.splitlines(keepends=True):
+        while len(line) > max_chars:
+            if current:
+                pieces.append(''.join(current))
+                current, current_len = [], 0
+            pieces.append(line[:max_chars])
+            line = line[max_chars:]
+        if current_len + len(line) > max_chars:
+            pieces.append(''.join(current))
+            current, current_len = [], 0
+        current.append(line)
+        current_len += len(line)
+    if current:
+        pieces.append(''.join(current))
+    return [piece.strip() for piece in pieces if piece.strip()]
+
+def chunk_openedge_code(file_content, file_path, max_chunk_chars=None, references=False):
+    """Splits OpenEdge ABL code into meaningful chunks.
+
+    A single linear pass over the file: comments (nested) and strings are skipped, so an
+    END PROCEDURE inside either does not end a chunk. Each PROCEDURE/FUNCTION block becomes
+    one chunk named after it, and the code around them becomes FILE_HEADER,
+    INTER_PROCEDURE_CODE and FILE_FOOTER chunks. A block with no END PROCEDURE/END FUNCTION
+    ends where the next block starts. Chunks longer than max_chunk_chars are split at line
+    boundaries into several chunks with the same procedure_name. With references=True each
+    chunk also carries the procedures, programs, includes and tables it references (see
+    extract_references).
+    """
+    chunks = []
+
+    def emit(procedure_name, start, end):
+        chunk_text = file_content[start:end].strip()
+        if chunk_text:
+            for piece in split_oversized(chunk_text, max_chunk_chars):
+                chunk = {
+                    "file_path": file_path,
+                    "procedure_name": procedure_name,
+                    "chunk_text": piece
+                }
+                if references:
+                    chunk["references"] = extract_references(piece)
+                chunks.append(chunk)
+
+    text = file_content.translate(_ASCII_UPPER)
+    last_end = 0
+    current_name = None
+    current_start = 0
+    start_line = _PREPROCESSOR_AT_START_RE.match(text)
+    pos = start_line.end() if start_line else 0
+    while pos is not None:
+        resume_at = None
+        for match in _TOKEN_RE.finditer(text, pos):
+            first = text[match.start()]
+            if first in '"\'\n':
+                continue
+            if first == '/':
+                if match.end() - match.start() == 2 and text[match.start() + 1] == '*':
+                    # A comment with another comment nested inside it.
+                    resume_at = _skip_comment(text, match.end())
+                    break
+                if text[match.start() + 1] == '/' and match.start() > 0 and not text[match.start() - 1].isspace():
+                    # Not a comment after all (e.g. inside a path); rescan the rest of the line.
+                    resume_at = match.start() + 2
+                    break
+                continue
+            if not _standalone(text, match.start(), match.end()):
+                continue
+
+            if first == 'E':
+                if current_name is not None:
+                    block_end = _block_end(text, match.end())
+                    emit(current_name, current_start, block_end)
+                    last_end = resume_at = block_end
+                    current_name = None
+                    break
+                continue
+
+            header = _parse_block_header(text, match.end())
+            if header is None:
+                continue
+            if current_name is not None:
+                # Procedures cannot nest, so the previous one was closed by a bare END.
+                emit(current_name, current_start, match.start())
+                last_end = match.start()
+            else:
+                emit("FILE_HEADER" if last_end == 0 else "INTER_PROCEDURE_CODE", last_end, match.start())
+            current_start = match.start()
+            current_name = file_content[header[0]:header[1]]
+            resume_at = header[2]
+            break
+        pos = resume_at
+
+    if current_name is not None:
+        emit(current_name, current_start, len(file_content))
+    else:
+        emit("FILE_FOOTER", last_end, len(file_content))
+    return chunks
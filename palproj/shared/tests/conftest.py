@@ -0,0 +1,6 @@
+# palproj/shared/tests/conftest.py
+import os
+import sys
+
+# Make the shared modules importable when pytest is run from any directory.
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
@@ -0,0 +1,107 @@
+# palproj/shared/tests/test_embedding_cache.py
+import hashlib
+import time
+
+from embedding_cache import CachedEmbeddings, EmbeddingCache, text_hash
+
+
+class CountingEmbeddings:
+    def __init__(self):
+        self.document_calls = []
+        self.query_calls = []
+
+    def embed_documents(self, texts):
+        self.document_calls.append(list(texts))
+        return [[float(len(text)), 0.5] for text in texts]
+
+    def embed_query(self, text):
+        self.query_calls.append(text)
+        return [float(len(text)), -0.5]
+
+
+def test_round_trip_is_keyed_by_model_and_survives_reopen(tmp_path):
+    path = str(tmp_path / "cache.sqlite3")
+    cache = EmbeddingCache(path)
+    cache.put_many("model-a", [("h1", [0.25, -1.5]), ("h2", [1.0, 2.0])])
+    assert cache.get_many("model-a", ["h1", "h3"]) == {"h1": [0.25, -1.5]}
+    assert cache.get_many("model-b", ["h1"]) == {}
+    cache.close()
+
+    reopened = EmbeddingCache(path)
+    assert reopened.get_many("model-a", ["h2"]) == {"h2": [1.0, 2.0]}
+    assert reopened.stats()['hits'] == 1
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path):
+    vector = [0.0] * 8  # 32 bytes as float32
+    cache = EmbeddingCache(str(tmp_path / "cache.sqlite3"), max_bytes=32 * 3, touch_interval=0)
+    for chunk_hash in ("old", "kept", "new0"):
+        cache.put_many("m", [(chunk_hash, vector)])
+        time.sleep(0.01)
+    cache.get_many("m", ["kept"])
+    time.sleep(0.01)
+    cache.put_many("m", [("new1", vector)])
+
+    remaining = cache.get_many("m", ["old", "kept", "new0", "new1"])
+    assert set(remaining) == {"kept", "new1"}
+    assert cache.stats()['bytes'] <= 32 * 3
+
+
+def test_replacing_entries_does_not_inflate_the_size(tmp_path):
+    vector = [0.0] * 8  # 32 bytes as float32
+    cache = EmbeddingCache(str(tmp_path / "cache.sqlite3"), max_bytes=32 * 3)
+    cache.put_many("m", [("a", vector), ("b", vector)])
+    for _ in range(5):
+        cache.put_many("m", [("a", vector), ("b", vector), ("b", vector)])
+    assert cache.stats()['bytes'] == 64
+    assert set(cache.get_many("m", ["a", "b"])) == {"a", "b"}  # nothing evicted
+    cache.put_many("m", [("a", [0.0] * 4)])
+    assert cache.stats()['bytes'] == 48 == cache._stored_bytes()
+
+
+def test_hits_on_recently_used_entries_do_not_write(tmp_path):
+    cache = EmbeddingCache(str(tmp_path / "cache.sqlite3"))
+    cache.put_many("m", [("h", [1.0])])
+    changes = cache._conn.total_changes
+    for _ in range(100):
+        assert cache.get_many("m", ["h"]) == {"h": [1.0]}
+    assert cache._conn.total_changes == changes
+
+
+def test_last_used_refreshes_are_written_in_batches(tmp_path):
+    path = str(tmp_path / "cache.sqlite3")
+    cache = EmbeddingCache(path, touch_batch=3)
+    cache.put_many("m", [(f"h{i}", [1.0]) for i in range(4)])
+    cache._conn.execute("UPDATE embeddings SET last_used = 0;")
+
+    def stale():
+        return {row[0] for row in cache._conn.execute("SELECT chunk_hash FROM embeddings WHERE last_used = 0;")}
+
+    cache.get_many("m", ["h0", "h1"])
+    assert stale() == {"h0", "h1", "h2", "h3"}  # queued, not written yet
+    cache.get_many("m", ["h2"])
+    assert stale() == {"h3"}  # the batch of three went out together
+    cache.get_many("m", ["h3"])
+    cache.close()
+
+    reopened = EmbeddingCache(path)
+    assert reopened._conn.execute("SELECT COUNT(*) FROM embeddings WHERE last_used = 0;").fetchone() == (0,)
+
+
+def test_cached_embeddings_only_calls_the_api_for_new_texts(tmp_path):
+    backend = CountingEmbeddings()
+    cached = CachedEmbeddings(backend, EmbeddingCache(str(tmp_path / "cache.sqlite3")), "models/test")
+
+    assert cached.embed_documents(["abc", "de"]) == [[3.0, 0.5], [2.0, 0.5]]
+    assert cached.embed_documents(["de", "fghi"]) == [[2.0, 0.5], [4.0, 0.5]]
+    assert backend.document_calls == [["abc", "de"], ["fghi"]]
+
+    # Queries use a different task type upstream, so they never reuse document vectors.
+    assert cached.embed_query("abc") == [3.0, -0.5]
+    assert cached.embed_query("abc") == [3.0, -0.5]
+    assert backend.query_calls == ["abc"]
+
+
+def test_text_hash_matches_chunk_hash():
+    text = "DEFINE VARIABLE x AS INTEGER."
+    assert text_hash(text) == hashlib.sha256(text.encode('utf-8')).hexdigest()
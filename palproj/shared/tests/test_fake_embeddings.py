@@ -0,0 +1,23 @@
+# palproj/shared/tests/test_fake_embeddings.py
+import math
+
+from fake_embeddings import FakeEmbeddings
+
+
+def test_vectors_are_deterministic_normalised_and_sized():
+    embeddings = FakeEmbeddings(dimensions=768)
+    first = embeddings.embed_documents(["PROCEDURE ip-calc-tax :", "FOR EACH customer NO-LOCK:"])
+    again = FakeEmbeddings(dimensions=768).embed_documents(["PROCEDURE ip-calc-tax :", "FOR EACH customer NO-LOCK:"])
+    assert first == again
+    assert all(len(vector) == 768 for vector in first)
+    assert all(math.isclose(sum(v * v for v in vector), 1.0) for vector in first)
+    assert embeddings.calls == 1 and embeddings.texts == 2
+
+
+def test_shared_words_are_closer_than_unrelated_text():
+    embeddings = FakeEmbeddings()
+    query = embeddings.embed_query("calculate the tax on an order")
+    related = embeddings.vector("PROCEDURE calc-tax: calculate tax for the order lines.")
+    unrelated = embeddings.vector("DISPLAY vendor.name WITH FRAME f-vendor.")
+    similarity = lambda a, b: sum(x * y for x, y in zip(a, b))
+    assert similarity(query, related) > similarity(query, unrelated)
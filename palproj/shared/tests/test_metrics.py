@@ -0,0 +1,68 @@
+# palproj/shared/tests/test_metrics.py
+import urllib.request
+
+import pytest
+
+from metrics import CONTENT_TYPE, Registry, serve, write_textfile
+
+
+def test_histogram_renders_cumulative_buckets_sum_and_count():
+    registry = Registry()
+    stages = registry.histogram('stage_seconds', 'Stage time.', ['stage'], buckets=(0.1, 1.0))
+    stages.observe(0.05, stage='llm')
+    stages.observe(0.5, stage='llm')
+    stages.observe(5.0, stage='llm')
+    text = registry.render()
+    assert '# TYPE stage_seconds histogram' in text
+    assert 'stage_seconds_bucket{stage="llm",le="0.1"} 1' in text
+    assert 'stage_seconds_bucket{stage="llm",le="1.0"} 2' in text
+    assert 'stage_seconds_bucket{stage="llm",le="+Inf"} 3' in text
+    assert 'stage_seconds_sum{stage="llm"} 5.55' in text
+    assert 'stage_seconds_count{stage="llm"} 3' in text
+
+
+def test_timer_observes_even_when_the_block_raises():
+    registry = Registry()
+    stages = registry.histogram('stage_seconds', 'Stage time.', ['stage'])
+    with pytest.raises(RuntimeError):
+        with stages.time(stage='vector_search'):
+            raise RuntimeError("vector_db down")
+    assert stages.count(stage='vector_search') == 1
+
+
+def test_counters_gauges_and_label_checks():
+    registry = Registry()
+    errors = registry.counter('errors_total', 'Errors.', ['stage'])
+    depth = registry.gauge('queue_depth', 'Queue depth.')
+    errors.inc(stage='write')
+    errors.inc(2, stage='write')
+    depth.set(7)
+    with pytest.raises(ValueError):
+        errors.inc(step='write')
+    with pytest.raises(ValueError):
+        registry.counter('errors_total', 'Again.')
+    text = registry.render()
+    assert 'errors_total{stage="write"} 3' in text
+    assert 'queue_depth 7' in text
+
+
+def test_label_values_are_escaped():
+    registry = Registry()
+    requests = registry.counter('requests_total', 'Requests.', ['route'])
+    requests.inc(route='/chat/"x"\n')
+    assert 'requests_total{route="/chat/\\"x\\"\\n"} 1' in registry.render()
+
+
+def test_serve_and_textfile(tmp_path):
+    registry = Registry()
+    registry.counter('files_total', 'Files.').inc(3)
+    server = serve(registry, 0, host='127.0.0.1')
+    try:
+        with urllib.request.urlopen(f"http://127.0.0.1:{server.server_port}/metrics") as response:
+            assert response.headers['Content-Type'] == CONTENT_TYPE
+            assert 'files_total 3' in response.read().decode()
+    finally:
+        server.shutdown()
+    path = tmp_path / 'ingest.prom'
+    write_textfile(registry, str(path))
+    assert 'files_total 3' in path.read_text()
@@ -0,0 +1,103 @@
+# palproj/shared/tests/test_openedge_chunker.py
+from openedge_chunker import chunk_openedge_code, extract_references, split_oversized
+
+
+def names(chunks):
+    return [chunk["procedure_name"] for chunk in chunks]
+
+
+def test_end_procedure_inside_comments_and_strings_does_not_end_the_chunk():
+    source = (
+        "DEFINE VARIABLE c AS CHARACTER NO-UNDO.\n"
+        "PROCEDURE ip-one:\n"
+        "  /* old code: END PROCEDURE. /* nested */ still comment */\n"
+        "  c = \"END PROCEDURE.\".\n"
+        "  c = 'it~'s END FUNCTION,'.\n"
+        "END PROCEDURE.\n"
+        "RUN ip-one.\n"
+    )
+    chunks = chunk_openedge_code(source, "a.p")
+    assert names(chunks) == ["FILE_HEADER", "ip-one", "FILE_FOOTER"]
+    assert chunks[1]["chunk_text"].endswith("'it~'s END FUNCTION,'.\nEND PROCEDURE.")
+    assert chunks[2]["chunk_text"] == "RUN ip-one."
+
+
+def test_functions_with_returns_and_forward_declarations():
+    source = (
+        "FUNCTION fn-total RETURNS DECIMAL (INPUT p AS DECIMAL) FORWARD.\n"
+        "h = THIS-PROCEDURE.\n"
+        "FUNCTION fn-total RETURNS DECIMAL (INPUT p AS DECIMAL):\n"
+        "  RETURN p * 2.\n"
+        "END FUNCTION.\n"
+        "PROCEDURE ip-a PRIVATE:\n"
+        "  RUN ip-b IN THIS-PROCEDURE.\n"
+        "END.\n"
+        "PROCEDURE ip-b:\n"
+        "END PROCEDURE.\n"
+    )
+    chunks = chunk_openedge_code(source, "b.p")
+    assert names(chunks) == ["FILE_HEADER", "fn-total", "ip-a", "ip-b"]
+    assert chunks[0]["chunk_text"].endswith("h = THIS-PROCEDURE.")
+    # ip-a closes with a bare END., so it runs up to the next block.
+    assert chunks[2]["chunk_text"].endswith("END.")
+
+
+def test_keywords_are_case_insensitive_and_names_keep_their_case():
+    source = "procedure ip-Mixed:\n  message 'hi'.\nend procedure.\n"
+    assert chunk_openedge_code(source, "c.p") == [
+        {"file_path": "c.p", "procedure_name": "ip-Mixed", "chunk_text": source.strip()}
+    ]
+
+
+def test_appbuilder_preprocessor_lines():
+    source = (
+        "&ANALYZE-SUSPEND _UIB-CODE-BLOCK _PROCEDURE disable_UI Procedure\n"
+        "PROCEDURE disable_UI :\n"
+        "  HIDE FRAME f.\n"
+        "END PROCEDURE.\n"
+        "/* _UIB-CODE-BLOCK-END */\n"
+        "&ANALYZE-RESUME\n"
+    )
+    assert names(chunk_openedge_code(source, "w.w")) == ["FILE_HEADER", "disable_UI", "FILE_FOOTER"]
+
+
+def test_oversized_chunks_are_split_at_line_boundaries():
+    body = "".join(f"  x = x + {i}.\n" for i in range(200))
+    source = f"PROCEDURE ip-big:\n{body}END PROCEDURE.\n"
+    chunks = chunk_openedge_code(source, "big.p", max_chunk_chars=500)
+    assert len(chunks) > 1
+    assert set(names(chunks)) == {"ip-big"}
+    assert all(len(chunk["chunk_text"]) <= 500 for chunk in chunks)
+    assert chunks[-1]["chunk_text"].endswith("END PROCEDURE.")
+
+
+def test_split_oversized_hard_splits_long_lines():
+    assert split_oversized("a" * 25, 10) == ["a" * 10, "a" * 10, "a" * 5]
+    assert split_oversized("short", None) == ["short"]
+
+
+def test_extract_references_finds_runs_includes_and_tables_outside_comments_and_strings():
+    source = (
+        "/* RUN old.p. FOR EACH legacy: */\n"
+        "{us/bbi/mfdeclre.i}\n"
+        "{&PROGRAM-NAME}\n"
+        "DEFINE TEMP-TABLE ttLine NO-UNDO FIELD amt AS DECIMAL.\n"
+        "DEFINE BUFFER bCust FOR Customer.\n"
+        "FOR EACH ttLine, EACH order NO-LOCK: END.\n"
+        "FIND FIRST gltrans WHERE gltrans.ref = \"RUN fake.p\" NO-LOCK NO-ERROR.\n"
+        "IF CAN-FIND(FIRST item WHERE item.x = 1) THEN RUN ip-calc-tax IN hProc (INPUT 1).\n"
+        "RUN prog\\P0001.p (INPUT 1).\n"
+        "RUN VALUE(cProgram).\n"
+        "RUN ip-calc-tax.\n"
+    )
+    assert extract_references(source) == [
+        ("include", "us/bbi/mfdeclre.i"), ("table", "customer"), ("table", "order"), ("table", "gltrans"),
+        ("table", "item"), ("run", "ip-calc-tax"), ("program", "prog/p0001.p"),
+    ]
+
+
+def test_chunks_carry_references_on_request():
+    source = "PROCEDURE ip-a:\n  RUN ip-b.\nEND PROCEDURE.\nPROCEDURE ip-b:\n  FIND customer.\nEND PROCEDURE.\n"
+    assert "references" not in chunk_openedge_code(source, "x.p")[0]
+    chunks = chunk_openedge_code(source, "x.p", references=True)
+    assert [chunk["references"] for chunk in chunks] == [[("run", "ip-b")], [("table", "customer")]]